@@ -0,0 +1,108 @@
+import logging
+from threading import Event, Lock, Thread
+from typing import Callable, Dict, Optional
+
+from data.appdata.functions import stop_program
+
+
+class BalanceMonitor:
+    """Баланс CapGuru без запроса перед каждой капчей.
+
+    Баланс обновляется в фоне раз в interval секунд, между обновлениями
+    из него вычитается известная стоимость отправленных капч. Запрос к
+    сервису на пути решения капчи делается только когда оценка опустилась
+    до критического значения.
+    """
+
+    def __init__(self, get_balance: Callable[[], float], interval: int = 60, warning: float = 5,
+                 critical: float = 0, image_cost: float = 0.05, recaptcha_cost: float = 0.2):
+        """
+        :param get_balance: Функция запроса баланса у сервиса.
+        :param interval: Время между фоновыми обновлениями баланса.
+        :param warning: Баланс, при котором пишется предупреждение.
+        :param critical: Баланс, при котором решение капч останавливается.
+        :param image_cost: Стоимость текстовой капчи.
+        :param recaptcha_cost: Стоимость рекапчи.
+        """
+        self._get_balance = get_balance
+        self.interval = interval
+        self.warning = warning
+        self.critical = critical
+        self.image_cost = image_cost
+        self.recaptcha_cost = recaptcha_cost
+        self._estimate: Optional[float] = None
+        self._lock = Lock()
+        self._stop = Event()
+        self._thread: Optional[Thread] = None
+
+    @property
+    def estimate(self) -> Optional[float]:
+        """Текущая оценка баланса (None - баланс ещё не получен)"""
+        return self._estimate
+
+    def refresh(self) -> float:
+        """Запрос баланса у сервиса и сброс оценки"""
+        balance = self._get_balance()
+        with self._lock:
+            self._estimate = balance
+        return balance
+
+    def _run(self) -> None:
+        """Фоновое обновление баланса"""
+        while not self._stop.wait(self.interval):
+            try: self.refresh()
+            except Exception:
+                logging.warning("Balance wasn't refreshed - Cap Guru", exc_info=True)
+
+    def start(self) -> None:
+        """Запуск фонового обновления"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = Thread(target=self._run, name="balance-monitor", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        """Остановка фонового обновления"""
+        self._stop.set()
+
+    def charge(self, cost: float) -> None:
+        """Уменьшение оценки баланса на стоимость отправленной капчи"""
+        with self._lock:
+            if self._estimate is not None:
+                self._estimate -= cost
+
+    def check(self) -> None:
+        """Проверка баланса перед решением капчи
+
+        Блокирует только при первом вызове и когда оценка дошла до критического значения.
+        """
+        estimate = self._estimate
+        if estimate is None or estimate <= self.critical:
+            estimate = self.refresh()
+        if estimate < self.warning:
+            logging.warning("Running out of balance - Cap Guru")
+        if estimate <= self.critical:
+            logging.critical("Out of balance - Cap Guru")
+            stop_program("Out of balance - Cap Guru")
+
+
+_monitors: Dict[str, BalanceMonitor] = {}
+_monitors_lock = Lock()
+
+
+def get_balance_monitor(key: str, get_balance: Callable[[], float], interval: int = 60) -> BalanceMonitor:
+    """Получение общего монитора баланса для ключа CapGuru
+
+    :param key: Ключ CapGuru.
+    :param get_balance: Функция запроса баланса, используется при первом вызове.
+    :param interval: Время между фоновыми обновлениями, используется при первом вызове.
+    """
+    with _monitors_lock:
+        monitor = _monitors.get(key)
+        if monitor is None:
+            monitor = BalanceMonitor(get_balance, interval)
+            monitor.start()
+            _monitors[key] = monitor
+        return monitor
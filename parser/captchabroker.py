@@ -0,0 +1,182 @@
+import logging
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from threading import Condition, Lock, Thread
+from typing import Dict, List, Optional
+
+import requests
+
+from data.appdata.httpsession import HttpOptions, get_http_session
+from data.appdata.solvetime import CaptchaTypes, SolveTimeEstimator, get_estimator
+
+
+def parse_multi_get(text: str, ids: List[str]) -> Optional[Dict[str, str]]:
+    """Разбор ответа на запрос результатов нескольких капч (action=get&ids=...)
+
+    Ответ - результаты через '|' в порядке id: решение, CAPCHA_NOT_READY или ERROR_...
+    Ответ на запрос одного id (OK|решение) тоже делится на части, поэтому
+    часть OK или пустая часть означает, что сервис ответил не в этом формате.
+
+    :param text: Текст ответа.
+    :param ids: id капч из запроса.
+    :return: Ответ для каждого id в формате запроса одного id. None - Если формат ответа другой.
+    """
+    answers = text.split('|')
+    if len(answers) != len(ids) or any(len(answer) == 0 or answer == 'OK' for answer in answers):
+        return None
+    return {req_id: answer if answer == 'CAPCHA_NOT_READY' or answer.startswith('ERROR') else f"OK|{answer}"
+            for req_id, answer in zip(ids, answers)}
+
+
+@dataclass
+class _Pending:
+    """Капча, ожидающая решения"""
+    future: Future
+    estimator: SolveTimeEstimator
+    start: float
+    deadline: float
+    next_poll: float = field(default=0)
+
+
+class CaptchaBroker:
+    """Общее для процесса ожидание решений капч CapGuru.
+
+    Решатели всех парсеров регистрируют id отправленных капч, один поток
+    опрашивает все готовые к проверке id одним запросом (action=get&ids=...)
+    и передаёт результаты ожидающим. Если сервис не поддерживает запрос
+    нескольких id, они опрашиваются по одному в том же потоке.
+    """
+
+    def __init__(self, key: str, session: requests.Session, http_options: HttpOptions = HttpOptions(),
+                 batch_size: int = 50, window: float = 0.5):
+        """
+        :param key: Ключ CapGuru.
+        :param session: HTTP сессия для запросов.
+        :param http_options: Настройки HTTP клиента (таймауты).
+        :param batch_size: Максимальное количество id в одном запросе.
+        :param window: Капчи, чей опрос наступит в пределах этого времени, опрашиваются вместе.
+        """
+        self.key = key
+        self.batch_size = batch_size
+        self.window = window
+        self.multi_get = True
+        self._session = session
+        self._timeout = http_options.timeout
+        self._pending: Dict[str, _Pending] = {}
+        self._condition = Condition()
+        self._thread = Thread(target=self._run, name="captcha-broker", daemon=True)
+        self._thread.start()
+
+    def wait(self, req_id: str, captcha_type: CaptchaTypes = CaptchaTypes.Image, deadline: float = 120) -> Future:
+        """Регистрация отправленной капчи
+
+        :param req_id: id капчи в CapGuru.
+        :param captcha_type: Тип капчи (для выбора времени опроса).
+        :param deadline: Время, отведённое на решение.
+        :return: Future с решением капчи. '-1' - Если капча не решена.
+        """
+        estimator = get_estimator(captcha_type)
+        now = time.monotonic()
+        pending = _Pending(Future(), estimator, now, now + deadline, now + min(estimator.first_poll(), deadline))
+        with self._condition:
+            self._pending[req_id] = pending
+            self._condition.notify()
+        return pending.future
+
+    def _due(self) -> Optional[List[str]]:
+        """Выбор id для опроса (вызывается под блокировкой)
+
+        :return: Список id или None, если опрашивать пока нечего.
+        """
+        if not self._pending:
+            return None
+        now = time.monotonic()
+        due = [req_id for req_id, pending in self._pending.items() if pending.next_poll <= now + self.window]
+        if not any(self._pending[req_id].next_poll <= now for req_id in due):
+            return None
+        return due
+
+    def _run(self) -> None:
+        """Цикл опроса всех ожидающих капч"""
+        while True:
+            with self._condition:
+                due = self._due()
+                while due is None:
+                    if self._pending:
+                        timeout = min(pending.next_poll for pending in self._pending.values()) - time.monotonic()
+                        self._condition.wait(max(timeout, 0))
+                    else:
+                        self._condition.wait()
+                    due = self._due()
+            for i in range(0, len(due), self.batch_size):
+                try:
+                    answers = self._poll(due[i:i + self.batch_size])
+                except Exception:
+                    logging.warning("Cap Guru results weren't received", exc_info=True)
+                    answers = {}
+                self._dispatch(due[i:i + self.batch_size], answers)
+
+    def _poll(self, ids: List[str]) -> Dict[str, str]:
+        """Запрос результатов капч
+
+        :param ids: id капч.
+        :return: Ответ сервиса для каждого id.
+        """
+        if self.multi_get and len(ids) > 1:
+            res = self._session.get(f"https://api.cap.guru/res.php?key={self.key}&action=get&ids={','.join(ids)}",
+                                    timeout=self._timeout)
+            answers = parse_multi_get(res.text, ids) if res.ok else None
+            if answers is not None:
+                return answers
+            logging.warning(f"Cap Guru doesn't support multi id results: {res.text}")
+            self.multi_get = False
+        answers = {}
+        for req_id in ids:
+            answers[req_id] = self._session.get(f"https://api.cap.guru/res.php?key={self.key}&action=get&id={req_id}",
+                                                timeout=self._timeout).text
+        return answers
+
+    def _dispatch(self, ids: List[str], answers: Dict[str, str]) -> None:
+        """Передача результатов ожидающим и планирование следующего опроса"""
+        now = time.monotonic()
+        with self._condition:
+            for req_id in ids:
+                pending = self._pending.get(req_id)
+                if pending is None:
+                    continue
+                answer = answers.get(req_id, 'CAPCHA_NOT_READY')
+                elapsed = now - pending.start
+                if answer.find('ERROR') > -1:
+                    logging.error(f"The captcha {req_id} was not solved: {answer}")
+                    result = '-1'
+                elif answer.find('OK') > -1:
+                    result = answer[answer.find('|') + 1:]
+                    pending.estimator.observe(elapsed)
+                    logging.debug(f"The captcha {req_id} is ready in {elapsed:.1f} s: {result}")
+                elif now >= pending.deadline:
+                    logging.error(f"The captcha {req_id} wasn't solved in {pending.deadline - pending.start:.0f} s")
+                    result = '-1'
+                else:
+                    pending.next_poll = min(now + pending.estimator.interval(elapsed), pending.deadline)
+                    continue
+                del self._pending[req_id]
+                pending.future.set_result(result)
+
+
+_brokers: Dict[str, CaptchaBroker] = {}
+_brokers_lock = Lock()
+
+
+def get_captcha_broker(key: str, http_options: HttpOptions = HttpOptions()) -> CaptchaBroker:
+    """Получение общего для процесса брокера капч для ключа CapGuru
+
+    :param key: Ключ CapGuru.
+    :param http_options: Настройки HTTP клиента, используются при первом вызове.
+    """
+    with _brokers_lock:
+        broker = _brokers.get(key)
+        if broker is None:
+            broker = CaptchaBroker(key, get_http_session(http_options), http_options)
+            _brokers[key] = broker
+        return broker
@@ -0,0 +1,17 @@
+# Нормализация номеров без зависимостей: модуль импортируют и парсер, и модели сайта
+
+# Буквы госномера, которые пишут и латиницей, и кириллицей
+_PLATE_LETTERS = str.maketrans("ABEKMHOPCTYX", "АВЕКМНОРСТУХ")
+_VIN_LETTERS = str.maketrans("АВЕКМНОРСТУХ", "ABEKMHOPCTYX")
+
+
+def normalize_number(number: str) -> str:
+    """Приведение vin номера или госномера к одному виду
+
+    :param number: vin номер или госномер в любом регистре, с пробелами и дефисами.
+    :return: vin номер латиницей или госномер кириллицей в верхнем регистре.
+    """
+    number = ''.join(number.split()).replace('-', '').upper()
+    if len(number) == 17:
+        return number.translate(_VIN_LETTERS)
+    return number.translate(_PLATE_LETTERS)
@@ -0,0 +1,329 @@
+import logging
+import time
+from collections import deque
+from contextlib import contextmanager
+from functools import partial
+from dataclasses import dataclass, field
+from threading import Condition, Event, Lock, Thread
+from typing import Callable, Deque, Dict, Iterator, Optional
+
+from selenium import webdriver
+from selenium.webdriver.firefox.options import Options
+
+
+@dataclass(frozen=True)
+class BrowserProfile:
+    """Настройки браузера.
+
+    headless: Запуск без окна.
+    block_trackers: Блокировка рекламы и аналитики (защита от отслеживания Firefox).
+    block_fonts: Запрет загрузки шрифтов сайтов.
+    same_origin_images: Загружать только картинки с домена сайта (капча и результаты), без сторонних.
+    window_width: Ширина окна.
+    window_height: Высота окна.
+    page_load_strategy: Когда driver.get возвращает управление (normal, eager, none).
+    """
+    headless: bool = False
+    block_trackers: bool = False
+    block_fonts: bool = False
+    same_origin_images: bool = False
+    window_width: int = 1366
+    window_height: int = 768
+    page_load_strategy: str = "normal"
+
+
+# Профиль для сервера: без окна и лишних ресурсов, меньше памяти на браузер
+PRODUCTION_PROFILE = BrowserProfile(headless=True, block_trackers=True, block_fonts=True, same_origin_images=True,
+                                    window_width=1024, window_height=768, page_load_strategy="eager")
+
+
+def create_firefox(profile: BrowserProfile = BrowserProfile()) -> webdriver.Firefox:
+    """Создание нового веб-драйвера Firefox
+
+    :param profile: Настройки браузера.
+    """
+    options = Options()
+    if profile.headless:
+        options.add_argument('--headless')
+    options.add_argument('--disable-audio')
+    options.add_argument('--mute-audio')
+    options.add_argument(f'--width={profile.window_width}')
+    options.add_argument(f'--height={profile.window_height}')
+    options.page_load_strategy = profile.page_load_strategy
+    if profile.block_trackers:
+        # Реклама мешает парсингу страницы ГИБДД и замедляет загрузку
+        options.set_preference("browser.contentblocking.category", "strict")
+        options.set_preference("privacy.trackingprotection.enabled", True)
+        options.set_preference("privacy.trackingprotection.socialtracking.enabled", True)
+        options.set_preference("privacy.trackingprotection.cryptomining.enabled", True)
+        options.set_preference("privacy.trackingprotection.fingerprinting.enabled", True)
+    if profile.block_fonts:
+        options.set_preference("gfx.downloadable_fonts.enabled", False)
+        options.set_preference("browser.display.use_document_fonts", 0)
+    if profile.same_origin_images:
+        # 3 - картинки только с домена страницы
+        options.set_preference("permissions.default.image", 3)
+    options.set_preference("media.autoplay.default", 5)
+    driver = webdriver.Firefox(options=options)
+    # Неявное ожидание выключено: элементы ждутся явно (waits.wait_until),
+    # иначе каждая неудачная проверка условия блокируется на время неявного ожидания
+    driver.implicitly_wait(0)
+    return driver
+
+
+@dataclass
+class DriverPoolOptions:
+    """Настройки пула веб-драйверов.
+
+    min_size: Количество драйверов, которые держатся запущенными всегда.
+    max_size: Максимальное количество одновременно запущенных драйверов.
+    max_uses: Количество выдач драйвера, после которого он перезапускается.
+    idle_timeout: Время (с), после которого простаивающий драйвер закрывается.
+    lease_timeout: Время (с) ожидания свободного драйвера.
+    reap_interval: Время (с) между фоновыми проверками простаивающих драйверов.
+    """
+    min_size: int = 1
+    max_size: int = 3
+    max_uses: int = 20
+    idle_timeout: int = 300
+    lease_timeout: int = 600
+    reap_interval: float = 60
+
+
+@dataclass
+class _PooledDriver:
+    """Драйвер из пула и его статистика"""
+    driver: webdriver.Firefox
+    uses: int = 0
+    created: float = field(default_factory=time.monotonic)
+    last_used: float = field(default_factory=time.monotonic)
+
+
+class DriverPool:
+    """Пул запущенных веб-драйверов.
+
+    Драйверы выдаются через acquire/lease и возвращаются через release,
+    между выдачами очищаются cookies и хранилища страницы. Простаивающие
+    драйверы сверх min_size закрываются фоновым потоком до вызова close.
+    """
+
+    def __init__(self, options: DriverPoolOptions = DriverPoolOptions(),
+                 factory: Callable[[], webdriver.Firefox] = create_firefox):
+        """
+        :param options: Настройки пула.
+        :param factory: Функция создания нового драйвера.
+        """
+        if options.max_size < 1 or options.min_size > options.max_size:
+            raise ValueError("Incorrect driver pool size")
+        self.options = options
+        self._factory = factory
+        self._idle: Deque[_PooledDriver] = deque()
+        self._leased: Dict[int, _PooledDriver] = {}
+        self._size = 0
+        self._closed = False
+        self._condition = Condition()
+        self._stop = Event()
+        self._reaper = Thread(target=self._reap, name="driver-pool-reaper", daemon=True)
+        self._reaper.start()
+
+    @property
+    def size(self) -> int:
+        """Количество запущенных драйверов"""
+        return self._size
+
+    def warm_up(self) -> None:
+        """Запуск драйверов до минимального размера пула"""
+        with self._condition:
+            count = self.options.min_size - self._size
+            self._size += max(count, 0)
+        for _ in range(count):
+            try:
+                pooled = _PooledDriver(self._factory())
+            except Exception:
+                logging.error("Error while driver start", exc_info=True)
+                with self._condition:
+                    self._size -= 1
+                continue
+            with self._condition:
+                self._idle.append(pooled)
+                self._condition.notify()
+        logging.info(f"Driver pool was warmed up: {self._size} drivers")
+
+    def _quit(self, pooled: _PooledDriver) -> None:
+        """Закрытие драйвера (вызывается без блокировки)"""
+        try: pooled.driver.quit()
+        except Exception:
+            logging.info("Error closing driver:", exc_info=True)
+
+    def _evict_idle(self) -> list:
+        """Выбор простаивающих драйверов для закрытия (вызывается под блокировкой)"""
+        evicted = []
+        now = time.monotonic()
+        while self._idle and self._size > self.options.min_size:
+            if now - self._idle[0].last_used < self.options.idle_timeout:
+                break
+            evicted.append(self._idle.popleft())
+            self._size -= 1
+        return evicted
+
+    def evict_idle(self) -> int:
+        """Закрытие драйверов, простаивающих дольше idle_timeout
+
+        :return: Количество закрытых драйверов.
+        """
+        with self._condition:
+            evicted = self._evict_idle()
+        for pooled in evicted:
+            self._quit(pooled)
+        return len(evicted)
+
+    def _reap(self) -> None:
+        """Фоновое закрытие простаивающих драйверов"""
+        while not self._stop.wait(self.options.reap_interval):
+            try:
+                count = self.evict_idle()
+            except Exception:
+                logging.error("Error while evicting idle drivers", exc_info=True)
+                continue
+            if count:
+                logging.debug(f"{count} idle drivers were closed")
+
+    def _is_alive(self, pooled: _PooledDriver) -> bool:
+        """Проверка, что браузер ещё отвечает"""
+        try:
+            pooled.driver.execute_script("return 1;")
+            return True
+        except Exception:
+            logging.warning("Driver from the pool is not responding", exc_info=True)
+            return False
+
+    def acquire(self, timeout: Optional[float] = None) -> webdriver.Firefox:
+        """Получение драйвера из пула.
+
+        :param timeout: Время ожидания свободного драйвера.
+        :return: Веб-драйвер.
+        """
+        timeout = self.options.lease_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._condition:
+                if self._closed:
+                    raise RuntimeError("Driver pool is closed")
+                evicted = self._evict_idle()
+                pooled = None
+                create = False
+                if self._idle:
+                    pooled = self._idle.pop()
+                elif self._size < self.options.max_size:
+                    self._size += 1
+                    create = True
+                elif not evicted:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise TimeoutError("There is no free driver in the pool")
+                    self._condition.wait(remaining)
+                    continue
+            for item in evicted:
+                self._quit(item)
+            if create:
+                try:
+                    pooled = _PooledDriver(self._factory())
+                except Exception:
+                    with self._condition:
+                        self._size -= 1
+                        self._condition.notify()
+                    raise
+            if pooled is None:
+                continue
+            if not create and not self._is_alive(pooled):
+                self._discard(pooled)
+                continue
+            pooled.uses += 1
+            with self._condition:
+                self._leased[id(pooled.driver)] = pooled
+            return pooled.driver
+
+    def _discard(self, pooled: _PooledDriver) -> None:
+        """Закрытие драйвера и освобождение места в пуле"""
+        self._quit(pooled)
+        with self._condition:
+            self._size -= 1
+            self._condition.notify()
+
+    def _reset(self, driver: webdriver.Firefox) -> bool:
+        """Очистка состояния браузера между выдачами
+
+        :return: Удалось ли очистить состояние.
+        """
+        try:
+            driver.delete_all_cookies()
+            driver.execute_script("window.localStorage.clear(); window.sessionStorage.clear();")
+            driver.get("about:blank")
+            return True
+        except Exception:
+            logging.warning("Driver state wasn't reset", exc_info=True)
+            return False
+
+    def release(self, driver: webdriver.Firefox) -> None:
+        """Возврат драйвера в пул
+
+        :param driver: Драйвер, полученный через acquire.
+        """
+        with self._condition:
+            pooled = self._leased.pop(id(driver), None)
+        if pooled is None:
+            logging.error("Driver doesn't belong to the pool")
+            return
+        if self._closed or pooled.uses >= self.options.max_uses or not self._reset(driver):
+            logging.debug(f"Driver was recycled after {pooled.uses} uses")
+            self._discard(pooled)
+            return
+        pooled.last_used = time.monotonic()
+        with self._condition:
+            self._idle.append(pooled)
+            self._condition.notify()
+
+    @contextmanager
+    def lease(self, timeout: Optional[float] = None) -> Iterator[webdriver.Firefox]:
+        """Получение драйвера на время блока with"""
+        driver = self.acquire(timeout)
+        try:
+            yield driver
+        finally:
+            self.release(driver)
+
+    def close(self) -> None:
+        """Закрытие всех свободных драйверов, выданные закроются при возврате"""
+        self._stop.set()
+        with self._condition:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._size -= len(idle)
+            self._condition.notify_all()
+        for pooled in idle:
+            self._quit(pooled)
+        logging.info("Driver pool was closed")
+
+
+_shared_pool: Optional[DriverPool] = None
+_shared_profile: Optional[BrowserProfile] = None
+_shared_lock = Lock()
+
+
+def get_driver_pool(options: DriverPoolOptions = DriverPoolOptions(),
+                    profile: BrowserProfile = PRODUCTION_PROFILE) -> DriverPool:
+    """Получение общего для процесса пула драйверов (бот и сайт)
+
+    :param options: Настройки пула, используются только при первом вызове.
+    :param profile: Настройки браузеров пула, используются только при первом вызове.
+    """
+    global _shared_pool, _shared_profile
+    with _shared_lock:
+        if _shared_pool is None or _shared_pool._closed:
+            _shared_pool = DriverPool(options, partial(create_firefox, profile))
+            _shared_profile = profile
+        elif options != _shared_pool.options or profile != _shared_profile:
+            logging.warning(f"Driver pool already exists with other settings: {_shared_pool.options}, "
+                            f"{_shared_profile}. Requested {options}, {profile} are ignored")
+        return _shared_pool
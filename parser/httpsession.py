@@ -0,0 +1,67 @@
+from dataclasses import dataclass
+from threading import Lock
+from typing import Dict, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+@dataclass(frozen=True)
+class HttpOptions:
+    """Настройки HTTP клиента.
+
+    pool_size: Количество keep-alive соединений к одному хосту.
+    connect_timeout: Время на установку соединения.
+    read_timeout: Время ожидания ответа.
+    retries: Количество повторов при ошибках соединения.
+    backoff: Коэффициент паузы между повторами (0.5, 1, 2... с).
+    """
+    pool_size: int = 10
+    connect_timeout: float = 5
+    read_timeout: float = 30
+    retries: int = 3
+    backoff: float = 0.5
+
+    @property
+    def timeout(self) -> Tuple[float, float]:
+        """Таймауты в формате requests"""
+        return self.connect_timeout, self.read_timeout
+
+
+def create_http_session(options: HttpOptions = HttpOptions(), submit: bool = False) -> requests.Session:
+    """Создание сессии с пулом соединений и повторами при ошибках соединения
+
+    POST запросы повторяются только если соединение не было установлено,
+    чтобы не отправить капчу дважды.
+
+    :param options: Настройки HTTP клиента.
+    :param submit: Сессия для отправки капч: любые запросы (и GET) повторяются только
+        если соединение не было установлено, после отправки запроса повторов нет.
+    """
+    read = 0 if submit else options.retries
+    retry = Retry(total=options.retries, connect=options.retries, read=read, other=0 if submit else None,
+                  status=0, backoff_factor=options.backoff, raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=options.pool_size, pool_maxsize=options.pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+_sessions: Dict[Tuple[HttpOptions, bool], requests.Session] = {}
+_sessions_lock = Lock()
+
+
+def get_http_session(options: HttpOptions = HttpOptions(), submit: bool = False) -> requests.Session:
+    """Получение общей для процесса сессии с указанными настройками
+
+    :param options: Настройки HTTP клиента.
+    :param submit: Сессия для отправки капч (без повторов после отправки запроса).
+    """
+    with _sessions_lock:
+        session = _sessions.get((options, submit))
+        if session is None:
+            session = create_http_session(options, submit)
+            _sessions[(options, submit)] = session
+        return session
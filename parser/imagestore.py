@@ -0,0 +1,168 @@
+import hashlib
+import logging
+import os
+from io import BytesIO
+from threading import Lock, get_ident
+from typing import Optional
+
+from PIL import Image, features
+
+# Папка картинок дтп общая для бота и сайта: задаётся переменной окружения CARSCAN_IMAGES_DIR,
+# по умолчанию data/images рядом с этим пакетом (data/appdata), а не от рабочей папки процесса
+IMAGES_DIR = os.environ.get("CARSCAN_IMAGES_DIR",
+                            os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "images"))
+# Папка отладочных скриншотов
+SCREENSHOTS_DIR = "data/img"
+
+
+class ImageStore:
+    """Хранилище картинок с именами по содержимому.
+
+    Картинка сжимается в WebP (или оптимизированный PNG, если WebP недоступен)
+    и сохраняется как <root>/<ab>/<hash>.<ext>, одинаковые картинки (повторная
+    проверка той же машины) хранятся одним файлом.
+    """
+
+    def __init__(self, root: str = IMAGES_DIR, quality: int = 80):
+        """
+        :param root: Папка хранилища.
+        :param quality: Качество WebP.
+        """
+        self.root = root
+        self.quality = quality
+        self.webp = features.check("webp")
+
+    def _encode(self, img: Image.Image) -> bytes:
+        """Сжатие картинки"""
+        buffer = BytesIO()
+        if self.webp:
+            img.save(buffer, "WEBP", quality=self.quality, method=4)
+        else:
+            img.save(buffer, "PNG", optimize=True)
+        return buffer.getvalue()
+
+    def save(self, img: Image.Image) -> str:
+        """Сохранение картинки
+
+        :param img: Картинка.
+        :return: Ключ картинки (путь относительно папки хранилища).
+        """
+        # Хэш по пикселям, чтобы не зависеть от настроек сжатия
+        digest = hashlib.sha1(img.mode.encode() + str(img.size).encode() + img.tobytes()).hexdigest()
+        key = f"{digest[:2]}/{digest}.{'webp' if self.webp else 'png'}"
+        path = os.path.join(self.root, key)
+        if not os.path.isfile(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Запись во временный файл, чтобы параллельная проверка не прочла недописанную картинку
+            tmp_path = f"{path}.{os.getpid()}.{get_ident()}.tmp"
+            with open(tmp_path, "wb") as file:
+                file.write(self._encode(img))
+            os.replace(tmp_path, path)
+        return key
+
+    def resolve(self, key: Optional[str]) -> Optional[str]:
+        """Путь к файлу картинки
+
+        :param key: Ключ из save или путь к файлу из старых версий.
+        :return: Путь к файлу. None - Если файла нет.
+        """
+        if key is None:
+            return None
+        for path in [os.path.join(self.root, key), key]:
+            if os.path.isfile(path):
+                return path
+        return None
+
+
+class ScreenshotStore:
+    """Отладочные скриншоты с ограничением общего размера.
+
+    При превышении max_bytes удаляются самые старые скриншоты.
+    """
+
+    def __init__(self, root: str = SCREENSHOTS_DIR, max_bytes: int = 200 * 1024 * 1024, quality: int = 60):
+        """
+        :param root: Папка скриншотов.
+        :param max_bytes: Максимальный размер папки.
+        :param quality: Качество WebP.
+        """
+        self.root = root
+        self.max_bytes = max_bytes
+        self.quality = quality
+        self.webp = features.check("webp")
+        self._lock = Lock()
+        self._size: Optional[int] = None
+
+    def _files(self) -> list:
+        """Скриншоты от старых к новым"""
+        files = [os.path.join(self.root, name) for name in os.listdir(self.root)]
+        return sorted((path for path in files if os.path.isfile(path)), key=os.path.getmtime)
+
+    def _enforce(self) -> None:
+        """Удаление старых скриншотов сверх лимита (вызывается под блокировкой)"""
+        if self._size is None:
+            self._size = sum(os.path.getsize(path) for path in self._files())
+        if self._size <= self.max_bytes:
+            return
+        for path in self._files():
+            if self._size <= self.max_bytes:
+                break
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+                self._size -= size
+            except OSError:
+                logging.debug(f"Screenshot {path} wasn't removed", exc_info=True)
+
+    def save(self, png: bytes, name: str) -> str:
+        """Сохранение скриншота
+
+        :param png: Скриншот в формате PNG.
+        :param name: Название скриншота.
+        :return: Путь к файлу.
+        """
+        os.makedirs(self.root, exist_ok=True)
+        if self.webp:
+            path = os.path.join(self.root, f"{name}.webp")
+            buffer = BytesIO()
+            Image.open(BytesIO(png)).save(buffer, "WEBP", quality=self.quality)
+            data = buffer.getvalue()
+        else:
+            path = os.path.join(self.root, f"{name}.png")
+            data = png
+        with self._lock:
+            old_size = os.path.getsize(path) if os.path.isfile(path) else 0
+            with open(path, "wb") as file:
+                file.write(data)
+            if self._size is not None:
+                self._size += len(data) - old_size
+            self._enforce()
+        return path
+
+
+_image_store: Optional[ImageStore] = None
+_screenshot_store: Optional[ScreenshotStore] = None
+_stores_lock = Lock()
+
+
+def get_image_store() -> ImageStore:
+    """Общее хранилище картинок дтп"""
+    global _image_store
+    with _stores_lock:
+        if _image_store is None:
+            _image_store = ImageStore()
+        return _image_store
+
+
+def get_screenshot_store() -> ScreenshotStore:
+    """Общее хранилище отладочных скриншотов"""
+    global _screenshot_store
+    with _stores_lock:
+        if _screenshot_store is None:
+            _screenshot_store = ScreenshotStore()
+        return _screenshot_store
+
+
+def resolve_image_path(key: Optional[str]) -> Optional[str]:
+    """Путь к файлу картинки дтп по значению Accident.img_path"""
+    return get_image_store().resolve(key)
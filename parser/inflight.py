@@ -0,0 +1,65 @@
+import logging
+from concurrent.futures import Future
+from threading import Lock
+from typing import Any, Callable, Dict, Optional
+
+
+class InflightRegistry:
+    """Реестр выполняющихся проверок.
+
+    Первый запрос с ключом выполняет работу, запросы с тем же ключом,
+    пришедшие до её окончания, ждут и получают тот же результат (или ту же ошибку).
+    Запросы объединяются только внутри процесса: бот и сайт - разные процессы,
+    одну машину они могут проверять одновременно (результаты объединит кэш).
+    """
+
+    def __init__(self):
+        self._futures: Dict[str, Future] = {}
+        self._lock = Lock()
+
+    def running(self, key: str) -> bool:
+        """Выполняется ли сейчас работа с ключом"""
+        with self._lock:
+            return key in self._futures
+
+    def run(self, key: str, func: Callable[..., Any], *args) -> Any:
+        """Выполнение работы или присоединение к уже запущенной
+
+        :param key: Ключ работы (например, нормализованный номер автомобиля).
+        :param func: Функция, выполняемая первым запросом.
+        :param args: Аргументы функции.
+        :return: Результат функции.
+        """
+        with self._lock:
+            future = self._futures.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._futures[key] = future
+        if not leader:
+            logging.info(f"Scan {key} is already running, waiting for its result")
+            return future.result()
+        try:
+            result = func(*args)
+        except BaseException as err:
+            future.set_exception(err)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._futures[key]
+
+
+_registry: Optional[InflightRegistry] = None
+_registry_lock = Lock()
+
+
+def get_inflight_registry() -> InflightRegistry:
+    """Общий для процесса реестр проверок (бота или сайта)"""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = InflightRegistry()
+        return _registry
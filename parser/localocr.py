@@ -0,0 +1,245 @@
+import hashlib
+import json
+import logging
+import os
+from io import BytesIO
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+
+from PIL import Image
+
+# Папка с решёнными капчами и моделями
+CAPTCHA_DIR = "data/captcha"
+
+
+class CaptchaCollector:
+    """Сохранение решённых сервисом капч для обучения локального распознавания.
+
+    Ответ сервиса может оказаться неверным, поэтому капча сначала откладывается
+    (hold) и сохраняется только после того, как сайт принял ответ (commit).
+    """
+
+    def __init__(self, root: str = CAPTCHA_DIR):
+        """
+        :param root: Папка для капч, внутри - папка на каждый тип капчи.
+        """
+        self.root = root
+        self._held: Dict[str, Tuple[bytes, str]] = {}
+        self._lock = Lock()
+
+    def hold(self, img_bytes: bytes, answer: str, kind: str) -> None:
+        """Откладывание капчи до проверки ответа сайтом (последняя капча каждого типа)
+
+        :param img_bytes: Картинка капчи.
+        :param answer: Решение капчи.
+        :param kind: Тип капчи (vin2vin, gibdd).
+        """
+        with self._lock:
+            self._held[kind] = (img_bytes, answer)
+
+    def commit(self, kind: str) -> Optional[str]:
+        """Сохранение отложенной капчи: сайт принял ответ
+
+        :param kind: Тип капчи (vin2vin, gibdd).
+        :return: Путь к файлу. None - Если капчи нет или она не сохранена.
+        """
+        with self._lock:
+            held = self._held.pop(kind, None)
+        if held is None:
+            return None
+        return self.save(held[0], held[1], kind)
+
+    def discard(self, kind: str) -> None:
+        """Удаление отложенной капчи: сайт не принял ответ или он не проверен
+
+        :param kind: Тип капчи (vin2vin, gibdd).
+        """
+        with self._lock:
+            self._held.pop(kind, None)
+
+    def save(self, img_bytes: bytes, answer: str, kind: str) -> Optional[str]:
+        """Сохранение капчи с ответом в имени файла
+
+        :param img_bytes: Картинка капчи.
+        :param answer: Решение капчи.
+        :param kind: Тип капчи (vin2vin, gibdd).
+        :return: Путь к файлу. None - Если ответ нельзя использовать как подпись.
+        """
+        if not answer.isalnum():
+            return None
+        folder = os.path.join(self.root, kind)
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, f"{answer}_{hashlib.sha1(img_bytes).hexdigest()[:12]}.png")
+        try:
+            Image.open(BytesIO(img_bytes)).save(path)
+        except Exception:
+            logging.warning("Captcha sample wasn't saved", exc_info=True)
+            return None
+        return path
+
+
+class GlyphOcr:
+    """Распознавание текстовых капч на процессоре без внешних библиотек.
+
+    Картинка бинаризуется и делится на символы по пустым столбцам, каждый символ
+    приводится к маске size и сравнивается с масками символов из решённых капч
+    (ближайший сосед по расстоянию Хэмминга). На символ хранится не больше
+    max_templates разных масок, сравнение идёт по маскам-числам через xor.
+    """
+    size: Tuple[int, int] = (12, 16)
+    max_templates: int = 20
+
+    def __init__(self, templates: Dict[str, List[str]] = None):
+        """
+        :param templates: Маски символов: символ -> список масок строкой из 0 и 1.
+        """
+        self.templates: Dict[str, List[str]] = {}
+        self._masks: List[Tuple[str, int]] = []
+        for char, masks in (templates or {}).items():
+            for mask in masks:
+                self._add(char, mask)
+
+    def _add(self, char: str, mask: str) -> bool:
+        """Добавление маски символа (повторы и маски сверх max_templates пропускаются)
+
+        :return: Была ли маска добавлена.
+        """
+        masks = self.templates.setdefault(char, [])
+        if mask in masks or len(masks) >= self.max_templates:
+            return False
+        masks.append(mask)
+        self._masks.append((char, int(mask, 2)))
+        return True
+
+    @classmethod
+    def _segment(cls, img: Image.Image) -> List[str]:
+        """Разбиение капчи на маски символов"""
+        gray = img.convert("L")
+        pixels = list(gray.getdata())
+        threshold = sum(pixels) / len(pixels) * 0.75
+        binary = gray.point(lambda p: 255 if p < threshold else 0)
+        width, height = binary.size
+        data = binary.load()
+        columns = [any(data[x, y] for y in range(height)) for x in range(width)]
+        glyphs = []
+        start = None
+        for x, filled in enumerate(columns + [False]):
+            if filled and start is None:
+                start = x
+            elif not filled and start is not None:
+                # Отдельные точки шума не считаются символами
+                if x - start > 1:
+                    box = binary.crop((start, 0, x, height)).getbbox()
+                    if box is not None:
+                        glyph = binary.crop((start + box[0], box[1], start + box[2], box[3])).resize(cls.size)
+                        glyphs.append(''.join('1' if p > 127 else '0' for p in glyph.getdata()))
+                start = None
+        return glyphs
+
+    def train(self, folder: str) -> int:
+        """Добавление масок символов из папки с решёнными капчами
+
+        :param folder: Папка с файлами "<ответ>_<hash>.png".
+        :return: Количество капч, использованных для обучения.
+        """
+        count = 0
+        if not os.path.isdir(folder):
+            logging.info(f"There are no captcha samples in {folder}")
+            return count
+        for name in os.listdir(folder):
+            answer = name.split("_", 1)[0]
+            try:
+                glyphs = self._segment(Image.open(os.path.join(folder, name)))
+            except Exception:
+                logging.warning(f"Captcha sample {name} wasn't read", exc_info=True)
+                continue
+            # Если символы слиплись, капча не подходит для обучения
+            if len(glyphs) != len(answer):
+                continue
+            for char, glyph in zip(answer, glyphs):
+                self._add(char, glyph)
+            count += 1
+        return count
+
+    def solve(self, img_bytes: bytes) -> Tuple[str, float]:
+        """Распознавание капчи
+
+        :param img_bytes: Картинка капчи.
+        :return: Текст и уверенность (0..1, по самому сомнительному символу).
+        """
+        if not self._masks:
+            return '', 0
+        glyphs = self._segment(Image.open(BytesIO(img_bytes)))
+        if len(glyphs) == 0:
+            return '', 0
+        text = []
+        confidence = 1.0
+        length = self.size[0] * self.size[1]
+        for glyph in glyphs:
+            value = int(glyph, 2)
+            best_char, best = '', length
+            for char, mask in self._masks:
+                distance = bin(value ^ mask).count('1')
+                if distance < best:
+                    best_char, best = char, distance
+            text.append(best_char)
+            confidence = min(confidence, 1 - best / length)
+        return ''.join(text), confidence
+
+    def save(self, path: str) -> None:
+        """Сохранение модели в json"""
+        with open(path, "w") as file:
+            json.dump(self.templates, file)
+
+    @classmethod
+    def load(cls, path: str) -> "GlyphOcr":
+        """Загрузка модели из json"""
+        with open(path, "r") as file:
+            return cls(json.load(file))
+
+
+def train_model(kind: str, root: str = CAPTCHA_DIR) -> GlyphOcr:
+    """Обучение модели на сохранённых капчах и её сохранение в <root>/<kind>.json
+
+    :param kind: Тип капчи (vin2vin, gibdd).
+    :param root: Папка с капчами.
+    """
+    model = GlyphOcr()
+    count = model.train(os.path.join(root, kind))
+    model.save(os.path.join(root, f"{kind}.json"))
+    logging.info(f"Local OCR for {kind} was trained on {count} captchas")
+    with _models_lock:
+        _models[kind] = model
+    return model
+
+
+_models: Dict[str, Optional[GlyphOcr]] = {}
+_models_lock = Lock()
+
+
+def set_local_ocr(kind: str, solver) -> None:
+    """Подключение своего локального распознавания для типа капчи
+
+    :param kind: Тип капчи (vin2vin, gibdd).
+    :param solver: Объект с методом solve(img_bytes) -> (текст, уверенность). None - отключить.
+    """
+    with _models_lock:
+        _models[kind] = solver
+
+
+def get_local_ocr(kind: str, root: str = CAPTCHA_DIR) -> Optional[GlyphOcr]:
+    """Получение обученной модели для типа капчи
+
+    :param kind: Тип капчи (vin2vin, gibdd).
+    :param root: Папка с моделями.
+    :return: Модель. None - Если модель ещё не обучена.
+    """
+    with _models_lock:
+        if kind in _models:
+            return _models[kind]
+        path = os.path.join(root, f"{kind}.json")
+        # Отсутствие модели не запоминается: модель может быть обучена позже без перезапуска
+        if not os.path.isfile(path):
+            return None
+        _models[kind] = GlyphOcr.load(path)
+        return _models[kind]
@@ -1,71 +1,165 @@
-import requests
+import base64
 import logging
-import time
 import datetime as dt
+from urllib.parse import unquote_to_bytes
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from dataclasses import dataclass
+from typing import Optional, Tuple
 
 from selenium import webdriver
 from selenium.webdriver.firefox.options import Options
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.common.by import By
+from selenium.webdriver.remote.webelement import WebElement
 
-from data.appdata.functions import stop_program, get_image_bytes
+from data.appdata.waits import wait_until, image_loaded
+from data.appdata.httpsession import HttpOptions, get_http_session
+from data.appdata.balancemonitor import get_balance_monitor
+from data.appdata.solvetime import CaptchaTypes
+from data.appdata.captchabroker import get_captcha_broker
+from data.appdata.localocr import CaptchaCollector, get_local_ocr
+from data.appdata.imagestore import get_screenshot_store
+
+
+def decode_data_url(src: Optional[str]) -> Optional[bytes]:
+    """Декодирование картинки из data URL
+
+    :param src: Адрес картинки.
+    :return: Картинка в байтах. None - Если это не data URL.
+    """
+    if src is None or not src.startswith("data:") or "," not in src:
+        return None
+    header, data = src.split(",", 1)
+    if header.endswith(";base64"):
+        return base64.b64decode(data)
+    return unquote_to_bytes(data)
+
+
+def capture_image_bytes(element: WebElement) -> bytes:
+    """Получение картинки, которая показана на странице, без повторной загрузки
+
+    data URL декодируется сразу, иначе делается скриншот элемента.
+
+    :param element: Элемент картинки.
+    :return: Картинка в байтах.
+    """
+    img_bytes = decode_data_url(element.get_attribute("src"))
+    if img_bytes is not None:
+        return img_bytes
+    return element.screenshot_as_png
+
+
+# Потоки ожидания решения капч (общие для всех решателей)
+_solving_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="captcha")
+
+
+class CaptchaTask:
+    """Капча, отправленная на решение.
+
+    Решение ждётся в фоне, результат забирается через result(),
+    а браузер пока может заполнять форму.
+    """
+
+    def __init__(self, solver: "MyCaptchaSolver", future: Future):
+        self._solver = solver
+        self._future = future
+
+    def done(self) -> bool:
+        """Готов ли результат"""
+        return self._future.done()
+
+    def value(self, timeout: Optional[float] = None) -> str:
+        """Решение капчи без проверки. '-1' - Если капча не решена.
+
+        :param timeout: Время ожидания решения. None - Время решения капчи у решателя (wait_timeout).
+        """
+        return self._future.result(timeout if timeout is not None else self._solver.wait_timeout)
+
+    def result(self, timeout: Optional[float] = None) -> str:
+        """Ожидание решения капчи
+
+        :param timeout: Время ожидания решения. None - Время решения капчи у решателя (wait_timeout).
+        :return: Решение капчи. Если капча не решена - исключение (см. _check_result).
+        """
+        res = self.value(timeout)
+        self._solver._check_result(res)
+        return res
 
 
 @dataclass
 class MyCaptchaSolver:
-    """Решение капчей всех типов"""
-    driver: webdriver.Firefox
+    """Решение капчей всех типов
+
+    driver может быть None, если капчи берутся не из браузера (только текстовые капчи).
+    """
+    driver: Optional[webdriver.Firefox]
     key: str = "***"
-    try_count: int = 10
-    sleep: int = 3
+    deadline: int = 120
+    http_options: HttpOptions = HttpOptions()
+    balance_interval: int = 60
+    ocr_confidence: float = 0.9
+    collect_samples: bool = True
+    local_ocr: bool = True
+    collector: Optional[CaptchaCollector] = None
 
     def __post_init__(self):
-        """"""
+        """Подключение к общей сессии с пулом соединений и к монитору баланса"""
+        self._session = get_http_session(self.http_options)
+        # Отправка капчи платная: после отправки запроса in.php не повторяется
+        self._submit_session = get_http_session(self.http_options, submit=True)
+        self._timeout = self.http_options.timeout
+        self._balance = get_balance_monitor(self.key, self.get_wallet, self.balance_interval)
+        self._broker = get_captcha_broker(self.key, self.http_options)
+        if self.collector is None:
+            self.collector = CaptchaCollector()
+
+    @property
+    def wait_timeout(self) -> float:
+        """Максимальное время ожидания решения: отправка капчи и deadline на решение"""
+        return sum(self._timeout) + self.deadline
 
     def get_wallet(self) -> int:
         """Функция для получения текущего баланса"""
-        balance = int(requests.get(f"https://api.cap.guru/res.php?action=getbalance&key={self.key}").text)
+        balance = int(self._session.get(f"https://api.cap.guru/res.php?action=getbalance&key={self.key}",
+                                         timeout=self._timeout).text)
         logging.info(f"Current balance received - Cap Guru: ~{balance} rub")
         return balance
 
     def _check_wallet(self) -> None:
-        """Проверка баланса"""
-        balance = self.get_wallet()
-        if balance < 5:
-            logging.warning("Running out of balance - Cap Guru")
-        if balance <= 0:
-            logging.critical("Out of balance - Cap Guru")
-            stop_program("Out of balance - Cap Guru")
-
-    def _captcha_solving(self, req_id: str) -> str:
-        """Ожидание решения капчи"""
+        """Проверка баланса по оценке монитора (запрос к сервису только у критической отметки)"""
+        self._balance.check()
+
+    def _captcha_solving(self, req_id: str, captcha_type: CaptchaTypes = CaptchaTypes.Image) -> str:
+        """Ожидание решения капчи
+
+        Результат опрашивается общим брокером вместе с капчами других парсеров:
+        первый запрос к ожидаемому времени решения капчи этого типа, следующие - с интервалом
+        по оценке распределения времени решения, до истечения deadline.
+
+        :param req_id: id капчи в CapGuru.
+        :param captcha_type: Тип капчи.
+        :return: Решение капчи. '-1' - Если капча не решена.
+        """
         logging.info("Start of captcha solving")
-        for _ in range(self.try_count):
-            res = requests.get(f"https://api.cap.guru/res.php?key={self.key}&action=get&id={req_id}")
-            if res.text.find('CAPCHA_NOT_READY') > -1:
-                logging.debug("The captcha is not ready yet")
-                time.sleep(self.sleep)
-            elif res.text.find('ERROR') > -1:
-                logging.error(f"The captcha in the picture was not solved: {res.text}")
-                return '-1'
-            elif res.text.find('OK') > -1:
-                result = res.text[res.text.find('|') + 1:]
-                logging.debug(f"The captcha is ready: {result}")
-                return result
-        logging.error(f"The number of solving iterations was exceed {self.try_count}")
-        return "-1"
+        future = self._broker.wait(req_id, captcha_type, self.deadline)
+        try:
+            # Брокер сам завершает капчу по deadline, запас - на последний запрос результата
+            return future.result(self.deadline + self.http_options.read_timeout)
+        except FutureTimeoutError:
+            logging.error(f"The captcha {req_id} result wasn't received from the broker")
+            return '-1'
 
     def _solve_img_captcha(self, img_path: str) -> str:
         """Решение текстовой капчи на картинке
 
         (картинка сохранена)"""
-        files = {'file': open(img_path, 'rb')}
+        with open(img_path, 'rb') as file:
+            img_bytes = file.read()
+        files = {'file': img_bytes}
         data = {'key': self.key, 'method': 'post'}
-        res = requests.post("https://api.cap.guru/in.php", files=files, data=data)
+        res = self._submit_session.post("https://api.cap.guru/in.php", files=files, data=data, timeout=self._timeout)
         if res.ok and res.text.find('OK') > -1:
             req_id = res.text[res.text.find('|') + 1:]
+            self._balance.charge(self._balance.image_cost)
         return self._captcha_solving(req_id)
 
     def _solve_img_captcha_bytes(self, img_bytes: bytes) -> str:
@@ -74,9 +168,10 @@ class MyCaptchaSolver:
         (картинка в байтах)"""
         files = {'file': img_bytes}
         data = {'key': self.key, 'method': 'post'}
-        res = requests.post("https://api.cap.guru/in.php", files=files, data=data)
+        res = self._submit_session.post("https://api.cap.guru/in.php", files=files, data=data, timeout=self._timeout)
         if res.ok and res.text.find('OK') > -1:
             req_id = res.text[res.text.find('|') + 1:]
+            self._balance.charge(self._balance.image_cost)
         else:
             logging.error(f"Cap Guru request was not ok: {res.ok} and {res.text.find('OK')}")
             return '-1'
@@ -85,91 +180,164 @@ class MyCaptchaSolver:
     def _check_result(self, result: str):
         """Проверка результата решения капчи"""
         if result == "-1":
-            fpath = f"data/img/page_screenshots_{dt.datetime.today().strftime('%d-%m-%y %H-%M-%S')}.png"
-            self.driver.save_full_page_screenshot(fpath)
+            if self.driver is None:
+                raise Exception("The captcha wasn't solved")
+            name = f"page_screenshots_{dt.datetime.today().strftime('%d-%m-%y %H-%M-%S')}"
+            fpath = get_screenshot_store().save(self.driver.get_full_page_screenshot_as_png(), name)
             raise Exception(f"The captcha wasn't solved. The page screenshot is saved: {fpath}")
 
-    def get_captcha_value_vin2vin(self, load_delay: int, load_try_count: int) -> str:
-        """Получение значение текстовой капчи на сайте vin2vin
+    # Картинки текстовых капч на сайтах
+    _vin2vin_captcha: Tuple[str, str] = (By.ID, 'p2')
+    _gibdd_captcha: Tuple[str, str] = (By.CSS_SELECTOR, '#captchaPic img')
 
-        :param load_delay: Время отведённое на загрузку элемента.
-        :param load_try_count: Количество попыток запроса на загрузку.
-        :return: Текст с картинки.
+    def _solve_locally(self, img_bytes: bytes, kind: str) -> Optional[str]:
+        """Решение текстовой капчи локальным распознаванием
+
+        :param img_bytes: Картинка в байтах.
+        :param kind: Тип капчи (vin2vin, gibdd).
+        :return: Текст с картинки. None - Если модели нет или она не уверена в ответе.
         """
-        # ждём загрузки элемента
-        element = WebDriverWait(self.driver, load_delay).until(EC.presence_of_element_located((By.ID, 'p2')))
-        self._check_wallet()
-        image_src = element.get_attribute("src")
-        while image_src is None or "gif" in image_src:
-            element = WebDriverWait(self.driver, load_delay).until(EC.presence_of_element_located((By.ID, 'p2')))
-            image_src = element.get_attribute("src")
-            time.sleep(2)
+        if not self.local_ocr:
+            return None
+        model = get_local_ocr(kind)
+        if model is None:
+            return None
+        try:
+            text, confidence = model.solve(img_bytes)
+        except Exception:
+            logging.warning("Local OCR was failed", exc_info=True)
+            return None
+        if len(text) == 0 or confidence < self.ocr_confidence:
+            logging.debug(f"Local OCR isn't sure: {text} ({confidence:.2f})")
+            return None
+        logging.info(f"The captcha was solved locally: {text} ({confidence:.2f})")
+        return text
 
-        res = self._solve_img_captcha_bytes(get_image_bytes(image_src))
-        c = 0
-        while res == '-1' and c <= load_try_count or "gif" in image_src:
-            image_element = self.driver.find_element(By.ID, 'p2')
-            image_src = image_element.get_attribute("src")
-            # driver.save_full_page_screenshot("page_screenshots.png")
-            res = self._solve_img_captcha_bytes(get_image_bytes(image_src))
-            time.sleep(2)
-            c += 1
-        self._check_result(res)
+    def _solve_remote(self, img_bytes: bytes, kind: str) -> str:
+        """Решение текстовой капчи в CapGuru
 
+        Капча с ответом откладывается в collector и сохраняется для обучения,
+        только когда сайт примет ответ (CaptchaCollector.commit).
+        """
+        res = self._solve_img_captcha_bytes(img_bytes)
+        if res != '-1' and self.collect_samples:
+            self.collector.hold(img_bytes, res, kind)
         return res
 
-    def get_captcha_value_gibdd(self, load_delay: int, load_try_count: int) -> str:
-        """Получение значение текстовой капчи на сайте ГИБДД"""
+    def submit_image(self, img_bytes: bytes, kind: str = "image") -> CaptchaTask:
+        """Отправка текстовой капчи на решение без ожидания результата
+
+        Сначала капча распознаётся локально, в CapGuru она уходит, только если модель не уверена в ответе.
+
+        :param img_bytes: Картинка в байтах.
+        :param kind: Тип капчи (vin2vin, gibdd).
+        """
+        value = self._solve_locally(img_bytes, kind)
+        if value is not None:
+            future = Future()
+            future.set_result(value)
+            return CaptchaTask(self, future)
         self._check_wallet()
-        # ждём загрузки элемента
-        element = WebDriverWait(self.driver, load_delay).until(EC.presence_of_element_located((By.ID, 'captchaPic')))
-        img_element = element.find_element(By.TAG_NAME, "img")
-        image_src = img_element.get_attribute("src")
-        start = dt.datetime.now()
-        while image_src is None or "gif" in image_src:
-            img_element = element.find_element(By.TAG_NAME, "img")
-            image_src = img_element.get_attribute("src")
-            time.sleep(2)
-            end = dt.datetime.now()
-            if (end - start).total_seconds() > 60:
-                raise TimeoutError("Time out exception fo GIBDD captcha load")
-
-        res = self._solve_img_captcha_bytes(get_image_bytes(image_src))
+        return CaptchaTask(self, _solving_executor.submit(self._solve_remote, img_bytes, kind))
+
+    def _submit_page_captcha(self, locator: Tuple[str, str], load_delay: int, kind: str) -> CaptchaTask:
+        """Ожидание загрузки картинки капчи на странице и её отправка на решение
+
+        :param locator: Поиск картинки (By, значение).
+        :param load_delay: Время отведённое на загрузку картинки.
+        :param kind: Тип капчи (vin2vin, gibdd).
+        """
+        # ждём загрузки картинки (пока вместо неё gif-заглушка)
+        element = wait_until(self.driver, image_loaded(locator), load_delay, f"Captcha {locator} wasn't loaded")
+        return self.submit_image(capture_image_bytes(element), kind)
+
+    def submit_captcha_vin2vin(self, load_delay: int) -> CaptchaTask:
+        """Отправка текстовой капчи сайта vin2vin на решение без ожидания результата
+
+        :param load_delay: Время отведённое на загрузку картинки.
+        """
+        return self._submit_page_captcha(self._vin2vin_captcha, load_delay, "vin2vin")
+
+    def submit_captcha_gibdd(self, load_delay: int) -> CaptchaTask:
+        """Отправка текстовой капчи сайта ГИБДД на решение без ожидания результата
+
+        :param load_delay: Время отведённое на загрузку картинки.
+        """
+        return self._submit_page_captcha(self._gibdd_captcha, load_delay, "gibdd")
+
+    def _get_captcha_value(self, locator: Tuple[str, str], load_delay: int, load_try_count: int, kind: str) -> str:
+        """Решение текстовой капчи на странице с повторами
+
+        :param locator: Поиск картинки (By, значение).
+        :param load_delay: Время отведённое на загрузку картинки.
+        :param load_try_count: Количество попыток решить капчу.
+        :param kind: Тип капчи (vin2vin, gibdd).
+        :return: Текст с картинки.
+        """
+        res = '-1'
         c = 0
         while res == '-1' and c <= load_try_count:
-            image_element = self.driver.find_element(By.ID, 'p2')
-            image_src = image_element.get_attribute("src")
-            # driver.save_full_page_screenshot("page_screenshots.png")
-            res = self._solve_img_captcha_bytes(get_image_bytes(image_src))
-            time.sleep(2)
+            res = self._submit_page_captcha(locator, load_delay, kind).value()
             c += 1
         self._check_result(res)
 
         return res
 
-    def pass_recaptcha(self) -> str:
-        """Прохождение рекапчи.
+    def get_captcha_value_vin2vin(self, load_delay: int, load_try_count: int) -> str:
+        """Получение значение текстовой капчи на сайте vin2vin
 
-        :return: Код решённой капчи. '-1' - Если капча не решена."""
-        self._check_wallet()
+        :param load_delay: Время отведённое на загрузку картинки.
+        :param load_try_count: Количество попыток решить капчу.
+        :return: Текст с картинки.
+        """
+        return self._get_captcha_value(self._vin2vin_captcha, load_delay, load_try_count, "vin2vin")
+
+    def get_captcha_value_gibdd(self, load_delay: int, load_try_count: int) -> str:
+        """Получение значение текстовой капчи на сайте ГИБДД
+
+        :param load_delay: Время отведённое на загрузку картинки.
+        :param load_try_count: Количество попыток решить капчу.
+        :return: Текст с картинки.
+        """
+        return self._get_captcha_value(self._gibdd_captcha, load_delay, load_try_count, "gibdd")
+
+    def _solve_recaptcha(self, url: str, cookies: list, user_agent: str) -> str:
+        """Решение рекапчи
+
+        :param url: Адрес страницы с рекапчей.
+        :param cookies: Cookies браузера.
+        :param user_agent: User-Agent браузера.
+        :return: Код решённой капчи. '-1' - Если капча не решена.
+        """
         method = 'userrecaptcha'
         google_key = '6LfY85spAAAAAE0dA0h57RxA5TEegIruV38jDeEQ'
-        url = self.driver.current_url
-        res = requests.get(
+        res = self._submit_session.get(
             "https://api.cap.guru/in.php?key={}&method={}&googlekey={}&pageurl={}&cookies={}&userAgent={}".format(
                 self.key,
                 method,
                 google_key,
                 url,
-                self.driver.get_cookies(),
-                self.driver.execute_script('return navigator.userAgent;')
-            ))
+                cookies,
+                user_agent
+            ), timeout=self._timeout)
         if res.ok and res.text.find('OK') > -1:
             req_id = res.text[res.text.find('|') + 1:]
-            res = self._captcha_solving(req_id)
-        else:
-            logging.error(f"Cap Guru request was not ok: {res.ok} and {res.text.find('OK')}")
-            res = '-1'
-        self._check_result(res)
+            self._balance.charge(self._balance.recaptcha_cost)
+            return self._captcha_solving(req_id, CaptchaTypes.ReCaptcha)
+        logging.error(f"Cap Guru request was not ok: {res.ok} and {res.text.find('OK')}")
+        return '-1'
 
-        return res
+    def submit_recaptcha(self) -> CaptchaTask:
+        """Отправка рекапчи текущей страницы на решение без ожидания результата"""
+        self._check_wallet()
+        # Данные браузера читаются в текущем потоке, в фоне только запросы к CapGuru
+        url = self.driver.current_url
+        cookies = self.driver.get_cookies()
+        user_agent = self.driver.execute_script('return navigator.userAgent;')
+        return CaptchaTask(self, _solving_executor.submit(self._solve_recaptcha, url, cookies, user_agent))
+
+    def pass_recaptcha(self) -> str:
+        """Прохождение рекапчи.
+
+        :return: Код решённой капчи. '-1' - Если капча не решена."""
+        return self.submit_recaptcha().result()
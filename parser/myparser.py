@@ -1,23 +1,28 @@
 import base64
 import logging
 import time
-from typing import List
+from typing import Dict, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum, auto
 
 from PIL import Image
 from io import BytesIO
 from dataclasses import dataclass
 from selenium import webdriver, common
-from selenium.webdriver.firefox.options import Options
 from selenium.webdriver.remote.webelement import WebElement
-from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.common.by import By
 from selenium.common.exceptions import TimeoutException
 
 from data.appdata.carinfo import CarInfo, Accident, DEFAULT
 from data.appdata.functions import stop_program, save_json
-from data.appdata.mycaptchasolver import MyCaptchaSolver
+from data.appdata.mycaptchasolver import MyCaptchaSolver, CaptchaTask
+from data.appdata.localocr import CaptchaCollector
+from data.appdata.driverpool import DriverPool, BrowserProfile, PRODUCTION_PROFILE, create_firefox
+from data.appdata.waits import wait_until, document_ready, network_idle
+from data.appdata.httpsession import HttpOptions
+from data.appdata.imagestore import get_image_store, get_screenshot_store
+from data.appdata.vin2vinclient import Vin2VinClient, remember_captcha_url
 
 
 class ParserResults(Enum):
@@ -33,44 +38,82 @@ class ParserResults(Enum):
     Skipped = auto()
 
 
+class ParserBackends(Enum):
+    """Способ получения страниц vin2vin с проверкой по VIN
+
+    Selenium: Через браузер.
+    Http: HTTP запросами без браузера, при ошибке или до первой проверки в браузере - через браузер.
+    """
+    Selenium = auto()
+    Http = auto()
+
+
 @dataclass
 class ParserOptions:
     """Настройки парсера.
 
-    try_count (int): Количество попыток CapGuru прочесть текстовую капчу.
-    sleep: Время между попытками CapGuru прочесть текстовую капчу.
+    solve_deadline: Время, отведённое CapGuru на решение одной капчи.
     load_try_count: количество попыток найти картинки (капчи) на сайте (она загружается не быстро).
-    delay: Время между проверками картинки (капчи) на сайте.
+    captcha_timeout: Время ожидания загрузки картинки (капчи) на сайте.
+    element_timeout: Время ожидания появления полей формы.
+    page_timeout: Время ожидания загрузки страницы после отправки формы.
+    result_timeout: Время ожидания результата проверки на сайте ГИБДД.
+    network_idle: Время без новых запросов, после которого страница считается загруженной.
+    retry_delay: Пауза перед повтором после ошибки CapGuru.
+    http_options: Настройки HTTP клиента для запросов к CapGuru.
+    accident_images: Сохранять ли скриншоты дтп (данные о дтп сохраняются всегда). Бот показывает
+        дтп скриншотами: Accident бота пока не знает полей дтп и загружает только путь к фотографии.
+    browser_profile: Настройки браузера (как у общего пула драйверов, BrowserProfile() - с окном для отладки).
+    backend: Способ получения страниц vin2vin с проверкой по VIN.
     """
-    try_count: int = 10
+    solve_deadline: int = 120
     load_try_count: int = 10
-    sleep: int = 5
-    delay: int = 5
+    captcha_timeout: int = 60
+    element_timeout: int = 10
+    page_timeout: int = 30
+    result_timeout: int = 60
+    network_idle: float = 1
+    retry_delay: int = 10
+    http_options: HttpOptions = HttpOptions()
+    accident_images: bool = True
+    browser_profile: BrowserProfile = PRODUCTION_PROFILE
+    backend: ParserBackends = ParserBackends.Selenium
 
 
 class MyParser:
     """Класс для получения данных"""
     car_info: CarInfo
-    driver: webdriver.Firefox
     options: ParserOptions
+    driver_pool: DriverPool
+
+    # Блок с результатом проверки ДТП на сайте ГИБДД
+    _gibdd_result = (By.CSS_SELECTOR, "#checkAutoAiusdtp .checkResult")
 
     def __init__(self, license_number: str = None, license_region: str = None, vin_number: str = None,
-                 car_info: CarInfo = None, options: ParserOptions = ParserOptions()):
+                 car_info: CarInfo = None, options: ParserOptions = ParserOptions(), driver_pool: DriverPool = None):
         """
         :param license_number: госномер.
         :param license_region: регион от госномера.
         :param vin_number: vin номер. Если он не передан, то он сразу будет получен.
         :param car_info: класс информации о автомобиле.
+        :param driver_pool: пул драйверов. Если не передан, то драйвер запускается отдельно.
         """
         if vin_number is None and license_number is None and license_region is None and car_info is None:
             raise Exception("To find information about car, you should have license number "
                             "and license region or vin number")
         self.options = options
+        self.driver_pool = driver_pool
+        self._driver: Optional[webdriver.Firefox] = None
+        # После того как сайт не принял ответ на капчу, капчи решаются только в CapGuru
+        self._local_ocr = True
+        # Капчи, решённые сервисом, сохраняются для обучения, только если сайт принял ответ
+        self._samples = CaptchaCollector()
         if car_info is not None:
             self.car_info = car_info
             return
         self.car_info = CarInfo()
-        self._driver_settings()
+        if options.backend == ParserBackends.Selenium:
+            self._driver_settings()
         if license_number is not None and license_region is not None:
             self.car_info.license_number = license_number
             self.car_info.license_region = license_region
@@ -101,20 +144,18 @@ class MyParser:
             raise Exception("There is no vin number")
 
     def _driver_settings(self) -> None:
-        """Настройка веб-драйвера"""
-        options = Options()
-        # options.add_argument('--headless')
-        options.add_argument('--disable-audio')
-        options.add_argument('--mute-audio')
-        # options.headless = True
-        self.driver = webdriver.Firefox(options=options)
-        # self.driver.install_addon(
-        #     "C:/Users/drako/AppData/Roaming/Mozilla/Firefox/Profiles/i28787xu.default-release/extensions/adblockultimate@adblockultimate.net.xpi")
-        # self.driver.install_addon(
-        #     "C:/Users/drako/AppData/Roaming/Mozilla/Firefox/Profiles/i28787xu.default-release/extensions/uBlock0@raymondhill.net.xpi")
-        # self.driver.install_addon(
-        #     "C:/Users/drako/AppData/Roaming/Mozilla/Firefox/Profiles/i28787xu.default-release/extensions/jid1-NIfFY2CA8fy1tg@jetpack.xpi")
-        self.driver.implicitly_wait(15)
+        """Настройка веб-драйвера: берём из пула или запускаем отдельный"""
+        if self.driver_pool is not None:
+            self._driver = self.driver_pool.acquire()
+        else:
+            self._driver = create_firefox(self.options.browser_profile)
+
+    @property
+    def driver(self) -> webdriver.Firefox:
+        """Веб-драйвер, запускается при первом обращении"""
+        if self._driver is None:
+            self._driver_settings()
+        return self._driver
 
     def _screenshot(self, name: str, log_level: int = logging.DEBUG) -> None:
         """Делать скриншоты страниц учитывая уровень логирования.
@@ -122,29 +163,94 @@ class MyParser:
         :param name: Названия скриншота для сохранения."""
         # Если уровень логирования в консоль равен log_level
         if logging.getLogger().handlers[1].level <= log_level:
-            self.driver.save_full_page_screenshot(f"data/img/{name}.png")
+            get_screenshot_store().save(self.driver.get_full_page_screenshot_as_png(), name)
 
-    def _pass_captcha(self) -> str:
+    def _submit(self, timeout: float) -> None:
+        """Отправка формы vin2vin и ожидание загрузки новой страницы
+
+        :param timeout: Время, отведённое на загрузку страницы.
+        """
+        submit_btn = wait_until(self.driver, EC.element_to_be_clickable((By.CSS_SELECTOR, 'button[type="submit"]')),
+                                self.options.element_timeout, "Submit button wasn't loaded")
+        submit_btn.click()
+        wait_until(self.driver, EC.staleness_of(submit_btn), timeout, "Page wasn't changed after submit")
+        wait_until(self.driver, document_ready, timeout, "Page wasn't loaded after submit")
+
+    def _solver(self) -> MyCaptchaSolver:
+        """Решатель капч для текущего драйвера"""
+        return MyCaptchaSolver(self.driver, deadline=self.options.solve_deadline,
+                               http_options=self.options.http_options, local_ocr=self._local_ocr,
+                               collector=self._samples)
+
+    def _captcha_rejected(self, visible: Tuple[str, str], kind: str) -> bool:
+        """Проверка, что после отправки формы сайт снова показывает капчу
+
+        Тогда следующие капчи решаются только в CapGuru: локальный ответ мог быть неверным,
+        а отложенная для обучения капча удаляется.
+
+        :param visible: Элемент, который виден, только если ответ не принят.
+        :param kind: Тип капчи (vin2vin, gibdd).
+        :return: Не принят ли ответ.
+        """
+        try:
+            rejected = any(element.is_displayed() for element in self.driver.find_elements(*visible))
+        except Exception:
+            return False
+        if rejected:
+            logging.warning(f"{kind} didn't accept the captcha answer")
+            self._local_ocr = False
+            self._samples.discard(kind)
+        return rejected
+
+    def _await_captcha(self, task: Optional[CaptchaTask]) -> Optional[str]:
+        """Получение решения капчи, отправленной заранее
+
+        :param task: Отправленная капча.
+        :return: Решение. None - Если капча не отправлена или не решена.
+        """
+        if task is None:
+            return None
+        try:
+            return task.result()
+        except Exception:
+            logging.warning("Captcha submitted in advance wasn't solved", exc_info=True)
+            return None
+
+    def _pass_captcha(self, task: CaptchaTask = None) -> str:
         """Прохождение текстовой капчи
 
+        :param task: Капча, отправленная на решение заранее.
         :return: Текст с картинки.
         """
-        solver = MyCaptchaSolver(self.driver, try_count=self.options.try_count, sleep=self.options.sleep)
+        value = self._await_captcha(task)
+        if value is not None:
+            return value
+        solver = self._solver()
         do = True
         while do:
             try:
-                value = solver.get_captcha_value_vin2vin(self.options.delay, self.options.load_try_count)
+                value = solver.get_captcha_value_vin2vin(self.options.captcha_timeout, self.options.load_try_count)
                 do = False
             except Exception:
-                time.sleep(10)
+                time.sleep(self.options.retry_delay)
         return value
 
     def _fill_vin(self):
         """Заполнение полей на сайте: VIN и текстовая капча."""
         logging.info("Start filling data to vin2vin")
-        captcha_value = self._pass_captcha()
-        input_text_vin = self.driver.find_element(By.ID, 'exampleInputEmail2')
+        # Капча решается, пока заполняется VIN
+        try:
+            task = self._solver().submit_captcha_vin2vin(self.options.captcha_timeout)
+            # Адрес картинки, подставленный скриптом страницы, нужен для проверок без браузера
+            remember_captcha_url(self.driver.current_url,
+                                 self.driver.find_element(By.ID, 'p2').get_attribute("src"))
+        except Exception:
+            logging.warning("Captcha wasn't submitted in advance", exc_info=True)
+            task = None
+        input_text_vin = wait_until(self.driver, EC.element_to_be_clickable((By.ID, 'exampleInputEmail2')),
+                                    self.options.element_timeout, "VIN field wasn't loaded")
         input_text_vin.send_keys(self.car_info.vin_number)
+        captcha_value = self._pass_captcha(task)
         input_text_captcha = self.driver.find_element(By.ID, 'exampleInputPassword2')
         input_text_captcha.send_keys(captcha_value)
         self._screenshot("filled_vin")
@@ -160,12 +266,15 @@ class MyParser:
         try:
             self._fill_vin()
             logging.info("Opening vin2vin page")
-            WebDriverWait(self.driver, 15)
-            submit_btn = self.driver.find_element(By.CSS_SELECTOR, 'button[type="submit"]')
-            submit_btn.click()
-            WebDriverWait(self.driver, 10)
+            self._submit(self.options.page_timeout)
             self._screenshot("pressed")
+            if len(self.driver.find_elements(By.TAG_NAME, "table")) == 0 and \
+                    self._captcha_rejected((By.ID, 'p2'), "vin2vin"):
+                return False
+            self._samples.commit("vin2vin")
         except Exception as err:
+            # Принят ли ответ, неизвестно
+            self._samples.discard("vin2vin")
             self._screenshot("other_page_error", logging.ERROR)
             logging.error(f"Error was caused while site parsing", exc_info=True)
             return False
@@ -176,17 +285,17 @@ class MyParser:
 
         :return: Текст с картинки. '-1' - Если ошибка.
         """
-        solver = MyCaptchaSolver(self.driver, try_count=self.options.try_count, sleep=self.options.sleep)
+        solver = self._solver()
         do = True
         while do:
             try:
-                value = solver.get_captcha_value_gibdd(self.options.delay, self.options.load_try_count)
+                value = solver.get_captcha_value_gibdd(self.options.captcha_timeout, self.options.load_try_count)
                 do = False
-            except TimeoutError:
+            except (TimeoutError, TimeoutException):
                 logging.error("Error while captcha load", exc_info=True)
                 return '-1'
             except Exception:
-                time.sleep(10)
+                time.sleep(self.options.retry_delay)
         return value
 
     def _fill_captcha(self):
@@ -195,7 +304,7 @@ class MyParser:
         captcha_value = self._pass_captcha_gibdd()
         while captcha_value == '-1':
             self.driver.refresh()
-            time.sleep(2)
+            wait_until(self.driver, document_ready, self.options.page_timeout, "GIBDD page wasn't reloaded")
             self._open_captcha()
             captcha_value = self._pass_captcha_gibdd()
         input_text_captcha = self.driver.find_element(By.NAME, 'captcha_num')
@@ -204,14 +313,16 @@ class MyParser:
 
     def _open_captcha(self):
         """Открытие капчи на сайте ГИБДД"""
-        time.sleep(5)
-        input_text_vin = WebDriverWait(self.driver, 10).until(EC.presence_of_element_located((By.ID, 'checkAutoVIN')))
-        # input_text_vin = self.driver.find_element(By.ID, 'checkAutoVIN')
+        input_text_vin = wait_until(self.driver, EC.element_to_be_clickable((By.ID, 'checkAutoVIN')),
+                                    self.options.element_timeout, "GIBDD VIN field wasn't loaded")
         input_text_vin.send_keys(self.car_info.vin_number)
-        check_btn = self.driver.find_element(By.LINK_TEXT, "запросить сведения о ДТП")
-        time.sleep(5)
+        check_btn = wait_until(self.driver, EC.element_to_be_clickable((By.LINK_TEXT, "запросить сведения о ДТП")),
+                               self.options.element_timeout, "GIBDD accident button wasn't loaded")
         check_btn.click()
-        time.sleep(5)
+        # Капча может не появиться, если сайт сразу отдал результат
+        wait_until(self.driver, EC.any_of(EC.visibility_of_element_located((By.ID, 'captchaPic')),
+                                          EC.visibility_of_element_located(self._gibdd_result)),
+                   self.options.captcha_timeout, "GIBDD captcha wasn't opened")
         self._screenshot("gibdd_opened")
 
     def _get_parser_gibdd(self, url: str = "https://xn--90adear.xn--p1ai/check/auto") -> bool:
@@ -224,16 +335,20 @@ class MyParser:
         self.driver.get(url)
         try:
             self._fill_captcha()
-            WebDriverWait(self.driver, 15)
             try:
                 submit_btn = self.driver.find_element(By.ID, 'captchaSubmit')
                 submit_btn.click()
             except Exception:
                 logging.info("Captcha was disappeared")
-            WebDriverWait(self.driver, 10)
-            time.sleep(10)
+            wait_until(self.driver, EC.visibility_of_element_located(self._gibdd_result),
+                       self.options.result_timeout, "GIBDD result wasn't loaded")
+            wait_until(self.driver, network_idle(self.options.network_idle), self.options.result_timeout,
+                       "GIBDD result wasn't loaded")
             self._screenshot("gibdd_pressed")
+            self._samples.commit("gibdd")
         except Exception as err:
+            self._captcha_rejected((By.ID, 'captchaPic'), "gibdd")
+            self._samples.discard("gibdd")
             self._screenshot("other_page_error", logging.ERROR)
             logging.error(f"Error was caused while site parsing", exc_info=True)
             return False
@@ -241,26 +356,30 @@ class MyParser:
 
     def _fill_license(self):
         """Заполнения в полей на сайте: Госномер и регион."""
-        input_text_number = WebDriverWait(self.driver, timeout=10).until(lambda d: d.find_element(By.ID, 'exampleInputEmail2'))
-        # input_text_number = self.driver.find_element(By.ID, 'exampleInputEmail2')
+        input_text_number = wait_until(self.driver, EC.element_to_be_clickable((By.ID, 'exampleInputEmail2')),
+                                       self.options.element_timeout, "Licence field wasn't loaded")
         input_text_number.send_keys(self.car_info.license_number)
         input_text_region = self.driver.find_element(By.ID, 'exampleInputPassword2')
         input_text_region.send_keys(self.car_info.license_region)
         self._screenshot("filled_licence")
 
-    def _pass_recaptcha(self) -> str:
+    def _pass_recaptcha(self, task: CaptchaTask = None) -> str:
         """Прохождение рекапчи.
 
+        :param task: Рекапча, отправленная на решение заранее.
         :return: Код решённой капчи. '-1' - Если капча не решена."""
-        solver = MyCaptchaSolver(self.driver, try_count=self.options.try_count, sleep=self.options.sleep)
+        result = self._await_captcha(task)
+        if result is not None:
+            return result
+        solver = self._solver()
         do = True
         while do:
             try:
                 result = solver.pass_recaptcha()
                 do = False
             except Exception:
-                time.sleep(10)
-                result = solver.get_captcha_value_vin2vin(self.options.delay, self.options.load_try_count)
+                time.sleep(self.options.retry_delay)
+                result = solver.get_captcha_value_vin2vin(self.options.captcha_timeout, self.options.load_try_count)
         return result
 
     def _get_parser(self) -> bool:
@@ -269,19 +388,21 @@ class MyParser:
         :return: Успешна ли операция."""
         self.driver.get("https://vin2vin.ru/getvin")
         try:
+            # Рекапча решается, пока заполняются поля госномера
+            try:
+                task = self._solver().submit_recaptcha()
+            except Exception:
+                logging.warning("Recaptcha wasn't submitted in advance", exc_info=True)
+                task = None
             self._fill_license()
-            WebDriverWait(self.driver, 15)
-            code = self._pass_recaptcha()
+            code = self._pass_recaptcha(task)
             recaptcha_response_element = self.driver.find_element(By.ID, 'g-recaptcha-response')
             self.driver.execute_script(f'arguments[0].value = "{code}";', recaptcha_response_element)
             self._screenshot("solved")
-            time.sleep(10)
             try:
-                submit_btn = self.driver.find_element(By.CSS_SELECTOR, 'button[type="submit"]')
-                submit_btn.click()
-            except:
-                self.driver.save_full_page_screenshot("error.png")
-            time.sleep(10)
+                self._submit(self.options.page_timeout)
+            except TimeoutException:
+                self._screenshot("submit_error", logging.ERROR)
             self._screenshot("opened")
         except Exception:
             self._screenshot("vin_page_error", logging.ERROR)
@@ -289,23 +410,41 @@ class MyParser:
             return False
         return True
 
-    def _crop_accident_screenshot(self, x: int, y: int, width: int, height: int, padding: int = 25) -> Image:
-        """Обрезка скриншота, чтобы получить информацию об авариях
+    def _get_accident_boxes(self, content: List[WebElement], titles: List[WebElement],
+                            padding: int = 25) -> List[Tuple[int, int, int, int]]:
+        """Расчёт областей скриншота с информацией о каждой аварии
 
-        :param x: Начало по x (слева).
-        :param y: Начало по y (слева).
-        :param width: Ширина обрезки.
-        :param height: Высота обрезки.
-        :param padding: Отступ от краёв.
-        :return: Обрезанная картинка.
+        :param content: Список всех дтп (tag name: li).
+        :param titles: Заголовки дтп.
+        :param padding: Отступ от левого края.
+        :return: Области (left, top, right, bottom) для каждого дтп.
         """
-        x -= padding
-        width += padding
-        screenshot = self.driver.get_full_page_screenshot_as_png()
-
-        img = Image.open(BytesIO(screenshot))
-        cropped_img = img.crop((x, y, x + width, y + height))
-        return cropped_img
+        # hr[1] - конец блока о дтп
+        hr = self.driver.find_elements(By.TAG_NAME, 'hr')[1]
+        hr_size = hr.size
+        hr_location = hr.location
+        right = hr_location['x'] + hr_size['width']
+        boxes = []
+        y = content[0].location['y']
+        for i in range(len(titles)):
+            x = content[i].location['x']
+            if i + 1 == len(titles):
+                bottom = hr_location['y']
+            else:
+                bottom = titles[i + 1].location['y']
+            boxes.append((x - padding, y, right, bottom))
+            # Следующий блок начинается чуть выше заголовка
+            y = bottom - 10
+        return boxes
+
+    def _crop_accident_screenshot(self, screenshot: Image, box: Tuple[int, int, int, int]) -> str:
+        """Вырезание и сохранение информации об аварии из скриншота страницы
+
+        :param screenshot: Скриншот всей страницы.
+        :param box: Область (left, top, right, bottom).
+        :return: Ключ картинки в хранилище.
+        """
+        return get_image_store().save(screenshot.crop(box))
 
     def _is_accidents(self, content: WebElement) -> bool:
         """Проверка, есть ли ДТП, или они не были загружены
@@ -322,38 +461,51 @@ class MyParser:
         logging.error("Result div was None")
         return True
 
-    def _get_accident_imgs(self, content: List[WebElement], titles: List[WebElement]) -> None:
+    def _get_accident_imgs(self, content: List[WebElement], titles: List[WebElement]) -> List[str]:
         """Разбиение всех дтп на отдельные скрины
 
+        Скриншот страницы делается один раз, все дтп вырезаются из него.
+
         :param content: Список всех дтп (tag name: li)
+        :param titles: Заголовки дтп.
+        :return: Ключи скринов в хранилище картинок.
         """
-        # Начало дтп (hr имеет размер)
-        hr_elements = self.driver.find_elements(By.TAG_NAME, 'hr')
-        y = 0
-        for i in range(len(titles)):
-            li = content[i]
-            title = titles[i].text
-            name = title[title.find("№") + 1:]
-            path = f"data/users/dtp№{name}.png"
-
-            content_location = li.location
-            # hr[1] - конец блока о дтп
-            hr_size = hr_elements[1].size
-            hr_location = hr_elements[1].location
-
-            x = content_location['x']
-            if i == 0: y = content_location['y']
-
-            width = hr_location['x'] - x + hr_size['width']
-            if i + 1 == len(titles):
-                height = hr_location['y'] - y
-            else:
-                height = titles[i + 1].location['y'] - y
-
-            img = self._crop_accident_screenshot(x, y, width, height)
-            self.car_info.accidents.append(Accident(path))
-            img.save(path)
-            y += img.height - 10
+        boxes = self._get_accident_boxes(content, titles)
+        screenshot = Image.open(BytesIO(self.driver.get_full_page_screenshot_as_png()))
+        screenshot.load()
+        # Сжатие картинок занимает основное время, они сохраняются параллельно
+        with ThreadPoolExecutor(max_workers=max(min(len(boxes), 4), 1)) as executor:
+            return list(executor.map(lambda box: self._crop_accident_screenshot(screenshot, box), boxes))
+
+    # Все поля каждого дтп одним запросом: "Подпись: значение" из текста пункта списка
+    _accident_records_script = """
+        return Array.from(arguments[0].querySelectorAll(':scope > li')).map(li => {
+            const record = {};
+            const title = li.querySelector('.ul-title');
+            if (title) record['Номер происшествия'] = title.innerText.split('№').pop().trim();
+            li.innerText.split('\\n').forEach(line => {
+                const i = line.indexOf(':');
+                if (i <= 0) return;
+                const key = line.slice(0, i).trim();
+                const value = line.slice(i + 1).trim();
+                if (value.length > 0 && !(key in record)) record[key] = value;
+            });
+            return record;
+        });"""
+
+    def _get_accident_records(self, ul: WebElement) -> List[Dict[str, str]]:
+        """Получение информации о дтп из списка на странице
+
+        :param ul: Список всех дтп (class: aiusdtp-list).
+        :return: Поля каждого дтп с русскими названиями (как в описании Accident).
+        """
+        records = self.driver.execute_script(self._accident_records_script, ul)
+        for record in records:
+            # "Номер ТС/количество ТС: 1/2" - нужно только количество
+            vehicles = record.pop("Номер ТС/количество ТС", None)
+            if vehicles is not None and "Количество ТС" not in record:
+                record["Количество ТС"] = vehicles.split("/")[-1].strip()
+        return records
 
     def _parse_page(self, parser_result: bool) -> ParserResults:
         """Парсинг страницы
@@ -377,7 +529,15 @@ class MyParser:
                 return ParserResults.Error if self._is_accidents(div_accident) else ParserResults.NotFound
             if len(titles) > len(content) or len(content) == 0:
                 return ParserResults.Error if self._is_accidents(div_accident) else ParserResults.NotFound
-            self._get_accident_imgs(content, titles)
+            records = self._get_accident_records(ul)
+            if self.options.accident_images:
+                for record, path in zip(records, self._get_accident_imgs(content, titles)):
+                    record["Путь к фотографии"] = path
+            for record in records:
+                # Accident бота создаётся с путём к фотографии, остальные поля - из описания, если они есть
+                accident = Accident(record.get("Путь к фотографии", DEFAULT))
+                accident.load_from_json(record)
+                self.car_info.accidents.append(accident)
             return ParserResults.Ok
         else:
             logging.error("Parsing was failed")
@@ -401,8 +561,8 @@ class MyParser:
         if parser_result:
             logging.info("Start of tabel parsing")
             try:
-                tables = WebDriverWait(self.driver, 10).until(
-                    EC.presence_of_all_elements_located((By.TAG_NAME, "table")))
+                wait_until(self.driver, EC.presence_of_all_elements_located((By.TAG_NAME, "table")),
+                           self.options.element_timeout)
             except common.exceptions.NoSuchElementException as ex:
                 self._screenshot("Table wasn't found")
                 logging.error("Table wasn't found")
@@ -412,31 +572,77 @@ class MyParser:
                 return ParserResults.NotFound
             except Exception as ex:  # Непредвиденная ошибка
                 logging.critical("Table wasn't found", exc_info=True)
-            dictionary: {str: str} = {}
-            for table in tables:
-                rows = table.find_elements(By.TAG_NAME, "tr")
-                for row in rows:
-                    cells = row.find_elements(By.TAG_NAME, "td")
-                    key = str(cells[0].text).replace(':', '').strip()
-                    if key == "VIN номер":
-                        if len(cells[1].text.strip()) == 0:
-                            logging.info("There is no info about car")
-                            return ParserResults.NotFound
-                        if cells[1].text.strip() == DEFAULT:
-                            logging.error("There was an error while parsing")
-                            return ParserResults.Error
-                    dictionary[key] = cells[1].text.strip()
-            try: self.car_info.set_dictionary(dictionary)
-            except Exception:
-                logging.error("Dictionary set was failed:", exc_info=True)
-                return ParserResults.Error
-            finally:
-                save_json(self.car_info.get_dictionary(True), self.car_info.vin_number)
-            return ParserResults.Ok
+            tables = self.driver.execute_script(self._tables_script)
+            return self._fill_from_tables(tables)
         else:
             logging.error("Parsing was failed")
             return ParserResults.Error
 
+    # Текст всех ячеек всех таблиц одним запросом: таблица -> строка -> ячейка
+    _tables_script = """
+        return Array.from(document.getElementsByTagName('table')).map(table =>
+            Array.from(table.getElementsByTagName('tr')).map(row =>
+                Array.from(row.getElementsByTagName('td')).map(cell => cell.innerText)));"""
+
+    def _fill_from_tables(self, tables: List[List[List[str]]]) -> ParserResults:
+        """Заполнение информации об автомобиле из таблиц "название: значение"
+
+        :param tables: Текст ячеек: таблица -> строка -> ячейка.
+        :return: Получилось ли получить данные.
+        """
+        dictionary: {str: str} = {}
+        for rows in tables:
+            for cells in rows:
+                if len(cells) < 2:
+                    continue
+                key = str(cells[0]).replace(':', '').strip()
+                value = cells[1].strip()
+                if key == "VIN номер":
+                    if len(value) == 0:
+                        logging.info("There is no info about car")
+                        return ParserResults.NotFound
+                    if value == DEFAULT:
+                        logging.error("There was an error while parsing")
+                        return ParserResults.Error
+                dictionary[key] = value
+        try: self.car_info.set_dictionary(dictionary)
+        except Exception:
+            logging.error("Dictionary set was failed:", exc_info=True)
+            return ParserResults.Error
+        finally:
+            save_json(self.car_info.get_dictionary(True), self.car_info.vin_number)
+        return ParserResults.Ok
+
+    def _fetch_tables_http(self, url: str) -> Optional[List[List[List[str]]]]:
+        """Получение таблиц страницы vin2vin без браузера
+
+        :param url: Ссылка на сайт для парсинга.
+        :return: Текст ячеек таблиц. None - Если не получилось.
+        """
+        solver = MyCaptchaSolver(None, deadline=self.options.solve_deadline, http_options=self.options.http_options,
+                                 local_ocr=self._local_ocr, collector=self._samples)
+        try:
+            tables = Vin2VinClient(solver, self.options.http_options).fetch_tables(url, self.car_info.vin_number)
+        except Exception:
+            logging.warning("vin2vin page wasn't loaded without browser", exc_info=True)
+            return None
+        if tables is None:
+            logging.info("vin2vin captcha address isn't known yet")
+        return tables
+
+    def _parse_vin_page(self, url: str) -> ParserResults:
+        """Получение данных со страницы vin2vin с проверкой по VIN
+
+        :param url: Ссылка на сайт для парсинга.
+        :return: Результат парсинга.
+        """
+        if self.options.backend == ParserBackends.Http:
+            tables = self._fetch_tables_http(url)
+            if tables is not None:
+                return self._fill_from_tables(tables)
+            logging.info("Falling back to browser parsing")
+        return self._parse_table(self._get_parser_with_vin(url))
+
     def parse_vin(self) -> ParserResults:
         """Получение данных о vin номере:
 
@@ -453,7 +659,7 @@ class MyParser:
 
         :return: Результат парсинга."""
         logging.info("Start of history parsing")
-        return self._parse_table(self._get_parser_with_vin("https://vin2vin.ru/history"))
+        return self._parse_vin_page("https://vin2vin.ru/history")
 
     def parse_limits(self) -> ParserResults:
         """Получаем данные со страницы о лимитах автомобиля:
@@ -462,7 +668,7 @@ class MyParser:
 
         :return: Результат парсинга."""
         logging.info("Start of limits parsing")
-        return self._parse_table(self._get_parser_with_vin("https://vin2vin.ru/restricted"))
+        return self._parse_vin_page("https://vin2vin.ru/restricted")
 
     def parse_hijacking(self) -> ParserResults:
         """Получаем данные со страницы об угоне автомобиля:
@@ -471,7 +677,7 @@ class MyParser:
 
         :return: Результат парсинга."""
         logging.info("Start of hijacking parsing")
-        return self._parse_table(self._get_parser_with_vin("https://vin2vin.ru/wanted"))
+        return self._parse_vin_page("https://vin2vin.ru/wanted")
 
     def parse_inspection(self) -> ParserResults:
         """Получаем данные со страницы о техосмотре автомобиля:
@@ -480,9 +686,21 @@ class MyParser:
 
         :return: Результат парсинга."""
         logging.info("Start of inspection parsing")
-        return self._parse_table(self._get_parser_with_vin("https://vin2vin.ru/eaisto"))
+        return self._parse_vin_page("https://vin2vin.ru/eaisto")
 
-    def __del__(self):
-        try: self.driver.quit()
+    def close(self) -> None:
+        """Возврат драйвера в пул или его закрытие"""
+        driver = getattr(self, "_driver", None)
+        if driver is None:
+            return
+        self._driver = None
+        try:
+            if self.driver_pool is not None:
+                self.driver_pool.release(driver)
+            else:
+                driver.quit()
         except Exception as e:
             logging.info("Error closing driver:", exc_info=True)
+
+    def __del__(self):
+        self.close()
@@ -0,0 +1,225 @@
+import json
+import logging
+import os
+import sqlite3
+import time
+from dataclasses import dataclass, field
+from threading import Lock
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from data.appdata.carinfo import CarInfo, DEFAULT
+from data.appdata.carnumbers import normalize_number
+from data.appdata.myparser import ParserResults
+
+# База кэша результатов проверки
+SCAN_CACHE_DB = "data/scan_cache.sqlite3"
+
+
+def car_plate(car_info: CarInfo) -> Optional[str]:
+    """Госномер автомобиля с регионом в нормализованном виде
+
+    :param car_info: Информация о машине.
+    :return: Госномер. None - Если госномер неизвестен.
+    """
+    if car_info.license_number == DEFAULT:
+        return None
+    region = car_info.license_region if car_info.license_region != DEFAULT else ''
+    return normalize_number(car_info.license_number + region)
+
+
+HOUR = 60 * 60
+DAY = 24 * HOUR
+
+
+@dataclass
+class CacheTtl:
+    """Время (с), в течение которого результат проверки считается свежим.
+
+    plate: Связь госномера с vin номером (регистрационные данные).
+    sections: Время для каждой страницы по имени ScanSections.
+    """
+    plate: float = 14 * DAY
+    sections: Dict[str, float] = field(default_factory=lambda: {
+        "History": 14 * DAY,
+        "Limits": 6 * HOUR,
+        "Hijacking": 6 * HOUR,
+        "Inspection": 3 * DAY,
+        "Accident": 3 * DAY,
+    })
+
+
+@dataclass
+class CachedCar:
+    """Автомобиль из кэша и время проверки его страниц"""
+    car_info: CarInfo
+    scanned: Dict[str, float] = field(default_factory=dict)
+    plate_scanned: float = 0
+
+
+class ScanStore:
+    """Хранилище кэша результатов проверки в SQLite.
+
+    Сохраняется только проверенная машина, время проверки страниц объединяется
+    с сохранённым (берётся более позднее), поэтому бот и сайт могут писать
+    в одну базу одновременно, не затирая результаты друг друга.
+    """
+
+    def __init__(self, path: str = SCAN_CACHE_DB):
+        """
+        :param path: Путь к файлу базы.
+        """
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self._lock = Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        with self._lock:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.executescript("""
+                CREATE TABLE IF NOT EXISTS scans (
+                    vin TEXT PRIMARY KEY,
+                    plate TEXT,
+                    data TEXT NOT NULL,
+                    scanned TEXT NOT NULL,
+                    plate_scanned REAL NOT NULL);
+                CREATE INDEX IF NOT EXISTS scans_plate ON scans (plate);""")
+
+    def load_scan(self, number: str) -> Optional[Tuple[dict, Dict[str, float], float]]:
+        """Машина и время проверки её страниц
+
+        :param number: vin номер или госномер.
+        :return: Словарь машины, время проверки страниц и время получения vin номера по госномеру.
+        """
+        number = normalize_number(number)
+        with self._lock:
+            row = self._connection.execute("SELECT data, scanned, plate_scanned FROM scans WHERE vin = ? OR plate = ? "
+                                           "ORDER BY vin = ? DESC, plate_scanned DESC LIMIT 1",
+                                           (number, number, number)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), json.loads(row[1]), row[2]
+
+    def save_scan(self, car_info: CarInfo, scanned: Dict[str, float], plate_scanned: float) -> None:
+        """Сохранение машины и времени проверки её страниц одной транзакцией
+
+        :param car_info: Проверенная машина.
+        :param scanned: Время проверки страниц (объединяется с сохранённым).
+        :param plate_scanned: Время получения vin номера по госномеру (0 - не получался).
+        """
+        vin = normalize_number(car_info.vin_number)
+        data = json.dumps(car_info.get_dictionary(True), ensure_ascii=False)
+        with self._lock, self._connection:
+            # IMMEDIATE: другой процесс не изменит время проверки между чтением и записью
+            self._connection.execute("BEGIN IMMEDIATE")
+            row = self._connection.execute("SELECT scanned, plate_scanned FROM scans WHERE vin = ?",
+                                           (vin,)).fetchone()
+            if row is not None:
+                scanned = merge_scanned(json.loads(row[0]), scanned)
+                plate_scanned = max(plate_scanned, row[1])
+            self._connection.execute("INSERT OR REPLACE INTO scans (vin, plate, data, scanned, plate_scanned) "
+                                     "VALUES (?, ?, ?, ?, ?)",
+                                     (vin, car_plate(car_info), data, json.dumps(scanned), plate_scanned))
+
+    def close(self) -> None:
+        """Закрытие базы"""
+        with self._lock:
+            self._connection.close()
+
+
+def merge_scanned(old: Dict[str, float], new: Dict[str, float]) -> Dict[str, float]:
+    """Объединение времени проверки страниц: для каждой страницы берётся более позднее"""
+    merged = dict(old)
+    for section, scanned in new.items():
+        merged[section] = max(scanned, merged.get(section, 0))
+    return merged
+
+
+class ScanCache:
+    """Кэш результатов проверки по vin номеру и госномеру.
+
+    Для каждой страницы хранится время последней успешной проверки,
+    поэтому повторно проверяются только устаревшие страницы.
+    Кэш хранится в хранилище (backend) с методами
+    load_scan(number) -> (словарь машины, время проверки страниц, время проверки госномера)
+    и save_scan(car_info, scanned, plate_scanned): в своей SQLite базе (ScanStore)
+    или, например, в базе сайта. Машина каждый раз читается из хранилища,
+    поэтому результаты другого процесса видны сразу, а у каждой проверки своя копия машины.
+    """
+
+    def __init__(self, ttl: CacheTtl = CacheTtl(), backend=None):
+        """
+        :param ttl: Время жизни результатов.
+        :param backend: Хранилище кэша. None - ScanStore().
+        """
+        self.ttl = ttl
+        self.backend = backend if backend is not None else ScanStore()
+
+    def get(self, number: str) -> Optional[CachedCar]:
+        """Получение автомобиля по vin номеру или госномеру
+
+        Госномер находится, только пока его связь с vin номером не устарела.
+
+        :param number: vin номер или госномер.
+        :return: Машина и время проверки её страниц. None - Если машина не проверялась.
+        """
+        number = normalize_number(number)
+        try:
+            loaded = self.backend.load_scan(number)
+        except Exception:
+            logging.error(f"Car {number} wasn't loaded from the scan cache", exc_info=True)
+            return None
+        if loaded is None:
+            return None
+        info, scanned, plate_scanned = loaded
+        car_info = CarInfo()
+        car_info.load_from_json(info)
+        if number != normalize_number(car_info.vin_number) and time.time() - plate_scanned > self.ttl.plate:
+            return None
+        return CachedCar(car_info, scanned, plate_scanned)
+
+    def stale_sections(self, cached: Optional[CachedCar], sections: Iterable) -> List:
+        """Страницы, результаты которых устарели
+
+        :param cached: Машина из кэша. None - Машина не проверялась.
+        :param sections: Страницы для проверки (ScanSections).
+        :return: Устаревшие страницы.
+        """
+        now = time.time()
+        scanned = cached.scanned if cached is not None else {}
+        return [section for section in sections
+                if now - scanned.get(section.name, 0) > self.ttl.sections.get(section.name, 0)]
+
+    def put(self, car_info: CarInfo, results: Dict, plate_scanned: bool = False) -> None:
+        """Сохранение результатов проверки
+
+        Свежими считаются страницы, где информация получена или её нет на сайте.
+
+        :param car_info: Проверенный автомобиль.
+        :param results: Результат проверки каждой страницы (ScanSections -> ParserResults).
+        :param plate_scanned: Был ли vin номер только что получен по госномеру.
+        """
+        now = time.time()
+        scanned = {section.name: now for section, result in results.items()
+                   if result in [ParserResults.Ok, ParserResults.NotFound]}
+        try:
+            self.backend.save_scan(car_info, scanned, now if plate_scanned else 0)
+        except Exception:
+            logging.error(f"Car {car_info.vin_number} wasn't saved to the scan cache", exc_info=True)
+
+
+_scan_cache: Optional[ScanCache] = None
+_scan_cache_lock = Lock()
+
+
+def get_scan_cache(ttl: CacheTtl = CacheTtl(), backend=None) -> ScanCache:
+    """Общий для процесса кэш результатов проверки
+
+    :param ttl: Время жизни результатов, используется только при первом вызове.
+    :param backend: Хранилище кэша, используется только при первом вызове. None - ScanStore().
+    """
+    global _scan_cache
+    with _scan_cache_lock:
+        if _scan_cache is None:
+            _scan_cache = ScanCache(ttl, backend)
+        return _scan_cache
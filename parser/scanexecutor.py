@@ -0,0 +1,133 @@
+import logging
+from collections import deque
+from dataclasses import dataclass
+from threading import Condition, Thread
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+
+@dataclass
+class _ScanJob:
+    """Проверка, ожидающая свободного потока"""
+    user_id: int
+    func: Callable[..., Any]
+    args: Tuple
+
+
+class ScanExecutor:
+    """Ограниченный пул потоков для проверок пользователей.
+
+    Проверки ждут в очереди без активного ожидания, у каждого пользователя
+    может быть одна проверка: в очереди её можно отменить и узнать её позицию.
+    """
+
+    def __init__(self, worker_count: int = 3, name: str = "scan-worker"):
+        """
+        :param worker_count: Количество одновременных проверок.
+        :param name: Префикс имён потоков.
+        """
+        if worker_count < 1:
+            raise ValueError("Incorrect worker count")
+        self._queue: Deque[_ScanJob] = deque()
+        self._running: Dict[int, _ScanJob] = {}
+        self._closed = False
+        self._condition = Condition()
+        self._workers: List[Thread] = [Thread(target=self._work, name=f"{name}-{i}", daemon=True)
+                                       for i in range(worker_count)]
+        for worker in self._workers:
+            worker.start()
+
+    def _work(self) -> None:
+        """Цикл потока: взять проверку из очереди и выполнить"""
+        while True:
+            with self._condition:
+                while not self._queue and not self._closed:
+                    self._condition.wait()
+                if not self._queue:
+                    return
+                job = self._queue.popleft()
+                self._running[job.user_id] = job
+            try:
+                job.func(*job.args)
+            except Exception:
+                logging.error(f"Error appeared in scan of user id{job.user_id}", exc_info=True)
+            finally:
+                with self._condition:
+                    self._running.pop(job.user_id, None)
+
+    def _place(self, index: int) -> int:
+        """Место в очереди проверки с индексом index (вызывается под блокировкой)
+
+        Первые проверки очереди заберут свободные потоки, для них место 0.
+        """
+        idle = len(self._workers) - len(self._running)
+        return max(index + 1 - idle, 0)
+
+    def submit(self, user_id: int, func: Callable[..., Any], *args) -> int:
+        """Постановка проверки в очередь
+
+        :param user_id: id пользователя.
+        :param func: Функция проверки.
+        :param args: Аргументы функции.
+        :return: Место в очереди (0 - проверка начнётся сразу).
+        """
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("Scan executor is shut down")
+            if user_id in self._running or any(job.user_id == user_id for job in self._queue):
+                raise RuntimeError(f"User id{user_id} already has a scan")
+            self._queue.append(_ScanJob(user_id, func, args))
+            self._condition.notify()
+            return self._place(len(self._queue) - 1)
+
+    def position(self, user_id: int) -> Optional[int]:
+        """Позиция проверки пользователя в очереди
+
+        :param user_id: id пользователя.
+        :return: 0 - Проверка выполняется или начнётся сразу, иначе место в очереди. None - Проверки нет.
+        """
+        with self._condition:
+            if user_id in self._running:
+                return 0
+            for i, job in enumerate(self._queue):
+                if job.user_id == user_id:
+                    return self._place(i)
+            return None
+
+    def cancel(self, user_id: int) -> bool:
+        """Отмена проверки, которая ещё не началась
+
+        :param user_id: id пользователя.
+        :return: Была ли проверка убрана из очереди.
+        """
+        with self._condition:
+            for job in self._queue:
+                if job.user_id == user_id:
+                    self._queue.remove(job)
+                    return True
+            return False
+
+    @property
+    def queued(self) -> int:
+        """Количество проверок в очереди"""
+        with self._condition:
+            return len(self._queue)
+
+    def shutdown(self, wait: bool = True, cancel_pending: bool = False) -> List[int]:
+        """Остановка пула: новые проверки не принимаются
+
+        :param wait: Ждать окончания выполняющихся проверок.
+        :param cancel_pending: Отменить проверки в очереди (иначе они будут выполнены).
+        :return: id пользователей, чьи проверки были отменены.
+        """
+        with self._condition:
+            self._closed = True
+            cancelled = []
+            if cancel_pending:
+                cancelled = [job.user_id for job in self._queue]
+                self._queue.clear()
+            self._condition.notify_all()
+        if wait:
+            for worker in self._workers:
+                worker.join()
+        logging.info("Scan executor was shut down")
+        return cancelled
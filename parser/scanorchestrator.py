@@ -0,0 +1,205 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from enum import Enum
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from data.appdata.carinfo import CarInfo, DEFAULT
+from data.appdata.functions import save_json
+from data.appdata.myparser import MyParser, ParserOptions, ParserResults
+from data.appdata.driverpool import DriverPool
+from data.appdata.scancache import ScanCache, normalize_number
+from data.appdata.inflight import InflightRegistry, get_inflight_registry
+
+
+class ScanSections(Enum):
+    """Независимые страницы, которые проверяются по известному vin номеру.
+
+    Значение - имя метода MyParser для проверки.
+    """
+    History = "parse_history"
+    Limits = "parse_limits"
+    Hijacking = "parse_hijacking"
+    Inspection = "parse_inspection"
+    Accident = "parse_accident"
+
+
+def merge_car_info(target: CarInfo, source: CarInfo, replace: bool = False) -> None:
+    """Перенос найденных данных из одного CarInfo в другой
+
+    :param target: Куда переносятся данные.
+    :param source: Результат проверки одной страницы.
+    :param replace: Заменять списки (повторная проверка), а не дополнять их.
+    """
+    this = target.__dict__
+    for key, value in source.__dict__.items():
+        if key not in this:
+            continue
+        if type(value) is list:
+            if replace:
+                if len(value) != 0:
+                    this[key] = list(value)
+            elif type(this[key]) is list:
+                this[key].extend(value)
+            else:
+                this[key] = list(value)
+        elif value != DEFAULT:
+            this[key] = value
+
+
+class ScanOrchestrator:
+    """Параллельная проверка страниц об одном автомобиле.
+
+    Каждая страница проверяется отдельным парсером со своим драйвером из пула,
+    результаты собираются в один CarInfo.
+    """
+
+    def __init__(self, driver_pool: DriverPool, options: ParserOptions = ParserOptions(), retry_count: int = 3,
+                 registry: InflightRegistry = None):
+        """
+        :param driver_pool: Пул драйверов для парсеров.
+        :param options: Настройки парсеров.
+        :param retry_count: Количество попыток проверить страницу при ошибке.
+        :param registry: Реестр выполняющихся проверок. None - Общий для процесса.
+        """
+        self.driver_pool = driver_pool
+        self.registry = registry if registry is not None else get_inflight_registry()
+        self.options = options
+        self.retry_count = retry_count
+        self._executor = ThreadPoolExecutor(max_workers=driver_pool.options.max_size,
+                                            thread_name_prefix="scan")
+
+    def _scan_section(self, car_info: CarInfo, section: ScanSections) -> Tuple[ParserResults, CarInfo]:
+        """Проверка одной страницы на отдельном драйвере
+
+        :param car_info: Автомобиль с известным vin номером.
+        :param section: Страница для проверки.
+        :return: Результат и найденная информация.
+        """
+        my_parser = None
+        try:
+            my_parser = MyParser(license_number=car_info.license_number, license_region=car_info.license_region,
+                                 vin_number=car_info.vin_number, options=self.options, driver_pool=self.driver_pool)
+            parser_func = getattr(my_parser, section.value)
+            result = parser_func()
+            for _ in range(self.retry_count - 1):
+                if result != ParserResults.Error:
+                    break
+                result = parser_func()
+        except Exception:
+            logging.error(f"Error appeared while {section.name} parsing: ", exc_info=True)
+            result = ParserResults.Error
+        finally:
+            if my_parser is not None:
+                my_parser.close()
+        return result, my_parser.car_info if my_parser is not None else None
+
+    def scan(self, car_info: CarInfo, sections: Iterable[ScanSections] = ScanSections,
+             replace: bool = False) -> Dict[ScanSections, ParserResults]:
+        """Проверка страниц параллельно и объединение результатов
+
+        :param car_info: Автомобиль с известным vin номером, в него записываются результаты.
+        :param sections: Страницы для проверки.
+        :param replace: Заменять старые результаты (списки) новыми.
+        :return: Результат проверки каждой страницы.
+        """
+        if car_info.vin_number == DEFAULT:
+            raise Exception("To scan sections, you should have vin number")
+        futures = {section: self._executor.submit(self._scan_section, car_info, section) for section in sections}
+        results: Dict[ScanSections, ParserResults] = {}
+        for section, future in futures.items():
+            result, partial = future.result()
+            results[section] = result
+            if result == ParserResults.Ok:
+                merge_car_info(car_info, partial, replace)
+            logging.info(f"{section.name} parsing result: {result.name}")
+        save_json(car_info.get_dictionary(True), car_info.vin_number)
+        return results
+
+    def find_vin(self, number: str) -> Optional[CarInfo]:
+        """Получение vin номера по госномеру
+
+        :param number: vin номер или госномер.
+        :return: Автомобиль с vin номером. None - Если vin номер не найден.
+        """
+        if len(number) == 17:
+            car_info = CarInfo()
+            car_info.vin_number = number
+            return car_info
+        my_parser = MyParser(license_number=number, options=self.options, driver_pool=self.driver_pool)
+        try:
+            for _ in range(self.retry_count):
+                result = my_parser.parse_vin()
+                if result != ParserResults.Error:
+                    break
+        finally:
+            my_parser.close()
+        if result != ParserResults.Ok or my_parser.car_info.vin_number == DEFAULT:
+            return None
+        return my_parser.car_info
+
+    def scan_number(self, number: str, cache: ScanCache = None,
+                    sections: Iterable[ScanSections] = ScanSections) -> Tuple[Optional[CarInfo], ParserResults]:
+        """Проверка автомобиля по vin номеру или госномеру с учётом кэша
+
+        Из кэша берутся свежие результаты, повторно проверяются только устаревшие страницы.
+        Одновременные запросы одного номера (или одного vin номера) выполняются одной проверкой.
+
+        :param number: vin номер или госномер.
+        :param cache: Кэш результатов. None - Проверять всё заново.
+        :param sections: Страницы для проверки.
+        :return: Информация о машине (None - если vin номер не найден) и результат:
+            Skipped - всё взято из кэша, Ok - машина проверена, NotFound - vin номер не найден.
+        """
+        number = normalize_number(number)
+        sections = list(sections)
+        key = f"number:{number}:{','.join(section.name for section in sections)}"
+        return self.registry.run(key, self._scan_number, number, cache, sections)
+
+    def _scan_number(self, number: str, cache: Optional[ScanCache],
+                     sections: List[ScanSections]) -> Tuple[Optional[CarInfo], ParserResults]:
+        """Проверка автомобиля по номеру (без объединения запросов)"""
+        cached = cache.get(number) if cache is not None else None
+        plate_scanned = False
+        if cached is not None:
+            car_info = cached.car_info
+        else:
+            car_info = self.find_vin(number)
+            if car_info is None:
+                return None, ParserResults.NotFound
+            plate_scanned = len(number) != 17
+        # Госномер и vin номер одной машины могут прийти одновременно
+        key = f"vin:{normalize_number(car_info.vin_number)}:{','.join(section.name for section in sections)}"
+        return self.registry.run(key, self._scan_car, car_info, cache, sections, plate_scanned)
+
+    def _scan_car(self, car_info: CarInfo, cache: Optional[ScanCache], sections: List[ScanSections],
+                  plate_scanned: bool) -> Tuple[CarInfo, ParserResults]:
+        """Проверка устаревших страниц автомобиля с известным vin номером
+
+        :param car_info: Автомобиль с vin номером.
+        :param cache: Кэш результатов.
+        :param sections: Страницы для проверки.
+        :param plate_scanned: Был ли vin номер только что получен по госномеру.
+        :return: Информация о машине и результат проверки.
+        """
+        # Кэш отдаёт свою копию машины: её можно дополнять без блокировок
+        cached = cache.get(car_info.vin_number) if cache is not None else None
+        if cached is not None:
+            if plate_scanned:
+                # По госномеру нашлась машина, которая уже проверялась по vin номеру
+                merge_car_info(cached.car_info, car_info, True)
+            car_info = cached.car_info
+        stale = cache.stale_sections(cached, sections) if cache is not None else sections
+        if len(stale) == 0:
+            if plate_scanned:
+                cache.put(car_info, {}, plate_scanned)
+            logging.info(f"Car {car_info.vin_number} was taken from cache")
+            return car_info, ParserResults.Skipped
+        logging.info(f"Car {car_info.vin_number} sections to scan: {', '.join(section.name for section in stale)}")
+        results = self.scan(car_info, stale, cached is not None)
+        if cache is not None:
+            cache.put(car_info, results, plate_scanned)
+        return car_info, ParserResults.Ok
+
+    def shutdown(self) -> None:
+        """Остановка потоков проверки"""
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,76 @@
+import math
+from enum import Enum
+from threading import Lock
+from typing import Dict
+
+
+class CaptchaTypes(Enum):
+    """Типы капч и типичное время их решения сервисом (с)"""
+    Image = 5
+    ReCaptcha = 20
+
+
+class SolveTimeEstimator:
+    """Оценка распределения времени решения капчи одного типа.
+
+    Среднее и дисперсия считаются экспоненциальным скользящим средним,
+    по ним выбирается время первого запроса результата и интервал между запросами.
+    """
+
+    def __init__(self, typical: float, alpha: float = 0.2, min_interval: float = 0.5, max_interval: float = 5):
+        """
+        :param typical: Типичное время решения (начальная оценка среднего).
+        :param alpha: Вес нового наблюдения.
+        :param min_interval: Минимальный интервал между запросами.
+        :param max_interval: Максимальный интервал между запросами.
+        """
+        self.alpha = alpha
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.mean = typical
+        self.variance = (typical / 2) ** 2
+        self._lock = Lock()
+
+    @property
+    def std(self) -> float:
+        """Стандартное отклонение времени решения"""
+        return math.sqrt(self.variance)
+
+    def observe(self, solve_time: float) -> None:
+        """Учёт времени решения очередной капчи"""
+        with self._lock:
+            diff = solve_time - self.mean
+            self.mean += self.alpha * diff
+            self.variance = (1 - self.alpha) * (self.variance + self.alpha * diff * diff)
+
+    def first_poll(self) -> float:
+        """Время от отправки капчи до первого запроса результата
+
+        После типичного времени решения: раньше среднего большинство капч ещё не решены,
+        и запрос только тратит лимит запросов к сервису.
+        """
+        return max(self.mean, self.min_interval)
+
+    def interval(self, elapsed: float) -> float:
+        """Интервал до следующего запроса результата
+
+        :param elapsed: Время с отправки капчи.
+        """
+        # Около ожидаемого времени решения опрашиваем часто, в хвосте распределения - реже
+        distance = abs(elapsed - self.mean) / max(self.std, 1e-3)
+        interval = self.std / 2 * (1 + distance)
+        return min(max(interval, self.min_interval), self.max_interval)
+
+
+_estimators: Dict[CaptchaTypes, SolveTimeEstimator] = {}
+_estimators_lock = Lock()
+
+
+def get_estimator(captcha_type: CaptchaTypes) -> SolveTimeEstimator:
+    """Получение общей для процесса оценки времени решения капчи этого типа"""
+    with _estimators_lock:
+        estimator = _estimators.get(captcha_type)
+        if estimator is None:
+            estimator = SolveTimeEstimator(captcha_type.value)
+            _estimators[captcha_type] = estimator
+        return estimator
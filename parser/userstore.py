@@ -0,0 +1,266 @@
+import json
+import logging
+import os
+import sqlite3
+from threading import Lock, Thread
+from typing import Any, Callable, Iterator, List, Optional, Tuple
+
+from data.appdata.carinfo import CarInfo, DEFAULT
+from data.appdata.scancache import car_plate, normalize_number
+
+# База пользователей бота
+USERS_DB = "data/users.sqlite3"
+# Папка json файлов старых версий
+JSON_DIR = "data/json"
+# Пробельные символы json
+_WHITESPACE = " \t\r\n"
+
+
+def iter_json_items(path: str, chunk_size: int = 1 << 16) -> Iterator[Tuple[str, Any]]:
+    """Чтение пар ключ-значение json объекта верхнего уровня по одной
+
+    Файл читается частями, в памяти держится только текущее значение.
+
+    :param path: Путь к json файлу с объектом.
+    :param chunk_size: Размер читаемой части файла.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8") as file:
+        buffer, pos = "", 0
+
+        def more() -> bool:
+            """Дочитывание файла, прочитанное до pos отбрасывается"""
+            nonlocal buffer, pos
+            chunk = file.read(chunk_size)
+            buffer, pos = buffer[pos:] + chunk, 0
+            return len(chunk) != 0
+
+        def skip(chars: str) -> str:
+            """Пропуск символов, возвращает следующий символ ('' - конец файла)"""
+            nonlocal pos
+            while True:
+                while pos < len(buffer) and buffer[pos] in chars:
+                    pos += 1
+                if pos < len(buffer):
+                    return buffer[pos]
+                if not more():
+                    return ''
+
+        def value() -> Any:
+            """Чтение значения, начинающегося с pos"""
+            nonlocal pos
+            while True:
+                try:
+                    result, end = decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError:
+                    if not more():
+                        raise
+                    continue
+                # Число, которое кончается на конце прочитанного, может продолжаться в следующей части файла
+                if end == len(buffer) and more():
+                    continue
+                pos = end
+                return result
+
+        if skip(_WHITESPACE) != "{":
+            raise ValueError(f"{path} doesn't contain json object")
+        pos += 1
+        while True:
+            char = skip(_WHITESPACE + ",")
+            if char == "}":
+                return
+            if char == '':
+                raise ValueError(f"Unexpected end of {path}")
+            key = value()
+            if skip(_WHITESPACE) != ":":
+                raise ValueError(f"Incorrect json object in {path}")
+            pos += 1
+            skip(_WHITESPACE)
+            yield key, value()
+
+
+class LegacyImporter:
+    """Перенос пользователей из json файла старых версий в хранилище.
+
+    Пользователи переносятся по одному в фоновом потоке за один проход по
+    файлу, бот отвечает сразу и не ждёт переноса. Пользователь, который
+    написал боту до своей очереди, получает перенесённые машины, когда до него
+    дойдёт перенос (on_import). Машины, которые уже есть в хранилище
+    (проверенные во время переноса), не заменяются старыми данными, поэтому
+    перенос можно повторять: прерванный перенос продолжается при следующем запуске.
+    После переноса файл переименовывается в <name>.imported.json.
+    """
+
+    def __init__(self, store, name: str = "users", folder: str = JSON_DIR,
+                 on_import: Optional[Callable[[int], None]] = None):
+        """
+        :param store: Хранилище пользователей (метод import_user).
+        :param name: Имя json файла с пользователями.
+        :param folder: Папка json файла.
+        :param on_import: Вызывается с id каждого перенесённого пользователя.
+        """
+        self.store = store
+        self.path = os.path.join(folder, f"{name}.json")
+        self.on_import = on_import
+        self.count = 0
+        self._done = not os.path.isfile(self.path)
+        self._lock = Lock()
+
+    @property
+    def running(self) -> bool:
+        """Идёт ли перенос"""
+        with self._lock:
+            return not self._done
+
+    def start(self) -> None:
+        """Запуск переноса в фоновом потоке"""
+        if self.running:
+            Thread(target=self.run, name="legacy-import", daemon=True).start()
+
+    def run(self) -> None:
+        """Перенос всех пользователей"""
+        logging.info("Start of importing users data")
+        try:
+            for key, cars in iter_json_items(self.path):
+                self.store.import_user(int(key), cars)
+                self.count += 1
+                if self.on_import is not None:
+                    self.on_import(int(key))
+            os.replace(self.path, f"{self.path[:-len('.json')]}.imported.json")
+            logging.info(f"End of importing users data: {self.count} users")
+        except Exception:
+            logging.error(f"Users data import was stopped after {self.count} users", exc_info=True)
+        finally:
+            with self._lock:
+                self._done = True
+
+
+class UserStore:
+    """Хранилище пользователей бота и их машин в SQLite.
+
+    Сохраняется только изменённая запись (пользователь, машина или связь),
+    машины общие для всех пользователей и хранятся один раз по vin номеру.
+    Подходит для записи из нескольких потоков.
+    """
+
+    def __init__(self, path: str = USERS_DB):
+        """
+        :param path: Путь к файлу базы.
+        """
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self._lock = Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        with self._lock:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.executescript("""
+                CREATE TABLE IF NOT EXISTS users (id INTEGER PRIMARY KEY);
+                CREATE TABLE IF NOT EXISTS cars (vin TEXT PRIMARY KEY, plate TEXT, data TEXT NOT NULL);
+                CREATE INDEX IF NOT EXISTS cars_plate ON cars (plate);
+                CREATE TABLE IF NOT EXISTS user_cars (
+                    user_id INTEGER NOT NULL REFERENCES users (id),
+                    vin TEXT NOT NULL REFERENCES cars (vin),
+                    added INTEGER NOT NULL,
+                    PRIMARY KEY (user_id, vin));""")
+
+    def _execute(self, sql: str, params: tuple = ()) -> List[tuple]:
+        """Выполнение запроса под блокировкой"""
+        with self._lock:
+            return self._connection.execute(sql, params).fetchall()
+
+    @staticmethod
+    def _car_row(car_info: CarInfo) -> tuple:
+        """Строка таблицы cars"""
+        return (normalize_number(car_info.vin_number), car_plate(car_info),
+                json.dumps(car_info.get_dictionary(True), ensure_ascii=False))
+
+    def user_count(self) -> int:
+        """Количество пользователей"""
+        return self._execute("SELECT COUNT(*) FROM users")[0][0]
+
+    def has_user(self, user_id: int) -> bool:
+        """Есть ли пользователь в базе"""
+        return len(self._execute("SELECT 1 FROM users WHERE id = ?", (user_id,))) != 0
+
+    def add_user(self, user_id: int) -> None:
+        """Сохранение нового пользователя"""
+        self._execute("INSERT OR IGNORE INTO users (id) VALUES (?)", (user_id,))
+
+    def save_car(self, car_info: CarInfo) -> None:
+        """Сохранение или обновление машины (для всех пользователей сразу)"""
+        if car_info.vin_number == DEFAULT:
+            return
+        self._execute("INSERT INTO cars (vin, plate, data) VALUES (?, ?, ?) "
+                      "ON CONFLICT (vin) DO UPDATE SET plate = excluded.plate, data = excluded.data",
+                      self._car_row(car_info))
+
+    def add_user_car(self, user_id: int, car_info: CarInfo) -> None:
+        """Сохранение машины и её связи с пользователем одной транзакцией
+
+        :param user_id: id пользователя.
+        :param car_info: Проверенная машина.
+        """
+        if car_info.vin_number == DEFAULT:
+            return
+        row = self._car_row(car_info)
+        with self._lock, self._connection:
+            self._connection.execute("BEGIN")
+            self._connection.execute("INSERT OR IGNORE INTO users (id) VALUES (?)", (user_id,))
+            self._connection.execute("INSERT INTO cars (vin, plate, data) VALUES (?, ?, ?) "
+                                     "ON CONFLICT (vin) DO UPDATE SET plate = excluded.plate, data = excluded.data",
+                                     row)
+            self._connection.execute("INSERT OR IGNORE INTO user_cars (user_id, vin, added) "
+                                     "VALUES (?, ?, (SELECT COUNT(*) FROM user_cars WHERE user_id = ?))",
+                                     (user_id, row[0], user_id))
+
+    def load_user_cars(self, user_id: int) -> List[dict]:
+        """Машины пользователя в порядке добавления
+
+        :param user_id: id пользователя.
+        :return: Словари машин (get_dictionary(True)).
+        """
+        rows = self._execute("SELECT cars.data FROM user_cars JOIN cars ON cars.vin = user_cars.vin "
+                             "WHERE user_cars.user_id = ? ORDER BY user_cars.added", (user_id,))
+        return [json.loads(data) for data, in rows]
+
+    def find_car(self, number: str) -> Optional[dict]:
+        """Поиск машины по vin номеру или госномеру
+
+        :param number: vin номер или госномер.
+        :return: Словарь машины. None - Если машины нет.
+        """
+        number = normalize_number(number)
+        rows = self._execute("SELECT data FROM cars WHERE vin = ? OR plate = ? LIMIT 1", (number, number))
+        return json.loads(rows[0][0]) if rows else None
+
+    def scan_backend(self) -> None:
+        """Хранилище для кэша результатов проверки: кэш хранится в своей SQLite базе (ScanStore)"""
+        return None
+
+    def import_user(self, user_id: int, cars: List[dict]) -> None:
+        """Перенос пользователя из json файла старых версий одной транзакцией
+
+        Машины, которые уже есть в базе, не заменяются: там данные новее.
+
+        :param user_id: id пользователя.
+        :param cars: Словари машин пользователя.
+        """
+        with self._lock, self._connection:
+            self._connection.execute("BEGIN")
+            self._connection.execute("INSERT OR IGNORE INTO users (id) VALUES (?)", (user_id,))
+            for i, info in enumerate(cars):
+                car_info = CarInfo()
+                car_info.load_from_json(info)
+                if car_info.vin_number == DEFAULT:
+                    continue
+                row = self._car_row(car_info)
+                self._connection.execute("INSERT OR IGNORE INTO cars (vin, plate, data) VALUES (?, ?, ?)", row)
+                self._connection.execute("INSERT OR IGNORE INTO user_cars (user_id, vin, added) VALUES (?, ?, ?)",
+                                         (user_id, row[0], i))
+
+    def close(self) -> None:
+        """Закрытие базы"""
+        with self._lock:
+            self._connection.close()
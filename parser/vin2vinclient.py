@@ -0,0 +1,173 @@
+import logging
+from html.parser import HTMLParser
+from threading import Lock
+from typing import Dict, List, Optional
+from urllib.parse import urljoin
+
+import requests
+
+from data.appdata.httpsession import HttpOptions, get_http_session
+from data.appdata.mycaptchasolver import MyCaptchaSolver
+from data.appdata.waits import is_gif
+
+
+class _Vin2VinPage(HTMLParser):
+    """Разбор страницы vin2vin: форма проверки и таблицы результата"""
+
+    def __init__(self):
+        super().__init__()
+        self.forms: List[Dict] = []
+        self.tables: List[List[List[str]]] = []
+        self._cell: Optional[List[str]] = None
+
+    def handle_starttag(self, tag: str, attrs: list) -> None:
+        attrs = {name: value if value is not None else '' for name, value in attrs}
+        if tag == "form":
+            self.forms.append({"action": attrs.get("action", ''), "method": attrs.get("method", "get").lower(),
+                               "inputs": []})
+        elif tag in ("input", "button", "textarea") and self.forms and attrs.get("name"):
+            self.forms[-1]["inputs"].append(attrs)
+        elif tag == "table":
+            self.tables.append([])
+        elif tag == "tr" and self.tables:
+            self.tables[-1].append([])
+        elif tag == "td" and self.tables and self.tables[-1]:
+            self._cell = []
+        elif tag == "br" and self._cell is not None:
+            self._cell.append("\n")
+
+    def handle_endtag(self, tag: str) -> None:
+        if tag == "td" and self._cell is not None:
+            # Пробелы схлопываются так же, как в innerText браузера
+            lines = (' '.join(line.split()) for line in ''.join(self._cell).split("\n"))
+            self.tables[-1][-1].append("\n".join(lines).strip())
+            self._cell = None
+
+    def handle_data(self, data: str) -> None:
+        if self._cell is not None:
+            self._cell.append(data)
+
+    def captcha_form(self) -> Optional[Dict]:
+        """Форма с полями VIN и капчи"""
+        for form in self.forms:
+            if any(item.get("id") == "exampleInputPassword2" for item in form["inputs"]):
+                return form
+        return None
+
+
+# Адрес картинки капчи, который подставляет скрипт страницы vin2vin (в HTML страницы - gif-заглушка)
+_captcha_url: Optional[str] = None
+_captcha_lock = Lock()
+
+
+def remember_captcha_url(page_url: str, src: Optional[str]) -> bool:
+    """Запоминание адреса картинки капчи, загруженной скриптом страницы в браузере
+
+    :param page_url: Адрес страницы.
+    :param src: src картинки после загрузки.
+    :return: Можно ли запросить картинку без браузера (data URL и заглушка не подходят).
+    """
+    global _captcha_url
+    if not src or src.startswith("data:") or is_gif(src):
+        return False
+    with _captcha_lock:
+        _captcha_url = urljoin(page_url, src)
+    return True
+
+
+def get_captcha_url() -> Optional[str]:
+    """Адрес картинки капчи vin2vin. None - Если он ещё не получен из браузера."""
+    return _captcha_url
+
+
+class Vin2VinClient:
+    """Получение таблиц vin2vin без браузера.
+
+    Страница загружается обычным HTTP запросом, картинка капчи запрашивается
+    тем же запросом, что и скрипт страницы (адрес берётся из браузера, см.
+    remember_captcha_url), с cookies этой страницы. Форма с VIN отправляется
+    запросом из её action, таблицы результата разбираются из HTML ответа.
+    """
+
+    def __init__(self, solver: MyCaptchaSolver, http_options: HttpOptions = HttpOptions()):
+        """
+        :param solver: Решатель капч (без драйвера).
+        :param http_options: Настройки HTTP клиента.
+        """
+        self.solver = solver
+        self.http_options = http_options
+
+    def _session(self) -> requests.Session:
+        """Сессия со своими cookies, но общим пулом соединений
+
+        Сессия не закрывается: close закрыл бы общие адаптеры get_http_session.
+        """
+        shared = get_http_session(self.http_options)
+        session = requests.Session()
+        session.headers.update({"User-Agent": "Mozilla/5.0 (X11; Linux x86_64; rv:109.0) "
+                                              "Gecko/20100101 Firefox/115.0"})
+        for prefix, adapter in shared.adapters.items():
+            session.mount(prefix, adapter)
+        return session
+
+    def _load_captcha(self, session: requests.Session, captcha_url: str, referer: str) -> bytes:
+        """Получение новой картинки капчи для cookies сессии
+
+        :param session: Сессия страницы (капча привязана к её cookies).
+        :param captcha_url: Адрес картинки.
+        :param referer: Адрес страницы.
+        :return: Картинка в байтах.
+        """
+        res = session.get(captcha_url, headers={"Referer": referer}, timeout=self.http_options.timeout)
+        res.raise_for_status()
+        content_type = res.headers.get("Content-Type", '').split(";")[0].strip().lower()
+        if not content_type.startswith("image/") or content_type == "image/gif":
+            raise Exception(f"vin2vin captcha isn't an image: {content_type}")
+        return res.content
+
+    def fetch_tables(self, url: str, vin: str) -> Optional[List[List[List[str]]]]:
+        """Получение таблиц результата проверки VIN
+
+        :param url: Ссылка на страницу vin2vin (history, restricted, wanted, eaisto).
+        :param vin: VIN номер.
+        :return: Текст ячеек: таблица -> строка -> ячейка. None - Если адрес капчи ещё неизвестен.
+        """
+        captcha_url = get_captcha_url()
+        if captcha_url is None:
+            return None
+        session = self._session()
+        res = session.get(url, timeout=self.http_options.timeout)
+        res.raise_for_status()
+        page = _Vin2VinPage()
+        page.feed(res.text)
+        form = page.captcha_form()
+        if form is None:
+            raise Exception("Form wasn't found on vin2vin page")
+        captcha_value = self.solver.submit_image(self._load_captcha(session, captcha_url, url), "vin2vin").value()
+        if captcha_value == '-1':
+            raise Exception("vin2vin captcha wasn't solved")
+        data = {}
+        for item in form["inputs"]:
+            if item.get("type") in ("checkbox", "radio") and "checked" not in item:
+                continue
+            if item.get("id") == "exampleInputEmail2":
+                data[item["name"]] = vin
+            elif item.get("id") == "exampleInputPassword2":
+                data[item["name"]] = captcha_value
+            else:
+                data.setdefault(item["name"], item.get("value", ''))
+        action = urljoin(url, form["action"] or url)
+        logging.info("Opening vin2vin page without browser")
+        if form["method"] == "post":
+            res = session.post(action, data=data, headers={"Referer": url}, timeout=self.http_options.timeout)
+        else:
+            res = session.get(action, params=data, headers={"Referer": url}, timeout=self.http_options.timeout)
+        res.raise_for_status()
+        result = _Vin2VinPage()
+        result.feed(res.text)
+        if not result.tables:
+            # Ответ на капчу не принят (или страница изменилась) - проверка повторяется в браузере
+            self.solver.collector.discard("vin2vin")
+            raise Exception("Tables weren't found on vin2vin result page")
+        self.solver.collector.commit("vin2vin")
+        return result.tables
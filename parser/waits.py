@@ -0,0 +1,89 @@
+import time
+from typing import Callable, Optional, Tuple, Union
+from urllib.parse import urlparse
+
+from selenium import webdriver
+from selenium.common.exceptions import StaleElementReferenceException, NoSuchElementException
+from selenium.webdriver.remote.webelement import WebElement
+from selenium.webdriver.support.ui import WebDriverWait
+
+Locator = Tuple[str, str]
+
+
+def is_gif(src: str) -> bool:
+    """Ссылка на gif картинку (по MIME типу data url или расширению файла)
+
+    :param src: Значение src картинки.
+    """
+    if src.startswith("data:"):
+        # Base64 данные jpeg тоже могут содержать "gif", смотрится только заголовок
+        return src[5:src.find(",")].split(";")[0].strip().lower() == "image/gif"
+    return urlparse(src).path.lower().endswith(".gif")
+
+
+class image_loaded:
+    """Условие ожидания: картинка загружена (src есть и это не gif-заглушка).
+
+    Возвращает элемент картинки.
+    """
+
+    def __init__(self, locator: Locator, parent: Optional[WebElement] = None):
+        """
+        :param locator: Поиск картинки (By, значение).
+        :param parent: Элемент, внутри которого ищется картинка.
+        """
+        self.locator = locator
+        self.parent = parent
+
+    def __call__(self, driver: webdriver.Firefox) -> Union[WebElement, bool]:
+        root = self.parent if self.parent is not None else driver
+        try:
+            element = root.find_element(*self.locator)
+            src = element.get_attribute("src")
+        except (NoSuchElementException, StaleElementReferenceException):
+            return False
+        if src is None or len(src) == 0 or is_gif(src):
+            return False
+        return element
+
+
+def document_ready(driver: webdriver.Firefox) -> bool:
+    """Условие ожидания: документ полностью загружен"""
+    return driver.execute_script("return document.readyState;") == "complete"
+
+
+class network_idle:
+    """Условие ожидания: документ загружен и новые ресурсы не запрашиваются quiet_time секунд"""
+
+    _script = "return [document.readyState, performance.getEntriesByType('resource').length];"
+
+    def __init__(self, quiet_time: float = 1):
+        """
+        :param quiet_time: Время без новых запросов.
+        """
+        self.quiet_time = quiet_time
+        self._count = -1
+        self._changed = time.monotonic()
+
+    def __call__(self, driver: webdriver.Firefox) -> bool:
+        state, count = driver.execute_script(self._script)
+        now = time.monotonic()
+        if state != "complete" or count != self._count:
+            self._count = count
+            self._changed = now
+            return False
+        return now - self._changed >= self.quiet_time
+
+
+def wait_until(driver: webdriver.Firefox, condition: Callable, timeout: float, message: str = "",
+               poll_frequency: float = 0.25):
+    """Ожидание условия с бюджетом времени на шаг
+
+    :param driver: Веб-драйвер.
+    :param condition: Условие ожидания (expected_conditions или условия из этого модуля).
+    :param timeout: Время, отведённое на шаг.
+    :param message: Текст ошибки TimeoutException.
+    :param poll_frequency: Частота проверки условия.
+    :return: Значение, которое вернуло условие.
+    """
+    return WebDriverWait(driver, timeout, poll_frequency=poll_frequency).until(condition, message)
@@ -0,0 +1,183 @@
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+
+from django.db import IntegrityError, transaction
+
+from data.appdata.carnumbers import normalize_number
+from data.appdata.scancache import merge_scanned
+from .models import User, Car, UserCar, RegistrationHistory, Accident, DEFAULT
+
+# Почта для пользователей телеграмм бота (поле почты обязательно)
+TELEGRAM_EMAIL = "{}@telegram.bot"
+# Связанные записи, которые понимает CarInfo бота (остальные списки он не загружает)
+BOT_RELATIONS = ("registration_history", "accidents")
+
+
+def save_car_json(info: Dict, scanned: Dict[str, float] = None, plate_scanned: float = None,
+                  replace: bool = True) -> Car:
+    """Сохранение машины из словаря бота (CarInfo.get_dictionary(True))
+
+    :param info: Словарь машины с русскими или английскими названиями.
+    :param scanned: Время проверки страниц для кэша результатов (объединяется с сохранённым).
+    :param plate_scanned: Время получения vin номера по госномеру (берётся более позднее).
+    :param replace: Заменять данные машины, если она уже есть в базе.
+    :return: Сохранённая машина.
+    """
+    translation = Car.en_names()
+    values = {translation.get(key, key): value for key, value in info.items()}
+    with transaction.atomic():
+        vin = normalize_number(values["vin_number"])
+        car, created = Car.objects.select_for_update().get_or_create(vin_number=vin)
+        if not created and not replace:
+            return car
+        car.load_from_json(values, False)
+        # В словаре vin номер может быть записан иначе (регистр, кириллица)
+        car.vin_number = vin
+        if scanned is not None:
+            car.scanned_sections = merge_scanned(car.scanned_sections, scanned)
+        if plate_scanned is not None:
+            car.plate_scanned = max(plate_scanned, car.plate_scanned)
+        car.save()
+        for key, model, related in [("registration_history", RegistrationHistory, car.reg_history),
+                                    ("accidents", Accident, car.accidents)]:
+            if type(values.get(key)) is not list:
+                continue
+            related.all().delete()
+            records = []
+            for item in values[key]:
+                record = model(car=car)
+                record.load_from_json(item)
+                records.append(record)
+            model.objects.bulk_create(records)
+    return car
+
+
+class DjangoUserStore:
+    """Хранилище пользователей бота в базе сайта.
+
+    Пользователи бота - записи User с telegram_id, их машины - связи UserCar,
+    таблица машин общая с сайтом, поэтому машина, проверенная на сайте,
+    сразу доступна в боте и наоборот. Методы те же, что у UserStore.
+    """
+
+    def _users(self):
+        """Пользователи бота"""
+        return User.objects.filter(telegram_id__isnull=False)
+
+    def _get_or_create_user(self, user_id: int) -> User:
+        """Пользователь бота, создаётся при первом обращении"""
+        user = User.objects.filter(telegram_id=user_id).first()
+        if user is not None:
+            return user
+        try:
+            with transaction.atomic():
+                return User.objects.create_user(TELEGRAM_EMAIL.format(user_id), telegram_id=user_id)
+        except IntegrityError:
+            # Пользователь был создан из другого потока
+            return User.objects.get(telegram_id=user_id)
+
+    def user_count(self) -> int:
+        """Количество пользователей бота"""
+        return self._users().count()
+
+    def has_user(self, user_id: int) -> bool:
+        """Есть ли пользователь в базе"""
+        return self._users().filter(telegram_id=user_id).exists()
+
+    def add_user(self, user_id: int) -> None:
+        """Сохранение нового пользователя"""
+        self._get_or_create_user(user_id)
+
+    def save_car(self, car_info) -> None:
+        """Сохранение или обновление машины (для всех пользователей сразу)"""
+        if car_info.vin_number == DEFAULT:
+            return
+        save_car_json(car_info.get_dictionary(True))
+
+    def add_user_car(self, user_id: int, car_info) -> None:
+        """Сохранение машины и её связи с пользователем одной транзакцией
+
+        :param user_id: id пользователя.
+        :param car_info: Проверенная машина (CarInfo бота).
+        """
+        with transaction.atomic():
+            user = self._get_or_create_user(user_id)
+            car = save_car_json(car_info.get_dictionary(True))
+            UserCar.objects.get_or_create(user=user, car=car)
+
+    def load_user_cars(self, user_id: int) -> List[dict]:
+        """Машины пользователя в порядке добавления
+
+        :param user_id: id пользователя.
+        :return: Словари машин с русскими названиями.
+        """
+        cars = Car.objects.filter(car_info__user__telegram_id=user_id).order_by("car_info__id")
+        return Car.serialize_queryset(cars, True, relations=BOT_RELATIONS)
+
+    def _find(self, number: str) -> Optional[Car]:
+        """Поиск машины по vin номеру или госномеру"""
+        number = normalize_number(number)
+        # Оба поля индексированы, машина с таким vin номером важнее машины с таким госномером
+        car = Car.objects.filter(vin_number=number).first()
+        if car is None:
+            car = Car.objects.filter(plate=number).order_by("-plate_scanned").first()
+        return car
+
+    def find_car(self, number: str) -> Optional[dict]:
+        """Поиск машины по vin номеру или госномеру
+
+        :param number: vin номер или госномер.
+        :return: Словарь машины. None - Если машины нет.
+        """
+        car = self._find(number)
+        return car.serialize(True, relations=BOT_RELATIONS) if car is not None else None
+
+    def scan_backend(self) -> "DjangoUserStore":
+        """Хранилище для кэша результатов проверки (ScanCache)"""
+        return self
+
+    def load_scan(self, number: str) -> Optional[Tuple[dict, Dict[str, float], float]]:
+        """Машина и время проверки её страниц для кэша результатов
+
+        :param number: vin номер или госномер.
+        :return: Словарь машины, время проверки страниц и время получения vin номера по госномеру.
+        """
+        car = self._find(number)
+        if car is None:
+            return None
+        return car.serialize(True, relations=BOT_RELATIONS), dict(car.scanned_sections), car.plate_scanned
+
+    def save_scan(self, car_info, scanned: Dict[str, float], plate_scanned: float) -> None:
+        """Сохранение машины и времени проверки её страниц из кэша результатов"""
+        save_car_json(car_info.get_dictionary(True), scanned, plate_scanned)
+
+    def import_user(self, user_id: int, cars: List[dict]) -> None:
+        """Перенос пользователя из json файла бота одной транзакцией
+
+        Машины, которые уже есть в базе, не заменяются: там данные новее.
+
+        :param user_id: id пользователя.
+        :param cars: Словари машин пользователя.
+        """
+        with transaction.atomic():
+            user = self._get_or_create_user(user_id)
+            for info in cars:
+                if info.get("VIN номер", info.get("vin_number", DEFAULT)) == DEFAULT:
+                    continue
+                UserCar.objects.get_or_create(user=user, car=save_car_json(info, replace=False))
+
+    def close(self) -> None:
+        """Соединения с базой закрывает Django"""
+
+
+_bot_store: Optional[DjangoUserStore] = None
+_bot_store_lock = Lock()
+
+
+def get_bot_store() -> DjangoUserStore:
+    """Общее хранилище пользователей бота в базе сайта"""
+    global _bot_store
+    with _bot_store_lock:
+        if _bot_store is None:
+            _bot_store = DjangoUserStore()
+        return _bot_store
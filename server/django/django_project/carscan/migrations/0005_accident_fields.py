@@ -0,0 +1,48 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('carscan', '0004_add_users'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='accident',
+            name='number',
+            field=models.CharField(default='Нет информации', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='accident',
+            name='date',
+            field=models.CharField(default='Нет информации', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='accident',
+            name='accident_type',
+            field=models.CharField(default='Нет информации', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='accident',
+            name='region',
+            field=models.CharField(default='Нет информации', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='accident',
+            name='damage_points',
+            field=models.CharField(default='Нет информации', max_length=200),
+        ),
+        migrations.AddField(
+            model_name='accident',
+            name='vehicle_count',
+            field=models.CharField(default='Нет информации', max_length=3),
+        ),
+        migrations.AlterField(
+            model_name='accident',
+            name='img_path',
+            field=models.FilePathField(default=None, null=True),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.2.25 on 2026-10-18 18:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('carscan', '0005_accident_fields'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='telegram_id',
+            field=models.BigIntegerField(default=None, null=True, unique=True, verbose_name='Telegram Id'),
+        ),
+        migrations.AddField(
+            model_name='car',
+            name='scanned_sections',
+            field=models.JSONField(default=dict),
+        ),
+        migrations.AddField(
+            model_name='car',
+            name='plate_scanned',
+            field=models.FloatField(default=0),
+        ),
+    ]
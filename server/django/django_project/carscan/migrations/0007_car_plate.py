@@ -0,0 +1,40 @@
+# Generated by Django 3.2.25 on 2026-10-18 19:00
+
+from django.db import migrations, models
+
+# Копия нормализации номеров на момент миграции (миграция не должна зависеть от кода парсера)
+_PLATE_LETTERS = str.maketrans("ABEKMHOPCTYX", "АВЕКМНОРСТУХ")
+_VIN_LETTERS = str.maketrans("АВЕКМНОРСТУХ", "ABEKMHOPCTYX")
+
+
+def normalize_number(number):
+    number = ''.join(number.split()).replace('-', '').upper()
+    if len(number) == 17:
+        return number.translate(_VIN_LETTERS)
+    return number.translate(_PLATE_LETTERS)
+
+
+def fill_plates(apps, schema_editor):
+    """Заполнение госномера для поиска у уже сохранённых машин (как Car.get_plate)"""
+    Car = apps.get_model('carscan', 'Car')
+    cars = list(Car.objects.exclude(license_number='Нет информации').only('id', 'license_number', 'license_region'))
+    for car in cars:
+        region = car.license_region if car.license_region != 'Нет информации' else ''
+        car.plate = normalize_number(car.license_number + region)
+    Car.objects.bulk_update(cars, ['plate'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('carscan', '0006_bot_store'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='car',
+            name='plate',
+            field=models.CharField(db_index=True, default='', max_length=12),
+        ),
+        migrations.RunPython(fill_plates, migrations.RunPython.noop),
+    ]
@@ -3,7 +3,8 @@ from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, Permis
 from django.utils.translation import gettext_lazy as _
 import logging
 from dataclasses import dataclass, field
-from typing import List, Dict, Any, Union, ClassVar
+from types import MappingProxyType
+from typing import List, Dict, Any, Union, ClassVar, Optional, Mapping, Tuple, Iterable
 from abc import ABC, abstractmethod
 
 
@@ -56,6 +57,8 @@ class User(AbstractBaseUser, PermissionsMixin):
     registration_date = models.DateField("Registration Date", auto_now_add=True)
     is_active = models.BooleanField(default=True)
     is_staff = models.BooleanField(default=False)
+    # Пользователи телеграмм бота хранятся в той же таблице
+    telegram_id = models.BigIntegerField("Telegram Id", unique=True, null=True, default=None)
 
     objects = CustomUserManager()
 
@@ -81,36 +84,85 @@ class CarInfo(models.Model):
     class Meta:
         abstract = True
 
+    @classmethod
+    def _translations(cls) -> Tuple[Mapping[str, str], Mapping[str, str]]:
+        """Названия свойств из описания класса: en -> ru и ru -> en
+
+        Описание разбирается один раз на класс, словари неизменяемые и общие для всех объектов.
+        """
+        translations = cls.__dict__.get("_translations_cache")
+        if translations is None:
+            ru_names: Dict[str, str] = {}
+            en_names: Dict[str, str] = {}
+            for line in (cls.__doc__ or "").split("\n"):
+                if ":" in line:
+                    en = line[:line.find(":")].strip()
+                    ru = line[line.find(":") + 1: -1].strip()
+                    ru_names[en] = ru
+                    en_names[ru] = en
+            translations = (MappingProxyType(ru_names), MappingProxyType(en_names))
+            cls._translations_cache = translations
+        return translations
+
+    @classmethod
+    def ru_names(cls) -> Mapping[str, str]:
+        """Русские названия свойств: en -> ru"""
+        return cls._translations()[0]
+
+    @classmethod
+    def en_names(cls) -> Mapping[str, str]:
+        """Английские названия свойств: ru -> en"""
+        return cls._translations()[1]
+
     @abstractmethod
-    def _get_ru_names(self) -> Dict[str, str]:
+    def _get_ru_names(self) -> Mapping[str, str]:
         """Получения русских названий свойств из описания"""
-        translation: Dict[str, str] = {}
-        for line in self.__doc__.split("\n"):
-            if ":" in line:
-                en = line[:line.find(":")].strip()
-                ru = line[line.find(":") + 1: -1].strip()
-                translation[en] = ru
-        return translation
+        return self.ru_names()
 
     @abstractmethod
-    def _get_en_names(self) -> Dict[str, str]:
+    def _get_en_names(self) -> Mapping[str, str]:
         """Получения русских названий свойств из описания"""
-        translation: Dict[str, str] = {}
-        for line in self.__doc__.split("\n"):
-            if ":" in line:
-                en = line[:line.find(":")].strip()
-                ru = line[line.find(":") + 1: -1].strip()
-                translation[ru] = en
-        return translation
+        return self.en_names()
+
+    @classmethod
+    def schema(cls) -> Tuple[str, ...]:
+        """Поля модели из описания класса в порядке описания (считаются один раз на класс)"""
+        schema = cls.__dict__.get("_schema_cache")
+        if schema is None:
+            fields = {field.name for field in cls._meta.concrete_fields}
+            schema = tuple(name for name in cls.ru_names() if name in fields)
+            cls._schema_cache = schema
+        return schema
+
+    @classmethod
+    def _keys(cls, translate: bool) -> List[str]:
+        """Ключи словаря для полей schema()"""
+        if not translate:
+            return list(cls.schema())
+        names = cls.ru_names()
+        return [names[name] for name in cls.schema()]
+
+    def serialize(self, translate: bool = False) -> Dict[str, Any]:
+        """Словарь только полей из описания класса
+
+        :param translate: Русские названия вместо английских.
+        """
+        return dict(zip(self._keys(translate), [getattr(self, name) for name in self.schema()]))
+
+    @classmethod
+    def serialize_queryset(cls, queryset, translate: bool = False) -> List[Dict[str, Any]]:
+        """Словари всех записей одним запросом, без создания объектов моделей
+
+        :param queryset: Записи этой модели.
+        :param translate: Русские названия вместо английских.
+        """
+        keys = cls._keys(translate)
+        return [dict(zip(keys, row)) for row in queryset.values_list(*cls.schema())]
 
     @abstractmethod
     def get_dictionary(self, translate: bool = False) -> Dict[str, str]:
         """Получение словаря всех данных"""
-        dictionary: Dict[str, str] = self.__dict__
-        if translate:
-            translation = self._get_ru_names()
-            dictionary = dict(map(lambda item: (translation[item[0]], item[1]), dictionary.items()))
-        return dictionary
+        return self.serialize(translate)
 
     @abstractmethod
     def load_from_json(self, dictionary: Dict[str, Union[str, List[Dict[str, str]]]], translate: bool = True):
@@ -191,42 +243,113 @@ class Car(CarInfo):
     pts_owner = models.CharField(max_length=3, default=DEFAULT)
     hijacking = models.TextField(default=DEFAULT)
     report_path = models.FilePathField(null=True, default=None)
+    # Время проверки каждой страницы (имя ScanSections -> timestamp) для кэша результатов
+    scanned_sections = models.JSONField(default=dict)
+    plate_scanned = models.FloatField(default=0)
+    # Госномер с регионом в нормализованном виде для поиска (заполняется при сохранении)
+    plate = models.CharField(max_length=12, default="", db_index=True)
 
 
     class Meta:
         db_table = "cars"
 
-    def __str__(self):
-        return f"Госномер {self.license_number}{self.get_dictionary()}" + f" VIN {self.vin_number}"
+    # Связанные записи из описания -> related_name
+    _related_records: ClassVar[Dict[str, str]] = {
+        "registration_history": "reg_history",
+        "vehicle_limits": "limits",
+        "inspections": "inspections",
+        "accidents": "accidents",
+        "fines": "fines",
+    }
 
-    def _get_ru_names(self) -> Dict[str, str]:
+    def __str__(self):
+        return f"Госномер {self.license_number}{self.serialize(related=False)}" + f" VIN {self.vin_number}"
+
+    def get_plate(self) -> str:
+        """Госномер с регионом в нормализованном виде. '' - Если госномер неизвестен."""
+        # Нормализация номеров общая с парсером (модуль без зависимостей)
+        from data.appdata.carnumbers import normalize_number
+        if self.license_number == DEFAULT:
+            return ""
+        region = self.license_region if self.license_region != DEFAULT else ""
+        return normalize_number(self.license_number + region)
+
+    def save(self, *args, **kwargs):
+        self.plate = self.get_plate()
+        super().save(*args, **kwargs)
+
+    def _get_ru_names(self) -> Mapping[str, str]:
         """Получения русских названий свойств из описания"""
         return super()._get_ru_names()
 
-    def _get_en_names(self) -> Dict[str, str]:
+    def _get_en_names(self) -> Mapping[str, str]:
         """Получения русских названий свойств из описания"""
         return super()._get_en_names()
 
-    def _get_dictionary_from_list(self, records: List[CarInfo]) -> List[Dict[str, str]]:
-        """Получение словаря из списка классов данных"""
-        return [record.get_dictionary() for record in records]
+    @classmethod
+    def _related_key(cls, name: str, translate: bool) -> str:
+        """Ключ словаря для связанных записей"""
+        return cls.ru_names()[name] if translate else name
+
+    @classmethod
+    def _relations(cls, relations: Optional[Iterable[str]]) -> List[Tuple[str, str]]:
+        """Выбранные связанные записи: (название из описания, related_name). None - все."""
+        if relations is None:
+            return list(cls._related_records.items())
+        return [(name, cls._related_records[name]) for name in relations]
+
+    def serialize(self, translate: bool = False, related: bool = True,
+                  relations: Iterable[str] = None) -> Dict[str, Union[str, List[Dict[str, Any]]]]:
+        """Словарь полей из описания и связанных записей
+
+        :param translate: Русские названия вместо английских.
+        :param related: Добавлять связанные записи (по запросу на каждый тип записей).
+        :param relations: Названия связанных записей из описания. None - все.
+        """
+        dictionary: Dict[str, Union[str, List[Dict[str, Any]]]] = super().serialize(translate)
+        if related:
+            for name, related_name in self._relations(relations):
+                model = getattr(Car, related_name).rel.related_model
+                records = model.serialize_queryset(getattr(self, related_name).order_by("id"), translate)
+                dictionary[self._related_key(name, translate)] = records if records else DEFAULT
+        return dictionary
+
+    @classmethod
+    def serialize_queryset(cls, queryset, translate: bool = False,
+                           related: bool = True,
+                           relations: Iterable[str] = None) -> List[Dict[str, Union[str, List[Dict[str, Any]]]]]:
+        """Словари всех машин: один запрос на машины и по одному на каждый тип связанных записей
+
+        :param queryset: Машины.
+        :param translate: Русские названия вместо английских.
+        :param related: Добавлять связанные записи.
+        :param relations: Названия связанных записей из описания. None - все.
+        """
+        keys = cls._keys(translate)
+        rows = list(queryset.values_list("id", *cls.schema()))
+        cars = [dict(zip(keys, row[1:])) for row in rows]
+        if not related or len(rows) == 0:
+            return cars
+        by_id: Dict[int, List[Dict[str, Any]]] = {}
+        for row, car in zip(rows, cars):
+            by_id.setdefault(row[0], []).append(car)
+        for name, related_name in cls._relations(relations):
+            rel = getattr(cls, related_name).rel
+            model = rel.related_model
+            record_keys = model._keys(translate)
+            records: Dict[int, List[Dict[str, Any]]] = {}
+            for row in (model.objects.filter(**{f"{rel.field.name}__in": list(by_id)}).order_by("id")
+                        .values_list(rel.field.attname, *model.schema())):
+                records.setdefault(row[0], []).append(dict(zip(record_keys, row[1:])))
+            key = cls._related_key(name, translate)
+            for car_id, items in by_id.items():
+                for car in items:
+                    car[key] = records.get(car_id, DEFAULT)
+        return cars
 
     def get_dictionary(self, translate: bool = False) -> Dict[str, Union[str, List[Dict[str, str]]]]:
         """Получение словаря всех данных"""
-        dictionary: Dict[str, Union[str, List[Dict[str, str]]]] = {}
-        for key, value in self.__dict__.items():
-            if type(value) is list:
-                if len(value) == 0:
-                    dictionary[key] = DEFAULT
-                else:
-                    dictionary[key] = self._get_dictionary_from_list(value)
-            else:
-                dictionary[key] = value
-        if translate:
-            if translate:
-                translation = self._get_ru_names()
-                dictionary = dict(map(lambda item: (translation[item[0]], item[1]), dictionary.items()))
-        return dictionary
+        return self.serialize(translate)
 
     def set_dictionary(self, dictionary, translate: bool = True) -> None:
         """Заполнение"""
@@ -288,11 +411,11 @@ class RegistrationHistory(CarInfo):
     def __str__(self):
         return f"Регистрация {self.car.id} {self.period}\n{self.description}"
 
-    def _get_ru_names(self) -> Dict[str, str]:
+    def _get_ru_names(self) -> Mapping[str, str]:
         """Получения русских названий свойств из описания"""
         return super()._get_ru_names()
 
-    def _get_en_names(self) -> Dict[str, str]:
+    def _get_en_names(self) -> Mapping[str, str]:
         """Получения русских названий свойств из описания"""
         return super()._get_en_names()
 
@@ -306,7 +429,10 @@ class RegistrationHistory(CarInfo):
 
 
 class VehicleLimits(CarInfo):
-    """Ограничения у автомобиля"""
+    """Ограничения у автомобиля
+
+    description: Описание ограничения.
+    """
 
     car = models.ForeignKey(Car, on_delete=models.CASCADE, related_name="limits")
     description = models.TextField()
@@ -317,17 +443,17 @@ class VehicleLimits(CarInfo):
     def __str__(self):
         return f"Ограничения автомобиля {self.car.id}: {self.description}"
 
-    def _get_ru_names(self) -> Dict[str, str]:
+    def _get_ru_names(self) -> Mapping[str, str]:
         """Получения русских названий свойств из описания"""
         return super()._get_ru_names()
 
-    def _get_en_names(self) -> Dict[str, str]:
+    def _get_en_names(self) -> Mapping[str, str]:
         """Получения русских названий свойств из описания"""
         return super()._get_en_names()
 
     def get_dictionary(self, translate: bool = False) -> Dict[str, str]:
         """Получение словаря всех данных"""
-        return super().get_dictionary()
+        return super().get_dictionary(translate)
 
     def load_from_json(self, dictionary: Dict[str, str], translate: bool = True):
         """Загрузка из json файла"""
@@ -353,17 +479,17 @@ class Inspection(CarInfo):
     def __str__(self):
         return f"Пробег {self.mileage}"
 
-    def _get_ru_names(self) -> Dict[str, str]:
+    def _get_ru_names(self) -> Mapping[str, str]:
         """Получения русских названий свойств из описания"""
         return super()._get_ru_names()
 
-    def _get_en_names(self) -> Dict[str, str]:
+    def _get_en_names(self) -> Mapping[str, str]:
         """Получения русских названий свойств из описания"""
         return super()._get_en_names()
 
     def get_dictionary(self, translate: bool = False) -> Dict[str, str]:
         """Получение словаря всех данных"""
-        return super().get_dictionary()
+        return super().get_dictionary(translate)
 
     def load_from_json(self, dictionary: Dict[str, str], translate: bool = True):
         """Загрузка из json файла"""
@@ -373,11 +499,24 @@ class Inspection(CarInfo):
 class Accident(CarInfo):
     """ДТП с участием автомобиля
 
+    number: Номер происшествия.
+    date: Дата и время происшествия.
+    accident_type: Тип происшествия.
+    region: Регион происшествия.
+    damage_points: Место первичного удара.
+    vehicle_count: Количество ТС.
     img_path: Путь к фотографии.
     """
 
     car = models.ForeignKey(Car, on_delete=models.CASCADE, related_name="accidents")
-    img_path = models.FilePathField()
+    number = models.CharField(max_length=20, default=DEFAULT)
+    date = models.CharField(max_length=20, default=DEFAULT)
+    accident_type = models.CharField(max_length=100, default=DEFAULT)
+    region = models.CharField(max_length=100, default=DEFAULT)
+    damage_points = models.CharField(max_length=200, default=DEFAULT)
+    vehicle_count = models.CharField(max_length=3, default=DEFAULT)
+    # Скриншот необязателен, основная информация хранится в полях
+    img_path = models.FilePathField(null=True, default=None)
 
     class Meta:
         db_table = "accidents"
@@ -385,17 +524,23 @@ class Accident(CarInfo):
     def __str__(self):
         return f"ДТП с автомобилем {self.car.id}"
 
-    def _get_ru_names(self) -> Dict[str, str]:
+    def get_img_path(self) -> Optional[str]:
+        """Путь к файлу скриншота: img_path хранит ключ хранилища картинок (или старый путь)"""
+        # Хранилище картинок общее с ботом (папка - imagestore.IMAGES_DIR), подключается только при обращении
+        from data.appdata.imagestore import resolve_image_path
+        return resolve_image_path(self.img_path)
+
+    def _get_ru_names(self) -> Mapping[str, str]:
         """Получения русских названий свойств из описания"""
         return super()._get_ru_names()
 
-    def _get_en_names(self) -> Dict[str, str]:
+    def _get_en_names(self) -> Mapping[str, str]:
         """Получения русских названий свойств из описания"""
         return super()._get_en_names()
 
     def get_dictionary(self, translate: bool = False) -> Dict[str, str]:
         """Получение словаря всех данных"""
-        return super().get_dictionary()
+        return super().get_dictionary(translate)
 
     def load_from_json(self, dictionary: Dict[str, str], translate: bool = True):
         """Загрузка из json файла"""
@@ -417,17 +562,17 @@ class Fine(CarInfo):
     def __str__(self):
         return f"Штрафы {self.description}"
 
-    def _get_ru_names(self) -> Dict[str, str]:
+    def _get_ru_names(self) -> Mapping[str, str]:
         """Получения русских названий свойств из описания"""
         return super()._get_ru_names()
 
-    def _get_en_names(self) -> Dict[str, str]:
+    def _get_en_names(self) -> Mapping[str, str]:
         """Получения русских названий свойств из описания"""
         return super()._get_en_names()
 
     def get_dictionary(self, translate: bool = False) -> Dict[str, str]:
         """Получение словаря всех данных"""
-        return super().get_dictionary()
+        return super().get_dictionary(translate)
 
     def load_from_json(self, dictionary: Dict[str, str], translate: bool = True):
         """Загрузка из json файла"""
@@ -1,3 +1,768 @@
-from django.test import TestCase
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from importlib import import_module
+from io import BytesIO
+from threading import Event
+from types import SimpleNamespace
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
 
-# Create your tests here.
+from django.test import SimpleTestCase, TestCase
+from PIL import Image
+
+from data.appdata.carinfo import CarInfo, Accident, DEFAULT as CAR_DEFAULT
+from data.appdata.captchabroker import CaptchaBroker, parse_multi_get
+from data.appdata.carnumbers import normalize_number
+from data.appdata.driverpool import DriverPool, DriverPoolOptions
+from data.appdata.httpsession import HttpOptions, create_http_session
+from data.appdata.imagestore import ImageStore
+from data.appdata.inflight import InflightRegistry
+from data.appdata.localocr import CaptchaCollector, GlyphOcr, get_local_ocr, set_local_ocr
+from data.appdata.myparser import MyParser, ParserResults
+from data.appdata.scancache import CacheTtl, ScanCache, ScanStore, merge_scanned
+from data.appdata.scanexecutor import ScanExecutor
+from data.appdata.solvetime import SolveTimeEstimator
+from data.appdata.userstore import LegacyImporter, UserStore, iter_json_items
+from data.appdata.vin2vinclient import Vin2VinClient, get_captcha_url, remember_captcha_url
+from data.appdata.waits import is_gif
+from .botstore import BOT_RELATIONS, DjangoUserStore
+from .models import Car, Accident as AccidentModel, RegistrationHistory, VehicleLimits, DEFAULT
+from data.appdata.scanorchestrator import ScanSections, merge_car_info
+
+
+def make_car(vin: str = "XTA21099043583726", plate: str = "А123ВС", region: str = "77") -> CarInfo:
+    """Машина бота с vin номером и госномером"""
+    car_info = CarInfo()
+    car_info.vin_number = vin
+    car_info.license_number = plate
+    car_info.license_region = region
+    return car_info
+
+
+class MultiGetParsingTests(SimpleTestCase):
+    """Разбор ответа CapGuru на запрос нескольких id"""
+
+    def test_answers_in_order(self):
+        answers = parse_multi_get("abc12|CAPCHA_NOT_READY|ERROR_CAPTCHA_UNSOLVABLE", ["1", "2", "3"])
+        self.assertEqual(answers, {"1": "OK|abc12", "2": "CAPCHA_NOT_READY", "3": "ERROR_CAPTCHA_UNSOLVABLE"})
+
+    def test_single_id_reply_is_rejected(self):
+        # Ответ на запрос одного id тоже делится на две части
+        self.assertIsNone(parse_multi_get("OK|abc12", ["1", "2"]))
+
+    def test_count_mismatch_is_rejected(self):
+        self.assertIsNone(parse_multi_get("ERROR_WRONG_ID_FORMAT", ["1", "2"]))
+        self.assertIsNone(parse_multi_get("a|b|c", ["1", "2"]))
+
+    def test_empty_answer_is_rejected(self):
+        self.assertIsNone(parse_multi_get("abc12|", ["1", "2"]))
+
+
+class FakeCapGuru:
+    """Ответы res.php без сети: решение, ERROR_... или None - капча не готова"""
+
+    def __init__(self, multi_get: bool = True):
+        self.multi_get = multi_get
+        self.answers = {}
+        self.requests = []
+
+    def _answer(self, req_id: str, multi: bool) -> str:
+        answer = self.answers.get(req_id)
+        if answer is None:
+            return "CAPCHA_NOT_READY"
+        if answer.startswith("ERROR") or multi:
+            return answer
+        return f"OK|{answer}"
+
+    def get(self, url: str, timeout=None) -> SimpleNamespace:
+        query = parse_qs(urlparse(url).query)
+        self.requests.append(query)
+        if "ids" not in query:
+            return SimpleNamespace(ok=True, text=self._answer(query["id"][0], False))
+        if not self.multi_get:
+            return SimpleNamespace(ok=True, text="ERROR_WRONG_ID_FORMAT")
+        return SimpleNamespace(ok=True, text="|".join(self._answer(req_id, True)
+                                                      for req_id in query["ids"][0].split(",")))
+
+
+class CaptchaBrokerTests(SimpleTestCase):
+    """Опрос результатов капч общим брокером"""
+
+    def _broker(self, service: FakeCapGuru) -> CaptchaBroker:
+        estimator = SolveTimeEstimator(0.05, min_interval=0.01, max_interval=0.05)
+        patcher = mock.patch("data.appdata.captchabroker.get_estimator", return_value=estimator)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return CaptchaBroker("key", service, window=0.5)
+
+    def test_ready_captchas_are_polled_together(self):
+        service = FakeCapGuru()
+        service.answers = {"1": "abc", "2": "def"}
+        broker = self._broker(service)
+        first, second = broker.wait("1", deadline=5), broker.wait("2", deadline=5)
+        self.assertEqual((first.result(5), second.result(5)), ("abc", "def"))
+        self.assertEqual(service.requests[0]["ids"], ["1,2"])
+
+    def test_single_ids_after_multi_get_is_rejected(self):
+        service = FakeCapGuru(multi_get=False)
+        service.answers = {"1": "abc", "2": "ERROR_CAPTCHA_UNSOLVABLE"}
+        broker = self._broker(service)
+        first, second = broker.wait("1", deadline=5), broker.wait("2", deadline=5)
+        self.assertEqual((first.result(5), second.result(5)), ("abc", "-1"))
+        self.assertFalse(broker.multi_get)
+
+    def test_not_ready_captcha_fails_at_deadline(self):
+        service = FakeCapGuru()
+        broker = self._broker(service)
+        start = time.monotonic()
+        self.assertEqual(broker.wait("1", deadline=0.2).result(5), "-1")
+        self.assertLess(time.monotonic() - start, 2)
+        self.assertGreater(len(service.requests), 1)
+
+    def test_dispatch_keeps_not_ready_captcha(self):
+        broker = self._broker(FakeCapGuru())
+        future = broker.wait("1", deadline=60)
+        broker._dispatch(["1"], {"1": "CAPCHA_NOT_READY"})
+        self.assertFalse(future.done())
+        broker._dispatch(["1"], {"1": "OK|abc"})
+        self.assertEqual(future.result(0), "abc")
+        self.assertNotIn("1", broker._pending)
+
+
+class HttpSessionTests(SimpleTestCase):
+    """Повторы запросов к CapGuru"""
+
+    def test_submit_session_does_not_retry_after_sending(self):
+        session = create_http_session(HttpOptions(retries=3), submit=True)
+        retry = session.get_adapter("https://api.cap.guru/in.php").max_retries
+        self.assertEqual(retry.connect, 3)
+        self.assertEqual(retry.read, 0)
+        self.assertEqual(retry.other, 0)
+
+    def test_poll_session_retries_reads(self):
+        retry = create_http_session(HttpOptions(retries=3)).get_adapter("https://api.cap.guru/res.php").max_retries
+        self.assertEqual(retry.read, 3)
+
+
+class LocalOcrTests(SimpleTestCase):
+    """Сбор капч для обучения и загрузка моделей"""
+
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.root = folder.name
+        self.image = BytesIO()
+        Image.new("L", (40, 20), 255).save(self.image, "PNG")
+
+    def test_sample_is_saved_only_when_accepted(self):
+        collector = CaptchaCollector(self.root)
+        collector.hold(self.image.getvalue(), "ab12", "gibdd")
+        collector.discard("gibdd")
+        self.assertIsNone(collector.commit("gibdd"))
+        collector.hold(self.image.getvalue(), "cd34", "gibdd")
+        path = collector.commit("gibdd")
+        self.assertEqual(os.listdir(os.path.join(self.root, "gibdd")), [os.path.basename(path)])
+        self.assertTrue(os.path.basename(path).startswith("cd34_"))
+
+    def test_model_trained_later_is_loaded(self):
+        self.addCleanup(set_local_ocr, "test", None)
+        self.assertIsNone(get_local_ocr("test", self.root))
+        GlyphOcr({"a": ["01" * 96]}).save(os.path.join(self.root, "test.json"))
+        self.assertIsInstance(get_local_ocr("test", self.root), GlyphOcr)
+
+
+class GifPlaceholderTests(SimpleTestCase):
+    """Распознавание gif-заглушки вместо картинки капчи"""
+
+    def test_data_url_is_checked_by_mime_type(self):
+        self.assertTrue(is_gif("data:image/gif;base64,R0lGODlhAQABAAAAACw="))
+        self.assertFalse(is_gif("data:image/jpeg;base64,/9j/4AAQgifSkZJRgABAQ=="))
+
+    def test_url_is_checked_by_extension(self):
+        self.assertTrue(is_gif("https://xn--90adear.xn--p1ai/img/loading.GIF?v=2"))
+        self.assertFalse(is_gif("https://xn--90adear.xn--p1ai/captcha?gif=1"))
+
+
+class FillFromTablesTests(SimpleTestCase):
+    """Заполнение машины из текста таблиц vin2vin"""
+
+    def setUp(self):
+        self.parser = MyParser(car_info=make_car())
+        patcher = mock.patch("data.appdata.myparser.save_json")
+        self.save_json = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.parser.car_info.set_dictionary = mock.Mock()
+
+    def test_tables_are_merged(self):
+        tables = [[["VIN номер:", " XTA21099043583726 "], ["Заголовок"]],
+                  [[" Марка: ", "LADA"], ["Цвет", "Белый", "лишняя ячейка"]]]
+        self.assertEqual(self.parser._fill_from_tables(tables), ParserResults.Ok)
+        self.parser.car_info.set_dictionary.assert_called_once_with(
+            {"VIN номер": "XTA21099043583726", "Марка": "LADA", "Цвет": "Белый"})
+        self.save_json.assert_called_once()
+
+    def test_empty_vin_means_not_found(self):
+        self.assertEqual(self.parser._fill_from_tables([[["VIN номер", " "]]]), ParserResults.NotFound)
+        self.parser.car_info.set_dictionary.assert_not_called()
+
+    def test_default_vin_means_error(self):
+        self.assertEqual(self.parser._fill_from_tables([[["VIN номер", CAR_DEFAULT]]]), ParserResults.Error)
+
+    def test_failed_set_is_error_but_car_is_saved(self):
+        self.parser.car_info.set_dictionary.side_effect = ValueError("Incorrect value")
+        self.assertEqual(self.parser._fill_from_tables([[["Марка", "LADA"]]]), ParserResults.Error)
+        self.save_json.assert_called_once()
+
+
+class FakeVin2Vin:
+    """Ответы vin2vin без сети: страница с формой, картинка капчи и страница результата"""
+    page = """<form action="/history" method="post">
+        <input type="hidden" name="token" value="t1"><input id="exampleInputEmail2" name="vin">
+        <input id="exampleInputPassword2" name="code"><input type="checkbox" name="agree">
+        <button type="submit" name="go">Проверить</button></form>"""
+
+    def __init__(self, result: str):
+        self.result = result
+        self.posted = None
+
+    def get(self, url: str, headers=None, timeout=None) -> SimpleNamespace:
+        if url.startswith("https://vin2vin.ru/captcha"):
+            return SimpleNamespace(content=b"png", headers={"Content-Type": "image/png"}, raise_for_status=lambda: None)
+        return SimpleNamespace(text=self.page, raise_for_status=lambda: None)
+
+    def post(self, url: str, data=None, headers=None, timeout=None) -> SimpleNamespace:
+        self.posted = (url, data)
+        return SimpleNamespace(text=self.result, raise_for_status=lambda: None)
+
+
+class Vin2VinClientTests(SimpleTestCase):
+    """Проверка vin2vin без браузера"""
+
+    def setUp(self):
+        patcher = mock.patch("data.appdata.vin2vinclient._captcha_url", None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.solver = mock.Mock()
+        self.solver.submit_image.return_value.value.return_value = "ab12"
+        self.client = Vin2VinClient(self.solver)
+
+    def _fetch(self, result: str) -> FakeVin2Vin:
+        site = FakeVin2Vin(result)
+        with mock.patch.object(self.client, "_session", return_value=site):
+            self.tables = self.client.fetch_tables("https://vin2vin.ru/history", "XTA21099043583726")
+        return site
+
+    def test_captcha_url_is_taken_from_browser(self):
+        self.assertFalse(remember_captcha_url("https://vin2vin.ru/history", "data:image/png;base64,AAAA"))
+        self.assertFalse(remember_captcha_url("https://vin2vin.ru/history", "/img/loading.gif"))
+        self.assertIsNone(get_captcha_url())
+        self.assertTrue(remember_captcha_url("https://vin2vin.ru/history", "/captcha?r=0.5"))
+        self.assertEqual(get_captcha_url(), "https://vin2vin.ru/captcha?r=0.5")
+
+    def test_unknown_captcha_url_falls_back_without_requests(self):
+        site = self._fetch("")
+        self.assertIsNone(self.tables)
+        self.assertIsNone(site.posted)
+
+    def test_form_is_posted_and_tables_are_parsed(self):
+        remember_captcha_url("https://vin2vin.ru/history", "/captcha?r=0.5")
+        site = self._fetch("<table><tr><td>VIN номер:</td><td> XTA21099043583726 <br> </td></tr></table>")
+        self.assertEqual(self.tables, [[["VIN номер:", "XTA21099043583726"]]])
+        self.assertEqual(site.posted, ("https://vin2vin.ru/history",
+                                       {"token": "t1", "vin": "XTA21099043583726", "code": "ab12", "go": ""}))
+        self.solver.submit_image.assert_called_once_with(b"png", "vin2vin")
+        self.solver.collector.commit.assert_called_once_with("vin2vin")
+
+    def test_rejected_answer_is_not_kept(self):
+        remember_captcha_url("https://vin2vin.ru/history", "/captcha?r=0.5")
+        with self.assertRaises(Exception):
+            self._fetch("<p>Неверный код</p>")
+        self.solver.collector.discard.assert_called_once_with("vin2vin")
+
+
+class InflightRegistryTests(SimpleTestCase):
+    """Объединение одновременных проверок одной машины"""
+
+    def setUp(self):
+        self.registry = InflightRegistry()
+        self.release = Event()
+        self.addCleanup(self.release.set)
+        self.executor = ThreadPoolExecutor(max_workers=2)
+        self.addCleanup(self.executor.shutdown)
+        patcher = mock.patch("data.appdata.inflight.logging")
+        self.logging = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _leader(self, outcome):
+        """Работа первого запроса: ждёт release и возвращает outcome (или выбрасывает)"""
+        self.release.wait(5)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    def _run_pair(self, outcome):
+        """Первый запрос и второй, присоединившийся к нему до окончания работы"""
+        follower_func = mock.Mock(return_value="other")
+        leader = self.executor.submit(self.registry.run, "A123BC77", self._leader, outcome)
+        deadline = time.monotonic() + 5
+        while not self.registry.running("A123BC77") and time.monotonic() < deadline:
+            time.sleep(0.01)
+        follower = self.executor.submit(self.registry.run, "A123BC77", follower_func)
+        # Второй запрос пишет в лог, когда нашёл выполняющуюся работу
+        while not self.logging.info.called and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.release.set()
+        return leader, follower, follower_func
+
+    def test_follower_gets_leader_result(self):
+        leader, follower, follower_func = self._run_pair("done")
+        self.assertEqual(leader.result(5), "done")
+        self.assertEqual(follower.result(5), "done")
+        follower_func.assert_not_called()
+        self.assertFalse(self.registry.running("A123BC77"))
+
+    def test_follower_gets_leader_exception(self):
+        leader, follower, follower_func = self._run_pair(ValueError("Scan failed"))
+        with self.assertRaises(ValueError):
+            leader.result(5)
+        with self.assertRaises(ValueError):
+            follower.result(5)
+        follower_func.assert_not_called()
+        self.assertFalse(self.registry.running("A123BC77"))
+
+    def test_finished_key_runs_again(self):
+        func = mock.Mock(side_effect=[1, 2])
+        self.assertEqual(self.registry.run("A123BC77", func), 1)
+        self.assertEqual(self.registry.run("A123BC77", func), 2)
+        self.assertEqual(self.registry.run("XTA21099043583726", len, "abc"), 3)
+
+
+class ScanCacheTests(SimpleTestCase):
+    """Свежесть страниц и связи госномера в кэше результатов"""
+
+    def setUp(self):
+        ttl = CacheTtl(plate=100, sections={"History": 100, "Limits": 10})
+        self.cache = ScanCache(ttl, ScanStore(":memory:"))
+        self.car = make_car()
+
+    def test_only_scanned_sections_are_fresh(self):
+        self.cache.put(self.car, {ScanSections.History: ParserResults.Ok, ScanSections.Limits: ParserResults.Error})
+        cached = self.cache.get(self.car.vin_number)
+        self.assertEqual(self.cache.stale_sections(cached, [ScanSections.History, ScanSections.Limits]),
+                         [ScanSections.Limits])
+
+    def test_sections_expire_by_ttl(self):
+        now = time.time()
+        with mock.patch("data.appdata.scancache.time.time", return_value=now):
+            self.cache.put(self.car, {ScanSections.History: ParserResults.Ok,
+                                      ScanSections.Limits: ParserResults.NotFound})
+        cached = self.cache.get(self.car.vin_number)
+        with mock.patch("data.appdata.scancache.time.time", return_value=now + 50):
+            self.assertEqual(self.cache.stale_sections(cached, [ScanSections.History, ScanSections.Limits]),
+                             [ScanSections.Limits])
+
+    def test_plate_link_expires(self):
+        now = time.time()
+        with mock.patch("data.appdata.scancache.time.time", return_value=now):
+            self.cache.put(self.car, {}, plate_scanned=True)
+        with mock.patch("data.appdata.scancache.time.time", return_value=now + 50):
+            self.assertIsNotNone(self.cache.get("a123bc77"))
+        with mock.patch("data.appdata.scancache.time.time", return_value=now + 200):
+            self.assertIsNone(self.cache.get("А123ВС77"))
+            self.assertIsNotNone(self.cache.get(self.car.vin_number))
+
+    def test_older_scan_does_not_overwrite_newer(self):
+        store = self.cache.backend
+        store.save_scan(self.car, {"History": 10, "Limits": 1}, 5)
+        store.save_scan(self.car, {"History": 5, "Limits": 3}, 0)
+        _, scanned, plate_scanned = store.load_scan(self.car.vin_number)
+        self.assertEqual(scanned, {"History": 10, "Limits": 3})
+        self.assertEqual(plate_scanned, 5)
+
+    def test_each_get_returns_own_copy(self):
+        self.cache.put(self.car, {ScanSections.History: ParserResults.Ok})
+        self.assertIsNot(self.cache.get(self.car.vin_number).car_info, self.cache.get(self.car.vin_number).car_info)
+
+    def test_merge_scanned(self):
+        self.assertEqual(merge_scanned({"History": 5, "Limits": 1}, {"Limits": 3, "Accident": 2}),
+                         {"History": 5, "Limits": 3, "Accident": 2})
+
+
+class NormalizeNumberTests(SimpleTestCase):
+    """Нормализация номеров и её копия в миграции 0007"""
+
+    def test_plate_and_vin(self):
+        self.assertEqual(normalize_number("a 123-bc 77"), "А123ВС77")
+        self.assertEqual(normalize_number("хта21099043583726"), "XTA21099043583726")
+
+    def test_migration_copy_matches(self):
+        migration = import_module("carscan.migrations.0007_car_plate")
+        for number in ("a 123-bc 77", "А123ВС", "хта21099043583726", "XTA21099043583726"):
+            self.assertEqual(migration.normalize_number(number), normalize_number(number))
+
+
+class MergeCarInfoTests(SimpleTestCase):
+    """Объединение результатов проверки страниц"""
+
+    def test_found_values_are_copied(self):
+        target, source = make_car(), CarInfo()
+        source.license_region = "777"
+        merge_car_info(target, source)
+        self.assertEqual(target.license_region, "777")
+        # Ненайденные значения (DEFAULT) не затирают известные
+        self.assertEqual(target.vin_number, "XTA21099043583726")
+
+    def test_lists_are_extended_or_replaced(self):
+        target, source = make_car(), CarInfo()
+        target.accidents = [Accident()]
+        source.accidents = [Accident()]
+        merge_car_info(target, source)
+        self.assertEqual(len(target.accidents), 2)
+        merge_car_info(target, source, replace=True)
+        self.assertEqual(len(target.accidents), 1)
+
+    def test_empty_list_does_not_replace(self):
+        target, source = make_car(), CarInfo()
+        target.accidents = [Accident()]
+        source.accidents = []
+        merge_car_info(target, source, replace=True)
+        self.assertEqual(len(target.accidents), 1)
+
+
+class ScanExecutorTests(SimpleTestCase):
+    """Очередь проверок пользователей"""
+
+    def setUp(self):
+        self.executor = ScanExecutor(worker_count=1)
+        self.started = Event()
+        self.release = Event()
+        self.done = []
+        self.addCleanup(self.release.set)
+        self.assertEqual(self.executor.submit(1, self._block, 1), 0)
+        self.assertTrue(self.started.wait(5))
+
+    def _block(self, user_id: int) -> None:
+        """Проверка, которая держит поток до release"""
+        self.started.set()
+        self.release.wait(5)
+        self.done.append(user_id)
+
+    def test_queue_is_served_in_order(self):
+        self.assertEqual(self.executor.submit(2, self.done.append, 2), 1)
+        self.assertEqual(self.executor.submit(3, self.done.append, 3), 2)
+        self.assertEqual(self.executor.position(1), 0)
+        self.assertEqual(self.executor.position(3), 2)
+        self.release.set()
+        self.executor.shutdown(wait=True)
+        self.assertEqual(self.done, [1, 2, 3])
+
+    def test_cancel_removes_only_queued_scan(self):
+        self.executor.submit(2, self.done.append, 2)
+        self.executor.submit(3, self.done.append, 3)
+        self.assertFalse(self.executor.cancel(1))
+        self.assertTrue(self.executor.cancel(2))
+        self.assertFalse(self.executor.cancel(2))
+        self.assertIsNone(self.executor.position(2))
+        self.assertEqual(self.executor.position(3), 1)
+        self.release.set()
+        self.executor.shutdown(wait=True)
+        self.assertEqual(self.done, [1, 3])
+
+    def test_one_scan_per_user(self):
+        self.executor.submit(2, self.done.append, 2)
+        with self.assertRaises(RuntimeError):
+            self.executor.submit(2, self.done.append, 2)
+        with self.assertRaises(RuntimeError):
+            self.executor.submit(1, self.done.append, 1)
+
+    def test_place_matches_position_with_idle_workers(self):
+        executor = ScanExecutor(worker_count=2)
+        self.addCleanup(executor.shutdown, False, True)
+        places = [executor.submit(user_id, self.release.wait, 5) for user_id in range(10, 14)]
+        self.assertEqual(places, [0, 0, 1, 2])
+        deadline = time.monotonic() + 5
+        while executor.queued > 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual([executor.position(user_id) for user_id in range(10, 14)], places)
+
+    def test_shutdown_cancels_pending(self):
+        self.executor.submit(2, self.done.append, 2)
+        self.executor.submit(3, self.done.append, 3)
+        self.assertEqual(self.executor.shutdown(wait=False, cancel_pending=True), [2, 3])
+        self.release.set()
+        self.executor.shutdown(wait=True)
+        self.assertEqual(self.done, [1])
+        with self.assertRaises(RuntimeError):
+            self.executor.submit(4, self.done.append, 4)
+
+
+class FakeDriver:
+    """Драйвер без браузера для тестов пула"""
+
+    def __init__(self):
+        self.alive = True
+        self.closed = False
+
+    def execute_script(self, script: str):
+        if not self.alive:
+            raise RuntimeError("Browser is not responding")
+        return 1
+
+    def delete_all_cookies(self) -> None:
+        pass
+
+    def get(self, url: str) -> None:
+        pass
+
+    def quit(self) -> None:
+        self.closed = True
+
+
+class DriverPoolTests(SimpleTestCase):
+    """Выдача, перезапуск и закрытие драйверов пула"""
+
+    def _pool(self, **options) -> DriverPool:
+        self.drivers = []
+        pool = DriverPool(DriverPoolOptions(**options), self._create)
+        self.addCleanup(pool.close)
+        return pool
+
+    def _create(self) -> FakeDriver:
+        driver = FakeDriver()
+        self.drivers.append(driver)
+        return driver
+
+    def test_released_driver_is_reused(self):
+        pool = self._pool(min_size=0, max_size=2)
+        with pool.lease() as driver:
+            self.assertEqual(pool.size, 1)
+        with pool.lease() as again:
+            self.assertIs(again, driver)
+        self.assertEqual(len(self.drivers), 1)
+
+    def test_driver_is_recycled_after_max_uses(self):
+        pool = self._pool(min_size=0, max_uses=1)
+        with pool.lease() as driver:
+            pass
+        self.assertTrue(driver.closed)
+        self.assertEqual(pool.size, 0)
+
+    def test_dead_driver_is_discarded(self):
+        pool = self._pool(min_size=0, max_size=1)
+        with pool.lease() as driver:
+            pass
+        driver.alive = False
+        with pool.lease() as again:
+            self.assertIsNot(again, driver)
+        self.assertTrue(driver.closed)
+        self.assertEqual(pool.size, 1)
+
+    def test_acquire_times_out(self):
+        pool = self._pool(min_size=0, max_size=1)
+        driver = pool.acquire()
+        with self.assertRaises(TimeoutError):
+            pool.acquire(timeout=0.05)
+        pool.release(driver)
+        pool.release(pool.acquire(timeout=0.05))
+
+    def test_idle_drivers_are_reaped_without_acquire(self):
+        pool = self._pool(min_size=0, idle_timeout=0, reap_interval=0.01)
+        with pool.lease() as driver:
+            pass
+        deadline = time.monotonic() + 5
+        while pool.size and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(pool.size, 0)
+        self.assertTrue(driver.closed)
+
+
+class UserStoreTests(SimpleTestCase):
+    """Пользователи бота и их машины в SQLite"""
+
+    def setUp(self):
+        self.store = UserStore(":memory:")
+        self.addCleanup(self.store.close)
+
+    def test_user_cars_keep_order(self):
+        first, second = make_car(), make_car("WVWZZZ1JZXW000001", "В456ОР", "99")
+        self.store.add_user_car(1, first)
+        self.store.add_user_car(1, second)
+        self.store.add_user_car(1, first)
+        self.assertTrue(self.store.has_user(1))
+        self.assertEqual(self.store.user_count(), 1)
+        self.assertEqual([info["VIN номер"] for info in self.store.load_user_cars(1)],
+                         [first.vin_number, second.vin_number])
+
+    def test_car_is_shared_between_users(self):
+        car_info = make_car()
+        self.store.add_user_car(1, car_info)
+        self.store.add_user_car(2, car_info)
+        car_info.license_region = "777"
+        self.store.save_car(car_info)
+        for user_id in [1, 2]:
+            self.assertEqual(self.store.load_user_cars(user_id)[0]["Регион госномера"], "777")
+
+    def test_find_car_by_vin_or_plate(self):
+        self.store.save_car(make_car())
+        self.assertEqual(self.store.find_car("xta21099043583726")["VIN номер"], "XTA21099043583726")
+        # Госномер латиницей находит госномер, сохранённый кириллицей
+        self.assertEqual(self.store.find_car("A123BC77")["VIN номер"], "XTA21099043583726")
+        self.assertIsNone(self.store.find_car("А000АА00"))
+
+    def test_json_items_are_read_in_parts(self):
+        data = {"1": [{"VIN номер": "X{}"}], "2": [], "3": {"a": "}\",{"}}
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "users.json")
+            with open(path, "w", encoding="utf-8") as file:
+                json.dump(data, file, ensure_ascii=False, indent=2)
+            self.assertEqual(dict(iter_json_items(path, chunk_size=4)), data)
+
+    def test_number_split_between_parts(self):
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "users.json")
+            with open(path, "w", encoding="utf-8") as file:
+                file.write('{"1": 12345, "2": [1.5e10]}')
+            self.assertEqual(dict(iter_json_items(path, chunk_size=2)), {"1": 12345, "2": [1.5e10]})
+
+
+class LegacyImporterTests(SimpleTestCase):
+    """Перенос пользователей из json файла старых версий"""
+
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.folder = folder.name
+        self.store = UserStore(":memory:")
+        self.addCleanup(self.store.close)
+        self.legacy = make_car()
+        self.legacy.license_region = "99"
+        self._write({"1": [self.legacy.get_dictionary(True)], "2": []})
+
+    def _write(self, users: dict) -> None:
+        """Запись json файла старых версий"""
+        with open(os.path.join(self.folder, "users.json"), "w", encoding="utf-8") as file:
+            json.dump(users, file, ensure_ascii=False)
+
+    def _import(self) -> LegacyImporter:
+        """Перенос в текущем потоке"""
+        importer = LegacyImporter(self.store, folder=self.folder)
+        importer.run()
+        return importer
+
+    def test_users_are_imported_and_file_is_renamed(self):
+        importer = self._import()
+        self.assertEqual(importer.count, 2)
+        self.assertFalse(importer.running)
+        self.assertEqual(self.store.user_count(), 2)
+        self.assertEqual(self.store.load_user_cars(1)[0]["VIN номер"], self.legacy.vin_number)
+        self.assertEqual(os.listdir(self.folder), ["users.imported.json"])
+
+    def test_import_can_be_repeated(self):
+        # Прерванный перенос: файл остался, часть пользователей уже в базе
+        importer = LegacyImporter(self.store, folder=self.folder)
+        for key, cars in iter_json_items(importer.path):
+            self.store.import_user(int(key), cars)
+            break
+        self._import()
+        self.assertEqual(self.store.user_count(), 2)
+        self.assertEqual(len(self.store.load_user_cars(1)), 1)
+
+    def test_newer_car_is_not_overwritten(self):
+        scanned = make_car()
+        self.store.save_car(scanned)
+        self._import()
+        self.assertEqual(self.store.load_user_cars(1)[0]["Регион госномера"], scanned.license_region)
+
+    def test_each_imported_user_is_reported(self):
+        imported = []
+        importer = LegacyImporter(self.store, folder=self.folder,
+                                  on_import=lambda user_id: imported.append((user_id, self.store.has_user(user_id))))
+        importer.run()
+        self.assertEqual(imported, [(1, True), (2, True)])
+
+
+class DjangoUserStoreTests(TestCase):
+    """Пользователи бота и кэш результатов в базе сайта"""
+
+    def setUp(self):
+        self.store = DjangoUserStore()
+
+    def test_user_car_round_trip(self):
+        self.store.add_user_car(10, make_car("xta21099043583726"))
+        self.assertTrue(self.store.has_user(10))
+        self.assertEqual(self.store.user_count(), 1)
+        self.assertEqual([info["VIN номер"] for info in self.store.load_user_cars(10)], ["XTA21099043583726"])
+
+    def test_find_car_by_vin_or_plate(self):
+        self.store.save_car(make_car())
+        self.assertEqual(Car.objects.get().plate, "А123ВС77")
+        self.assertEqual(self.store.find_car("A123BC77")["VIN номер"], "XTA21099043583726")
+        self.assertEqual(self.store.find_car("XTA21099043583726")["Госномер"], "А123ВС")
+        self.assertIsNone(self.store.find_car("А000АА00"))
+
+    def test_scan_times_are_merged(self):
+        car_info = make_car()
+        self.store.save_scan(car_info, {"History": 10}, 5)
+        self.store.save_scan(car_info, {"History": 5, "Limits": 3}, 0)
+        info, scanned, plate_scanned = self.store.load_scan("А123ВС77")
+        self.assertEqual(info["VIN номер"], car_info.vin_number)
+        self.assertEqual(scanned, {"History": 10, "Limits": 3})
+        self.assertEqual(plate_scanned, 5)
+
+    def test_import_keeps_newer_car(self):
+        self.store.save_car(make_car())
+        legacy = make_car()
+        legacy.license_region = "99"
+        self.store.import_user(11, [legacy.get_dictionary(True)])
+        self.store.import_user(11, [legacy.get_dictionary(True)])
+        cars = self.store.load_user_cars(11)
+        self.assertEqual(len(cars), 1)
+        self.assertEqual(cars[0]["Регион госномера"], "77")
+
+    def test_bot_gets_only_known_relations(self):
+        self.store.save_car(make_car())
+        info = self.store.find_car("XTA21099043583726")
+        relations = set(Car.ru_names()[name] for name in Car._related_records)
+        self.assertEqual(relations & set(info), set(Car.ru_names()[name] for name in BOT_RELATIONS))
+
+
+class CarSerializeTests(TestCase):
+    """Словари машины по одной и запросом на несколько машин совпадают"""
+
+    def setUp(self):
+        self.car = Car.objects.create(vin_number="XTA21099043583726", license_number="А123ВС")
+        RegistrationHistory.objects.create(car=self.car, period="2010 - 2015", description="Физическое лицо")
+        RegistrationHistory.objects.create(car=self.car, period="2015 - н.в.", description="Юридическое лицо")
+        VehicleLimits.objects.create(car=self.car, description="Запрет на регистрационные действия")
+        Car.objects.create(vin_number="XTA21099043583727")
+
+    def test_serialize_matches_queryset(self):
+        for translate in (False, True):
+            self.assertEqual(Car.serialize_queryset(Car.objects.order_by("id"), translate),
+                             [car.serialize(translate) for car in Car.objects.order_by("id")])
+
+    def test_relation_subset(self):
+        relations = ("registration_history", "accidents")
+        info = self.car.serialize(relations=relations)
+        self.assertEqual(Car.serialize_queryset(Car.objects.filter(pk=self.car.pk), relations=relations), [info])
+        self.assertEqual([item["period"] for item in info["registration_history"]], ["2010 - 2015", "2015 - н.в."])
+        self.assertEqual(info["accidents"], DEFAULT)
+        self.assertNotIn("vehicle_limits", info)
+
+
+class AccidentImageTests(TestCase):
+    """Картинки дтп ищутся в том же хранилище, куда их сохраняет парсер"""
+
+    def test_key_is_resolved_by_shared_store(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        store = ImageStore(folder.name)
+        key = store.save(Image.new("RGB", (4, 4), "red"))
+        car = Car.objects.create(vin_number="XTA21099043583726")
+        accident = AccidentModel.objects.create(car=car, img_path=key)
+        with mock.patch("data.appdata.imagestore.get_image_store", return_value=store):
+            self.assertEqual(accident.get_img_path(), os.path.join(folder.name, key))
+        self.assertIsNone(AccidentModel(car=car).get_img_path())
@@ -7,11 +7,15 @@ from rest_framework import status
 from .serializers import *
 import logging
 import json
-from typing import Dict
+import time
+import threading
 from pprint import pprint
 
 # Глобальная переменная для хранения результата (не рекомендуется для production)
 results = {}
+# Параллельная проверка страниц, создаётся при первом запуске парсинга
+orchestrator = None
+orchestrator_lock = threading.Lock()
 
 # Create your views here.
 
@@ -51,12 +55,32 @@ def cars_detail(request, pk):
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-def parsing(param: Dict[str, str], seconds: int = 10):
-    """"""
-    # Имитация длительного процесса
-    time.sleep(seconds)
-    result = f'Процесс завершён. Получен параметр param1 со значением: {param}'
-    results[task_id] = result
+def parsing(number: str, task_id: str):
+    """Проверка автомобиля в отдельном потоке
+
+    :param number: vin номер или гос номер.
+    :param task_id: Идентификатор задачи для получения результата.
+    """
+    # Парсер подключается только при запуске проверки, драйверы и кэш общие с ботом
+    from data.appdata.driverpool import get_driver_pool
+    from data.appdata.scanorchestrator import ScanOrchestrator
+    from data.appdata.scancache import get_scan_cache
+    from .botstore import get_bot_store
+
+    global orchestrator
+    try:
+        with orchestrator_lock:
+            if orchestrator is None:
+                orchestrator = ScanOrchestrator(get_driver_pool())
+        # Результаты сохраняются в таблицу машин, общую с ботом
+        car_info, _ = orchestrator.scan_number(number, get_scan_cache(backend=get_bot_store()))
+        if car_info is None:
+            results[task_id] = 'По данному номеру не было найдено информации'
+        else:
+            results[task_id] = car_info.get_dictionary(True)
+    except Exception:
+        logging.error("Error appeared while parsing: ", exc_info=True)
+        results[task_id] = 'Во время проверки произошла ошибка'
 
 
 # @csrf_exempt
@@ -65,12 +89,12 @@ def parse(request):
     """"""
     if request.method == 'POST':
         data = json.loads(request.body)
-        param = data.get('param1', None)
+        param1 = data.get('param1', None)
         if param1:
             # Генерация уникального идентификатора задачи
             task_id = str(time.time())
             # Запуск длительного процесса в отдельном потоке
-            threading.Thread(target=long_running_task, args=(param1, task_id)).start()
+            threading.Thread(target=parsing, args=(param1.strip(), task_id)).start()
             response_data = {'message': 'Процесс запущен', 'task_id': task_id}
         else:
             response_data = {'message': 'Параметр param1 не найден в запросе'}
@@ -1,84 +1,112 @@
-import os.path
+import os
 import time
 from pprint import pprint
 
 import telebot
 import logging
-from typing import Dict, List, Union, Optional
+from typing import Dict, Union, Optional
 from telebot import types
-from queue import Queue
-from threading import Thread, current_thread, active_count
+from threading import Lock, current_thread
 
 from data.appdata.carinfo import CarInfo
-from data.appdata.myparser import ParserOptions, MyParser, ParserResults, DEFAULT
+from data.appdata.myparser import ParserOptions, ParserResults, DEFAULT
+from data.appdata.driverpool import DriverPoolOptions, get_driver_pool
+from data.appdata.scanorchestrator import ScanOrchestrator
+from data.appdata.scancache import get_scan_cache, normalize_number, car_plate
+from data.appdata.scanexecutor import ScanExecutor
+from data.appdata.imagestore import resolve_image_path
+from data.appdata.userstore import UserStore, LegacyImporter
 from data.appdata.user import User, UserStates
-from data.appdata.functions import save_json, load_json
+
+
+def create_user_store():
+    """Хранилище пользователей бота: база сайта, если задан DJANGO_SETTINGS_MODULE, иначе своя SQLite база"""
+    if os.environ.get("DJANGO_SETTINGS_MODULE"):
+        import django
+        django.setup()
+        from carscan.botstore import get_bot_store
+        return get_bot_store()
+    return UserStore()
 
 
 class ScanCarBot:
     """Телеграмм бот для проверки автомобилей"""
     _token: str = "***"
 
-    def __init__(self, parser_options: ParserOptions = ParserOptions(), thread_count: int = 3):
+    def __init__(self, parser_options: ParserOptions = ParserOptions(), thread_count: int = 3,
+                 pool_options: DriverPoolOptions = DriverPoolOptions(), store=None):
+        """
+        :param store: Хранилище пользователей (UserStore или DjangoUserStore). None - create_user_store().
+        """
         self.bot = telebot.TeleBot(self._token)
+        # Пользователи, загруженные из хранилища (при первом обращении)
         self.users: Dict[int, User] = {}
+        self._users_lock = Lock()
+        self.store = store if store is not None else create_user_store()
         self.parser_options = parser_options
+        self.driver_pool = get_driver_pool(pool_options, parser_options.browser_profile)
+        self.orchestrator = ScanOrchestrator(self.driver_pool, parser_options)
+        # С базой сайта кэш общий: машина, проверенная на сайте, сразу есть в боте
+        self.cache = get_scan_cache(backend=self.store.scan_backend())
+        # Индекс проверенных машин пользователей: vin номер и госномер -> машина
+        self._cars_by_vin: Dict[str, CarInfo] = {}
+        self._cars_by_plate: Dict[str, CarInfo] = {}
+        self._index_lock = Lock()
+        self._importer = LegacyImporter(self.store, on_import=self._user_imported)
         logging.info("Bot was started")
         self._load_users()
-        self.thread_queue: Queue[Thread] = Queue()
-        self.thread_count = thread_count
-        self.main_thread = Thread(target=self._start_thread)
-
-    def _get_free_thread_count(self) -> int:
-        """Получение количества свободных потоков"""
-        return self.thread_count - active_count()
-
-    def _start_thread(self):
-        """Проверка количества активных потоков и запуск новых"""
-        logging.info("The main thread was started")
-        while getattr(self.main_thread, "do_run", True):
-            free = self._get_free_thread_count()
-            for _ in range(free):
-                if not self.thread_queue.empty():
-                    self.thread_queue.get().start()
-        logging.info("The main thread was ended")
+        self.executor = ScanExecutor(thread_count)
 
     def _load_users(self):
-        """Загрузка пользователей из файла"""
-        logging.info("Start of loading users data")
-        if not os.path.isfile("data/json/users.json"):
+        """Запуск переноса пользователей из файла старых версий в хранилище
+
+        Перенос идёт в фоне, сами пользователи загружаются из хранилища при первом обращении."""
+        self._importer.start()
+        logging.info(f"Users in the store: {self.store.user_count()}")
+
+    def _user_imported(self, user_id: int) -> None:
+        """Добавление перенесённых машин пользователю, который уже загружен из хранилища
+
+        :param user_id: id перенесённого пользователя.
+        """
+        with self._users_lock:
+            user = self.users.get(user_id)
+        if user is None:
             return
-        users: Dict[int, List[dict]] = load_json("users")
-        for key, item in users.items():
-            user = User(id=key)
-            for info in item:
-                car_info = CarInfo()
-                car_info.load_from_json(info)
-                user.cars_info.append(car_info)
-                # pprint(car_info.get_dictionary(True))
-            self.users[int(key)] = user
-        logging.info("End of loading users data")
-
-    def _save_users(self):
-        """Сохранение данных пользователей в файл"""
-        logging.info("Start of saving users data")
-        users: Dict[int, List[dict]] = {}
-        for user in self.users.values():
-            info = []
-            for car in user.cars_info:
-                info.append(car.get_dictionary(True))
-            users[user.id] = info
-        save_json(users, "users")
-        logging.info("End of saving users data")
-
-    def _parser_invoke(self, parser_func) -> ParserResults:
-        """Запуск парсинга, пока есть ошибка
-
-        :param parser_func: Функция парсера для запуска."""
-        result = parser_func()
-        while result == ParserResults.Error:
-            result = parser_func()
-        return result
+        for info in self.store.load_user_cars(user_id):
+            self._add_user_car(user, self._car_from_json(info))
+
+    def _car_from_json(self, info: dict) -> CarInfo:
+        """Машина из хранилища: уже загруженная или новая
+
+        :param info: Словарь машины.
+        """
+        car_info = CarInfo()
+        car_info.load_from_json(info)
+        loaded = self._get_indexed_car(car_info.vin_number)
+        if loaded is not None:
+            return loaded
+        self._index_car(car_info)
+        return car_info
+
+    def _get_user(self, user_id: int) -> Optional[User]:
+        """Получение пользователя, при первом обращении - из хранилища
+
+        :param user_id: id пользователя.
+        :return: Пользователь. None - Если пользователь не подписан.
+        """
+        with self._users_lock:
+            user = self.users.get(user_id)
+        if user is not None:
+            return user
+        if not self.store.has_user(user_id):
+            # Пользователь из файла старых версий, до которого ещё не дошёл перенос, пока считается новым
+            return None
+        user = User(id=user_id)
+        for info in self.store.load_user_cars(user_id):
+            self._add_user_car(user, self._car_from_json(info))
+        with self._users_lock:
+            return self.users.setdefault(user_id, user)
 
     def _parse(self, message: types.Message) -> ParserResults:
         """Начало проверки автомобиля
@@ -88,26 +116,14 @@ class ScanCarBot:
         """
         number = message.text
         user_id = message.from_user.id
-        result = self._get_auto_by_number(number)
-        if result is None:
-            if len(number) == 17:
-                my_parser = MyParser(vin_number=number, options=self.parser_options)
-            else:
-                my_parser = MyParser(license_number=message.text, options=self.parser_options)
-            if my_parser.car_info.vin_number == DEFAULT:
-                if self._parser_invoke(my_parser.parse_vin) != ParserResults.Ok:
-                    my_parser.driver.quit()
-                    # my_parser.driver.close()
-                    return ParserResults.NotFound
-            self._parser_invoke(my_parser.parse_history)
-            self._parser_invoke(my_parser.parse_accident)
-            self.users[user_id].cars_info.append(my_parser.car_info)
-            # my_parser.driver.close()
-            return ParserResults.Ok
-        else:
-            if result.vin_number not in [info.vin_number for info in self.users[user_id].cars_info]:
-                self.users[user_id].cars_info.append(result)
-            return ParserResults.Skipped
+        # Свежие страницы берутся из кэша, устаревшие проверяются параллельно на своих драйверах
+        car_info, result = self.orchestrator.scan_number(number, self.cache)
+        if car_info is None:
+            return ParserResults.NotFound
+        self._add_user_car(self.users[user_id], car_info)
+        # Сохраняются только эта машина и её связь с пользователем
+        self.store.add_user_car(user_id, car_info)
+        return result
 
     def _check_data(self, message: str) -> bool:
         """Проверка данных введённых пользователем
@@ -122,19 +138,48 @@ class ScanCarBot:
         check_length = length not in [8, 9, 17]
         return not any([check_null, check_count, check_length])
 
+    def _index_car(self, car_info: CarInfo) -> None:
+        """Добавление машины в индекс по vin номеру и госномеру"""
+        plate = car_plate(car_info)
+        with self._index_lock:
+            if car_info.vin_number != DEFAULT:
+                self._cars_by_vin[normalize_number(car_info.vin_number)] = car_info
+            if plate is not None:
+                self._cars_by_plate[plate] = car_info
+
+    def _add_user_car(self, user: User, car_info: CarInfo) -> None:
+        """Добавление машины пользователю (если её ещё нет) и в индекс
+
+        :param user: Пользователь.
+        :param car_info: Проверенная машина.
+        """
+        if car_info.vin_number not in [info.vin_number for info in user.cars_info]:
+            user.cars_info.append(car_info)
+        # Данные машины могли обновиться (например, стал известен госномер)
+        self._index_car(car_info)
+
+    def _get_indexed_car(self, number: str) -> Optional[CarInfo]:
+        """Поиск машины в индексе загруженных машин
+
+        :param number: vin номер или гос номер.
+        """
+        number = normalize_number(number)
+        with self._index_lock:
+            car_info = self._cars_by_vin.get(number)
+            return car_info if car_info is not None else self._cars_by_plate.get(number)
+
     def _get_auto_by_number(self, number: str) -> Optional[CarInfo]:
         """Получение проверенного автомобиля по номеру
 
         :param number: vin номер или гос номер.
         :return: Информация о машине CarInfo, если она проверялась, иначе None.
         """
-        for user in self.users.values():
-            for car_info in user.cars_info:
-                vin = car_info.vin_number
-                license = car_info.license_number + car_info.license_region
-                if vin == number or license == number:
-                    return car_info
-        return None
+        car_info = self._get_indexed_car(number)
+        if car_info is None:
+            info = self.store.find_car(number)
+            if info is not None:
+                car_info = self._car_from_json(info)
+        return car_info
 
     def _get_message_info(self, car_info: CarInfo, number: str, parse_result: ParserResults) -> str:
         """Составление сообщение с информацией о автомобиле
@@ -154,7 +199,12 @@ class ScanCarBot:
                 message.append(f"*{key}*: {value}")
             elif type(value) is list:
                 if key == "Информация о ДТП":
-                    message.append(f"*{key}*: Фотографии")
+                    message.append(f"*{key}:*")
+                    for item in value:
+                        values = [str(v) for k, v in item.items()
+                                  if k not in ["img_path", "Путь к фотографии"] and v not in [None, DEFAULT]]
+                        if len(values) != 0:
+                            message.append(f"_\t{values[0]}_: {', '.join(values[1:])}")
                 elif key == "История регистрации":
                     message.append(f"*{key}:*")
                     for item in value:
@@ -181,10 +231,15 @@ class ScanCarBot:
             return
         message = self._get_message_info(car_info, number, parse_result)
         self.bot.send_message(user_id, message, parse_mode="Markdown")
-        if type(car_info.accidents) is list and len(car_info.accidents) != 0:
+        photos = []
+        if type(car_info.accidents) is list:
+            photos = [resolve_image_path(accident.img_path) for accident in car_info.accidents
+                      if accident.img_path not in [None, DEFAULT]]
+            photos = [path for path in photos if path is not None]
+        if len(photos) != 0:
             media = []
-            for photo_path in car_info.accidents:
-                media.append(types.InputMediaPhoto(open(photo_path.img_path, 'rb')))
+            for photo_path in photos:
+                media.append(types.InputMediaPhoto(open(photo_path, 'rb')))
             media[0].caption = "ДТП"
             self.bot.send_media_group(user_id, media)
             for photo in media:
@@ -199,7 +254,6 @@ class ScanCarBot:
             logging.info(f"New {current_thread().name} was started")
             result = self._parse(message)
             self._send_car_info(user_id, message.text, result)
-            self._save_users()
         except Exception:
             self.bot.send_message(user_id, "Во время проверки произошла ошибка. "
                                            "Пожалуйста попробуйте ещё раз.")
@@ -215,10 +269,11 @@ class ScanCarBot:
         def start(message: types.Message):
             """Начало общения с ботом"""
             user_id = message.from_user.id
-            if user_id not in self.users:
+            if self._get_user(user_id) is None:
                 logging.info(f"New user subscribed: {user_id}")
-                self.users[user_id] = User(id=user_id)
-                self._save_users()
+                self.store.add_user(user_id)
+                with self._users_lock:
+                    self.users.setdefault(user_id, User(id=user_id))
             self.bot.send_message(user_id, "Привет! Я бот для проверки машин. "
                                            "Введите /scancar чтобы начать проверку автомобиля.")
 
@@ -226,7 +281,7 @@ class ScanCarBot:
         def scan_car(message):
             """Запрос на сканирование машины"""
             user_id = message.from_user.id
-            user = self.users.get(user_id)
+            user = self._get_user(user_id)
             if user:
                 if user.state != UserStates.WaitForResult:
                     logging.info(f"User id{user_id} start scanning")
@@ -236,27 +291,52 @@ class ScanCarBot:
                     # Устанавливаем состояние ожидания номера автомобиля
                     user.state = UserStates.WritingCarNumber
                 elif user.state == UserStates.WaitForResult:
+                    position = self.executor.position(user_id)
+                    queue_info = f" Ваше место в очереди: {position}." if position else ""
                     self.bot.send_message(user_id, "Извините, вы уже запустили данную функцию. "
-                                                   "Пожалуйста, дождитесь окончания процесса.")
+                                                   f"Пожалуйста, дождитесь окончания процесса.{queue_info}")
             else:
                 self.bot.reply_to(message, 'Чтобы начать проверку машины, сначала введите команду /start.')
 
+        @self.bot.message_handler(commands=["cancel"])
+        def cancel(message):
+            """Отмена проверки, которая ещё ждёт в очереди"""
+            user_id = message.from_user.id
+            user = self._get_user(user_id)
+            if user and self.executor.cancel(user_id):
+                user.state = UserStates.Nothing
+                self.bot.reply_to(message, "Проверка отменена.")
+            elif user and user.state == UserStates.WaitForResult:
+                self.bot.reply_to(message, "Проверка уже началась, её нельзя отменить.")
+            else:
+                if user and user.state == UserStates.WritingCarNumber:
+                    user.state = UserStates.Nothing
+                self.bot.reply_to(message, "Нет проверки для отмены.")
+
         @self.bot.message_handler(commands=["getcar"])
         def get_car(message):
             """Запрос на получение информации об уже отсканированных машин"""
             user_id = message.from_user.id
-            user = self.users.get(user_id)
+            user = self._get_user(user_id)
             if user:
-                car_parameter = message.text.split("/getcar ", 1)[1]
-                # Здесь должен быть код для получения машины с указанными параметрами
-                self.bot.reply_to(message, f"Машина с параметром '{car_parameter}': ...")
+                params = message.text.split(maxsplit=1)
+                if len(params) < 2 or not self._check_data(params[1]):
+                    self.bot.reply_to(message, "Укажите гос номер или vin номер машины, например: "
+                                               "/getcar А123БВ123.")
+                    return
+                car_parameter = params[1].strip()
+                if self._get_auto_by_number(car_parameter) is None:
+                    self.bot.reply_to(message, f"Машина с номером {car_parameter} ещё не проверялась. "
+                                               f"Введите /scancar чтобы проверить её.")
+                    return
+                self._send_car_info(user_id, car_parameter, ParserResults.Skipped)
             else:
                 self.bot.reply_to(message, "Чтобы получить информацию о машине, сначала введите команду /start.")
 
         @self.bot.message_handler(func=lambda message: True)
         def handle_message(message):
             user_id = message.from_user.id
-            user = self.users.get(user_id)
+            user = self._get_user(user_id)
             if user and user.state == UserStates.WritingCarNumber:
                 car_number = message.text
                 if not self._check_data(car_number):
@@ -264,23 +344,46 @@ class ScanCarBot:
                                                    "Введите гос номер автомобиля (например, А123БВ123) или "
                                                    "vin номер (A0B001023C4506789).")
                 else:
-                    if self._get_free_thread_count() == 0:
-                        self.bot.send_message(user_id, "Вас запрос находиться в очереди. "
-                                                       "Вам придёт сообщение, когда проверка начнётся.")
                     user.state = UserStates.WaitForResult
                     # if result == ParserResults.Ok:
                     #     self._send_car_info(user_id, car_number)
                     #     self._save_users()
                     # else:
                     #     self.bot.send_message(user_id, "К сожалению, по данному номеру не было найдено информации.")
-                    self.thread_queue.put(Thread(target=self._parsing, args=(message, )))
+                    try:
+                        position = self.executor.submit(user_id, self._parsing, message)
+                    except RuntimeError:
+                        logging.error("Scan wasn't queued", exc_info=True)
+                        user.state = UserStates.Nothing
+                        self.bot.send_message(user_id, "Не удалось начать проверку. Пожалуйста попробуйте ещё раз.")
+                        return
+                    if position != 0:
+                        self.bot.send_message(user_id, f"Ваш запрос находится в очереди, место: {position}. "
+                                                       "Вам придёт сообщение, когда проверка начнётся. "
+                                                       "Отменить проверку: /cancel.")
             else:
                 self.bot.reply_to(message, 'Извините, я не понимаю команду. Введите /start чтобы начать.')
 
-        self.main_thread.start()
-        self.thread_count += active_count() + 1
-        self.bot.infinity_polling()
+        self.driver_pool.warm_up()
+        try:
+            self.bot.infinity_polling()
+        finally:
+            self.stop()
+
+    def stop(self, wait: bool = True):
+        """Остановка бота: проверки в очереди отменяются, начатые - доводятся до конца
 
-    def __del__(self, instance):
-        """"""
-        self.main_thread.do_run = False
+        :param wait: Ждать окончания начатых проверок.
+        """
+        self.bot.stop_polling()
+        for user_id in self.executor.shutdown(wait=False, cancel_pending=True):
+            self.users[user_id].state = UserStates.Nothing
+            try:
+                self.bot.send_message(user_id, "Бот перезапускается, проверка отменена. "
+                                               "Пожалуйста попробуйте позже.")
+            except Exception:
+                logging.warning(f"User id{user_id} wasn't notified about cancel", exc_info=True)
+        if wait:
+            self.executor.shutdown(wait=True)
+        self.orchestrator.shutdown()
+        self.driver_pool.close()